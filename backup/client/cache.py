@@ -0,0 +1,152 @@
+from collections import namedtuple
+import sqlite3
+from threading import Lock
+import time
+
+CachedResponse = namedtuple('CachedResponse',
+                            ['etag', 'last_modified', 'body', 'stored_at'])
+
+
+class ResponseCache:
+
+    def __init__(self, db_file, max_size=256 * 1024 * 1024, max_age=0):
+        """
+        An on-disk cache of response bodies, along with the validators needed
+        to ask E-Democracy whether they have changed. Responses are kept in
+        their own SQLite database, apart from the backup. Once the bodies
+        held exceed max_size bytes, the least recently used responses are
+        evicted. Safe to share between threads.
+
+        :param db_file: Path to the database to keep responses in
+        :param max_size: Most bytes of response bodies to keep
+        :param max_age: Seconds after being stored or revalidated that a
+                        response is used without asking E-Democracy whether
+                        it has changed
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = Lock()
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        # Losing the last few writes to a cache is harmless, so don't pay for
+        # an fsync on each of them.
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.execute('''
+        CREATE TABLE IF NOT EXISTS
+        responses
+        (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body TEXT,
+         size INTEGER, stored_at REAL, used_at REAL)
+        ''')
+        self.db.execute('''
+        CREATE INDEX IF NOT EXISTS response_used_at ON responses (used_at)
+        ''')
+        self.db.commit()
+        self.size = self.db.execute('''
+        SELECT coalesce(sum(size), 0) FROM responses
+        ''').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def get(self, url):
+        """
+        Fetches the cached response of the provided URL.
+
+        :param url: URL the response was fetched from
+        :returns: CachedResponse, or None if the URL has no cached response
+        """
+        with self.lock:
+            row = self.db.execute('''
+            SELECT etag, last_modified, body, stored_at
+            FROM responses
+            WHERE url = ?
+            ''', (url,)).fetchone()
+            if row is None:
+                return None
+
+            self.db.execute('''
+            UPDATE responses SET used_at = ? WHERE url = ?
+            ''', (time.time(), url))
+            self.db.commit()
+            return CachedResponse(*row)
+
+    def is_fresh(self, response):
+        """
+        :param response: CachedResponse to check
+        :returns: True if the response may be used without revalidating it
+        """
+        return time.time() - response.stored_at < self.max_age
+
+    def validators(self, response):
+        """
+        :param response: CachedResponse to revalidate, or None
+        :returns: Dict of headers making a request conditional on the
+                  response having changed
+        """
+        headers = {}
+        if response is not None:
+            if response.etag:
+                headers['If-None-Match'] = response.etag
+            if response.last_modified:
+                headers['If-Modified-Since'] = response.last_modified
+        return headers
+
+    def put(self, url, etag, last_modified, body):
+        """
+        Caches a response, replacing any already cached for the URL. Responses
+        without validators are only kept if they may be used without
+        revalidating.
+
+        :param url: URL the response was fetched from
+        :param etag: ETag header of the response, if any
+        :param last_modified: Last-Modified header of the response, if any
+        :param body: Text of the response
+        """
+        if not (etag or last_modified or self.max_age):
+            return
+
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('''
+            SELECT size FROM responses WHERE url = ?
+            ''', (url,)).fetchone()
+            self.size -= row[0] if row else 0
+
+            size = len(body.encode('utf-8'))
+            self.db.execute('''
+            INSERT OR REPLACE into responses values(?, ?, ?, ?, ?, ?, ?)
+            ''', (url, etag, last_modified, body, size, now, now))
+            self.size += size
+            self._evict()
+            self.db.commit()
+
+    def refresh(self, url):
+        """
+        Marks the cached response of the URL as just revalidated.
+
+        :param url: URL the response was fetched from
+        """
+        with self.lock:
+            self.db.execute('''
+            UPDATE responses SET stored_at = ? WHERE url = ?
+            ''', (time.time(), url))
+            self.db.commit()
+
+    def _evict(self):
+        while self.size > self.max_size:
+            rows = self.db.execute('''
+            SELECT url, size FROM responses ORDER BY used_at LIMIT 100
+            ''').fetchall()
+            for url, size in rows:
+                if self.size <= self.max_size:
+                    break
+                self.db.execute('''
+                DELETE FROM responses WHERE url = ?
+                ''', (url,))
+                self.size -= size
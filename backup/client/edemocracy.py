@@ -1,8 +1,15 @@
-from bs4 import BeautifulSoup
+import aiohttp
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
 import json
 import logging
-import re
+import random
 import requests
+from threading import Condition, Lock
+import time
+
+from backup.client.parsers import SoupListingParser
 
 BASE_URL = 'http://forums.e-democracy.org'
 
@@ -17,19 +24,435 @@ class EDemocracyLoginException(Exception):
     pass
 
 
+class TokenBucket:
+
+    def __init__(self, rate, burst=1):
+        """
+        A token bucket allowing an average of `rate` takes per second, and up
+        to `burst` takes at once after a quiet period. Safe to share between
+        threads.
+
+        :param rate: Tokens added to the bucket per second
+        :param burst: Most tokens the bucket can hold
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def reserve(self):
+        """
+        Takes a token from the bucket. If the bucket is empty, the token is
+        taken from those that will be added next, and the caller must wait
+        for it.
+
+        :returns: Seconds to wait before the token may be used
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_take(self):
+        """
+        Takes a token from the bucket, only if one is there to take now.
+
+        :returns: True if a token was taken
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+
+    def __init__(self, rate=None, burst=1, endpoints=None):
+        """
+        Limits the rate of requests made to E-Democracy, both in total and to
+        individual endpoints. A single limiter is shared by every client of a
+        sync, so limits apply across all of its workers.
+
+        :param rate: Requests per second to all endpoints together, or None
+                     for no overall limit
+        :param burst: Requests that may be made at once to all endpoints
+                      together after a quiet period
+        :param endpoints: Dict of endpoint names, such as 'mbox', to
+                          (rate, burst) tuples limiting just that endpoint
+        """
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.endpoints = {
+            endpoint: TokenBucket(endpoint_rate, endpoint_burst)
+            for endpoint, (endpoint_rate, endpoint_burst)
+            in (endpoints or {}).items()
+        }
+
+    @staticmethod
+    def parse_endpoints(text):
+        """
+        Parses per endpoint limits from text of the form
+        'mbox=5:10,profile=2', where each endpoint's rate may be followed by
+        a burst size, which otherwise defaults to 1.
+
+        :param text: Text of the per endpoint limits
+        :returns: Dict of endpoint names to (rate, burst) tuples
+        :raises ValueError: If a limit is malformed, or its rate is not above
+                            0 or its burst below 1
+        """
+        endpoints = {}
+        for limit in filter(None, (text or '').split(',')):
+            endpoint, _, rate = limit.strip().partition('=')
+            rate, _, burst = rate.partition(':')
+            rate, burst = float(rate), int(burst or 1)
+            if not rate > 0 or burst < 1:
+                raise ValueError("Invalid rate limit of endpoint %s: %s" %
+                                 (endpoint, limit.strip()))
+            endpoints[endpoint] = (rate, burst)
+        return endpoints
+
+    def reserve(self, endpoint):
+        """
+        Reserves a request to the named endpoint.
+
+        :param endpoint: Name of the endpoint to be requested
+        :returns: Seconds to wait before making the request
+        """
+        delays = [bucket.reserve()
+                  for bucket in (self.bucket, self.endpoints.get(endpoint))
+                  if bucket is not None]
+        return max(delays) if delays else 0
+
+    def wait(self, endpoint):
+        """
+        Blocks until a request to the named endpoint may be made.
+
+        :param endpoint: Name of the endpoint to be requested
+        """
+        delay = self.reserve(endpoint)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RetryPolicy:
+
+    def __init__(self, retries=0, base_delay=0.5, max_delay=60,
+                 statuses=(429, 500, 502, 503, 504)):
+        """
+        Decides whether, and after how long, a failed request is retried.
+        Delays grow exponentially with each attempt, with full jitter so that
+        workers that failed together don't retry together. A Retry-After
+        header sent with the failure is honored instead, up to max_delay.
+
+        :param retries: Most times a request is retried after its first
+                        attempt
+        :param base_delay: Most seconds to wait before the first retry
+        :param max_delay: Most seconds to wait before any retry
+        :param statuses: Response statuses that are retried. Connection
+                         errors and timeouts are always retried.
+        """
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.statuses = statuses
+
+    def should_retry(self, attempt, status):
+        """
+        :param attempt: Number of attempts made so far, starting from 1
+        :param status: Status of the last attempt, or None if it raised
+        :returns: True if the request should be attempted again
+        """
+        return attempt <= self.retries and \
+            (status is None or status in self.statuses)
+
+    def delay(self, attempt, retry_after=None):
+        """
+        :param attempt: Number of attempts made so far, starting from 1
+        :param retry_after: Value of the Retry-After header of the last
+                            attempt, if any
+        :returns: Seconds to wait before the next attempt
+        """
+        if retry_after is not None:
+            try:
+                seconds = float(retry_after)
+            except ValueError:
+                try:
+                    seconds = parsedate_to_datetime(retry_after).timestamp() \
+                        - time.time()
+                except (TypeError, ValueError):
+                    seconds = None
+            if seconds is not None:
+                return min(self.max_delay, max(0, seconds))
+
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+
+    def __init__(self, window=60, min_requests=20, threshold=0.5,
+                 cooldown=60):
+        """
+        Pauses every request to E-Democracy once too many recent requests
+        have failed, giving the site time to recover rather than spending
+        requests that are likely to fail. A single breaker is shared by every
+        client of a sync, so it pauses all of its workers together.
+
+        The breaker opens once at least `threshold` of the requests completed
+        within the last `window` seconds failed, counting only once there
+        have been `min_requests` of them. Requests then wait until `cooldown`
+        seconds have passed, after which they are let through again and
+        judged afresh.
+
+        :param window: Seconds of recent requests to judge the error rate by
+        :param min_requests: Fewest recent requests to judge the error rate by
+        :param threshold: Fraction of recent requests that must fail to open
+                          the breaker
+        :param cooldown: Seconds to pause requests for once open
+        """
+        self.window = window
+        self.min_requests = min_requests
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.outcomes = deque()
+        self.failures = 0
+        self.opened_until = 0
+        self.lock = Lock()
+
+    def observe(self, endpoint, status):
+        """
+        Records the outcome of a request.
+
+        :param endpoint: Name of the endpoint requested
+        :param status: Status of the response, or None if the request raised
+        """
+        failed = status is None or status == 429 or status >= 500
+        with self.lock:
+            now = time.monotonic()
+            self.outcomes.append((now, failed))
+            self.failures += failed
+            while self.outcomes[0][0] < now - self.window:
+                self.failures -= self.outcomes.popleft()[1]
+
+            if len(self.outcomes) >= self.min_requests and \
+                    self.failures >= self.threshold * len(self.outcomes):
+                logger.warning(
+                    "%i of the last %i requests failed, pausing requests "
+                    "for %is" % (self.failures, len(self.outcomes),
+                                 self.cooldown))
+                self.opened_until = now + self.cooldown
+                self.outcomes.clear()
+                self.failures = 0
+
+    def wait_time(self):
+        """
+        :returns: Seconds until requests may be made again, or 0 if they may
+                  be made now
+        """
+        return max(0, self.opened_until - time.monotonic())
+
+    def wait(self):
+        """
+        Blocks until requests may be made.
+        """
+        delay = self.wait_time()
+        while delay > 0:
+            time.sleep(delay)
+            delay = self.wait_time()
+
+
+class ConcurrencyLimiter:
+    # Notes on the limit:
+    # - the limit is raised additively, by one request per round of `limit`
+    #   requests that succeed while latency is steady, and cut
+    #   multiplicatively when a request fails with a 429, a 5xx or a
+    #   connection error, or when latency rises well above its baseline;
+    # - the baseline is the lowest smoothed latency seen, and drifts slowly
+    #   upwards so that a lasting change in the site's speed is accepted
+    #   rather than backed off from forever;
+    # - the limit is cut at most once per `cooldown` seconds, so a burst of
+    #   failures among requests already in flight counts as one;
+    # - callers waiting for a slot sleep until a release frees one, threads
+    #   on a condition and coroutines on a future of their own event loop,
+    #   rather than polling for it.
+    def __init__(self, minimum=1, maximum=100, initial=None, tolerance=2.0,
+                 backoff=0.5, cooldown=1.0):
+        """
+        Adapts the number of requests to E-Democracy that may be in flight at
+        once to how well the site is coping with them. A single limiter is
+        shared by every client of a sync, so it limits all of its workers
+        together.
+
+        :param minimum: Fewest requests to allow in flight
+        :param maximum: Most requests to allow in flight
+        :param initial: Requests to allow in flight at first. Defaults to a
+                        tenth of maximum.
+        :param tolerance: Times its baseline that smoothed latency may rise
+                          to before the limit is cut
+        :param backoff: Fraction of the limit kept when it is cut
+        :param cooldown: Fewest seconds between cuts of the limit
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(initial or max(minimum, maximum // 10))
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.cut_at = 0
+        self.lock = Lock()
+        self.slot_freed = Condition(self.lock)
+        # (loop, future) of every coroutine waiting for a slot
+        self.async_waiters = deque()
+
+    def acquire(self):
+        """
+        Blocks until a slot for a request is free, and takes it.
+        """
+        with self.slot_freed:
+            while not self._take():
+                self.slot_freed.wait()
+
+    async def acquire_async(self):
+        """
+        Waits until a slot for a request is free, and takes it.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            with self.lock:
+                if self._take():
+                    return
+                waiter = (loop, loop.create_future())
+                self.async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                # Pass on a wake this coroutine will no longer act on
+                with self.lock:
+                    if waiter in self.async_waiters:
+                        self.async_waiters.remove(waiter)
+                    else:
+                        self._wake()
+                raise
+
+    def _take(self):
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def _wake(self):
+        """
+        Wakes as many waiting callers as there are free slots. Each takes a
+        slot if one is still free when it runs, or waits again.
+        """
+        free = int(self.limit) - self.in_flight
+        if free <= 0:
+            return
+        self.slot_freed.notify(free)
+        for _ in range(min(free, len(self.async_waiters))):
+            loop, future = self.async_waiters.popleft()
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def release(self, status, latency):
+        """
+        Frees the slot of a finished request, and adapts the limit to how it
+        went.
+
+        :param status: Status of the response, or None if the request raised
+        :param latency: Seconds the request took
+        """
+        failed = status is None or status == 429 or status >= 500
+        with self.lock:
+            self.in_flight -= 1
+            if not failed:
+                self.latency = latency if self.latency is None else \
+                    0.9 * self.latency + 0.1 * latency
+                self.baseline = self.latency if self.baseline is None else \
+                    min(self.baseline * 1.001, self.latency)
+
+            if failed or self.latency > self.tolerance * self.baseline:
+                now = time.monotonic()
+                if now - self.cut_at >= self.cooldown:
+                    self.cut_at = now
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    logger.info("Cut concurrency to %i after %s" %
+                                (self.limit, 'a failed request' if failed
+                                 else 'latency rose to %.2fs' % self.latency))
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._wake()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
 class EDemocracyClient:
 
-    def __init__(self, client=None):
+    def __init__(self, client=None, rate_limiter=None, retry_policy=None,
+                 circuit_breaker=None, cache=None, parser=None,
+                 concurrency_limiter=None, metrics=None, base_url=None):
         """
         A Client used to fetch data from the E-Democracy forums.
-        If another instance of this client is provided, it's server session
-        will also be used by the newly created client.
+        If another instance of this client is provided, it's server session,
+        rate limiter, retry policy, circuit breaker, cache, parser,
+        concurrency limiter, metrics and base URL will also be used by the
+        newly created client.
 
         :param client: An existing client to use the server session of
+        :param rate_limiter: RateLimiter to draw from before every request.
+                             Requests are not limited if neither this nor
+                             client is provided.
+        :param retry_policy: RetryPolicy deciding when failed GET and HEAD
+                             requests are retried. Requests are not retried if
+                             neither this nor client is provided.
+        :param circuit_breaker: CircuitBreaker to pause requests with while
+                                too many are failing, if any
+        :param cache: ResponseCache to revalidate JSON responses with, if any.
+                      Closed along with this client, unlike a cache used
+                      from client.
+        :param parser: ListingParser to scrape HTML pages with. Defaults to a
+                       SoupListingParser.
+        :param concurrency_limiter: ConcurrencyLimiter to take a slot from
+                                    for every request, if any
+
+        :param metrics: Metrics to record every request in, if any
+        :param base_url: URL of the site to sync from. Defaults to the
+                         E-Democracy forums.
         """
         self.session = requests.Session()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker
+        self.cache = cache
+        self.owns_cache = cache is not None
+        self.parser = parser or SoupListingParser()
+        self.concurrency_limiter = concurrency_limiter
+        self.metrics = metrics
+        self.base_url = base_url or BASE_URL
         if client is not None:
             self.session.cookies = client.session.cookies.copy()
+            self.rate_limiter = rate_limiter or client.rate_limiter
+            self.retry_policy = retry_policy or client.retry_policy
+            self.circuit_breaker = circuit_breaker or client.circuit_breaker
+            self.cache = cache or client.cache
+            self.parser = parser or client.parser
+            self.concurrency_limiter = concurrency_limiter or \
+                client.concurrency_limiter
+            self.metrics = metrics or client.metrics
+            self.base_url = base_url or client.base_url
 
     def __enter__(self):
         return self
@@ -39,13 +462,86 @@ class EDemocracyClient:
 
     def close(self):
         self.session.close()
+        if self.owns_cache:
+            self.cache.close()
+
+    def _request(self, endpoint, method, url, **kwargs):
+        retry_policy = self.retry_policy if method in ('GET', 'HEAD') \
+            else RetryPolicy()
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.wait()
+            self.rate_limiter.wait(endpoint)
+
+            if self.concurrency_limiter is not None:
+                self.concurrency_limiter.acquire()
+            started = time.monotonic()
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                failure = e
+            finally:
+                latency = time.monotonic() - started
+                status = response.status_code if response is not None \
+                    else None
+                if self.concurrency_limiter is not None:
+                    self.concurrency_limiter.release(status, latency)
+
+            if self.metrics is not None:
+                # Streamed bodies are counted by whoever reads them
+                self.metrics.observe(
+                    endpoint, status, latency,
+                    len(response.content) if response is not None and
+                    not kwargs.get('stream') else 0)
+
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.observe(endpoint, status)
+
+            if not retry_policy.should_retry(attempt, status):
+                if response is None:
+                    raise failure
+                return response
+
+            delay = retry_policy.delay(
+                attempt,
+                response.headers.get('Retry-After')
+                if response is not None else None)
+            if response is not None:
+                response.close()
+            logger.warning("Request to %s failed with %s, retrying in %.1fs" %
+                           (url, status or failure, delay))
+            time.sleep(delay)
+
+    def _get_json(self, endpoint, url, error):
+        cached = self.cache.get(url) if self.cache is not None else None
+        if cached is not None and self.cache.is_fresh(cached):
+            return json.loads(cached.body)
+
+        res = self._request(endpoint, 'GET', url,
+                            headers=self.cache.validators(cached)
+                            if cached is not None else None)
+        if res.status_code == 304 and cached is not None:
+            self.cache.refresh(url)
+            return json.loads(cached.body)
+        if res.status_code != 200:
+            raise EDemocracyClientException(error)
+
+        if self.cache is not None:
+            self.cache.put(url, res.headers.get('ETag'),
+                           res.headers.get('Last-Modified'), res.text)
+        return json.loads(res.text)
 
     def login(self, username, password):
         logger.info("Logging In")
-        response = self.session.post('%s/login.html' % BASE_URL, {
-            'login': username,
-            'password': password
-        }, allow_redirects=False)
+        response = self._request('login', 'POST',
+                                 '%s/login.html' % self.base_url,
+                                 data={
+                                     'login': username,
+                                     'password': password
+                                 }, allow_redirects=False)
 
         if response.status_code not in [302, 200]:
             raise EDemocracyClientException(
@@ -58,13 +554,14 @@ class EDemocracyClient:
 
     def logout(self):
         logger.info("Logging Out")
-        self.session.get('%s/logout.html' % BASE_URL)
+        self._request('logout', 'GET', '%s/logout.html' % self.base_url)
 
     def whoami(self):
         """
         :returns: Username of the logged in user, or None if not logged in.
         """
-        profile = self.session.head('%s/p/' % BASE_URL)
+        profile = self._request('whoami', 'HEAD', '%s/p/' % self.base_url,
+                                allow_redirects=False)
         if profile.status_code != 302:
             raise EDemocracyClientException(
                 'Problem retrieving logged in username from E-Democracy')
@@ -78,42 +575,28 @@ class EDemocracyClient:
         """Fetches the list of currently available groups from the E-Democracy
         group list."""
 
-        links_page = self.session \
-                         .get('%s/groups/' % BASE_URL)
+        links_page = self._request('groups', 'GET',
+                                   '%s/groups/' % self.base_url)
         if links_page.status_code != 200:
             raise EDemocracyClientException(
                 'Problem retrieving groups from E-Democracy')
 
-        soup = BeautifulSoup(links_page.text, 'html.parser')
-        links = soup.find(id='bodyblock') \
-                    .find_all('a', href=re.compile("^/groups/"))
-        return sorted(list(set(
-            [link.get('href').split('/')[2] for link in links
-             if not link.get('href').startswith('/groups/leave.html')]
-        )))
+        return self.parser.parse_groups(links_page.text)
 
     def get_group_members(self, group_id):
         """Fetches the list of members of the provided group."""
 
-        res = self.session \
-                  .get('%s/groups/%s/members.json' % (BASE_URL, group_id))
-        if res.status_code != 200:
-            raise EDemocracyClientException(
-                'Problem retrieving group membership for %s from '
-                'E-Democracy' % group_id)
-
-        return json.loads(res.text)
+        return self._get_json(
+            'members', '%s/groups/%s/members.json' % (self.base_url, group_id),
+            'Problem retrieving group membership for %s from '
+            'E-Democracy' % group_id)
 
     def get_profile_of_member(self, member_id):
         """Fetches the profile of the provided member."""
-        res = self.session \
-                  .get('%s/p/%s/profile.json' % (BASE_URL, member_id))
-        if res.status_code != 200:
-            raise EDemocracyClientException(
-                'Problem retrieving profile for %s from '
-                'E-Democracy' % member_id)
-
-        return json.loads(res.text)
+        return self._get_json(
+            'profile', '%s/p/%s/profile.json' % (self.base_url, member_id),
+            'Problem retrieving profile for %s from '
+            'E-Democracy' % member_id)
 
     def get_messages_of_group_and_month(self, group_id, month):
         """
@@ -124,16 +607,13 @@ class EDemocracyClient:
         :param month: Month to get messages for. String of the format 'YYYYMM'
         :returns: List of messages posted to the group in the specified month.
         """
-        res = self.session \
-                  .get('%s/groups/%s/messages/'
-                       'gs-group-messages-export-posts.json?month=%s' %
-                       (BASE_URL, group_id, month))
-        if res.status_code != 200:
-            raise EDemocracyClientException(
-                'Problem retrieving list of messages for %s in %s from '
-                'E-Democracy' % (group_id, month))
-
-        return json.loads(res.text)
+        return self._get_json(
+            'posts',
+            '%s/groups/%s/messages/'
+            'gs-group-messages-export-posts.json?month=%s' %
+            (self.base_url, group_id, month),
+            'Problem retrieving list of messages for %s in %s from '
+            'E-Democracy' % (group_id, month))
 
     def get_message_of_group(self, group_id, message_id):
         """
@@ -141,18 +621,28 @@ class EDemocracyClient:
 
         :param group_id: ID of the group to get message from
         :param message_id: ID of the message to fetch
-        :returns: Text of the message
+        :returns: Raw bytes of the message
         """
-        res = self.session \
-                  .get('%s/groups/%s/messages/'
-                       'gs-group-messages-export-mbox/%s' %
-                       (BASE_URL, group_id, message_id))
-        if res.status_code != 200:
-            raise EDemocracyClientException(
-                'Problem retrieving message %s from group %s'
-                'E-Democracy' % (message_id, group_id))
-
-        return res.text
+        # The body is streamed and kept as the bytes sent, rather than decoded
+        # into text; mbox responses rarely declare a charset, so decoding
+        # means guessing one from the whole body, attachments and all. It is
+        # read from the raw stream in one go, rather than as chunks joined
+        # afterwards, so it is only ever held once.
+        res = self._request('mbox', 'GET',
+                            '%s/groups/%s/messages/'
+                            'gs-group-messages-export-mbox/%s' %
+                            (self.base_url, group_id, message_id),
+                            stream=True)
+        with res:
+            if res.status_code != 200:
+                raise EDemocracyClientException(
+                    'Problem retrieving message %s from group %s'
+                    'E-Democracy' % (message_id, group_id))
+
+            body = res.raw.read(decode_content=True)
+            if self.metrics is not None:
+                self.metrics.add_bytes('mbox', len(body))
+            return body
 
     def get_message_months_of_group(self, group_id):
         """
@@ -161,17 +651,238 @@ class EDemocracyClient:
         :param group_id: ID of group to fetch months of messages for.
         :returns: List of months that have messages, in the format YYYYMM.
         """
-        export_page = self.session \
-                          .get('%s/groups/%s/messages/export.html' %
-                               (BASE_URL, group_id))
+        export_page = self._request('export', 'GET',
+                                    '%s/groups/%s/messages/export.html' %
+                                    (self.base_url, group_id))
         if export_page.status_code != 200:
             raise EDemocracyClientException(
                 'Problem retrieving groups from E-Democracy')
 
-        soup = BeautifulSoup(export_page.text, 'html.parser')
-        items = soup.find(id='bodyblock') \
-                    .find(id='gs-group-messages-export-list') \
-                    .find_all('button',
-                              class_='gs-group-messages-export-list-item-'
-                                     'buttons-generate')
-        return [item.get('data-month') for item in items]
+        return self.parser.parse_message_months(export_page.text)
+
+
+class AsyncEDemocracyClient:
+
+    def __init__(self, client=None, limit=100, rate_limiter=None,
+                 retry_policy=None, circuit_breaker=None, cache=None,
+                 parser=None, concurrency_limiter=None, metrics=None,
+                 base_url=None):
+        """
+        An asyncio Client used to fetch data from the E-Democracy forums.
+        Many requests can be in flight through a single instance of this
+        client at once, up to the provided limit. If an EDemocracyClient is
+        provided, it's server session, rate limiter, retry policy, circuit
+        breaker, cache, parser, concurrency limiter, metrics and base URL
+        will be used by the newly created client.
+
+        The underlying connection pool is only opened when the client is
+        entered, which must happen inside a running event loop.
+
+        :param client: An existing EDemocracyClient to use the server session
+                       of
+        :param limit: Maximum number of simultaneous connections
+        :param rate_limiter: RateLimiter to draw from before every request
+        :param retry_policy: RetryPolicy deciding when failed requests are
+                             retried
+        :param circuit_breaker: CircuitBreaker to pause requests with while
+                                too many are failing, if any
+        :param cache: ResponseCache to revalidate JSON responses with, if any
+        :param parser: ListingParser to scrape HTML pages with
+        :param concurrency_limiter: ConcurrencyLimiter to take a slot from
+                                    for every request, if any
+
+        :param metrics: Metrics to record every request in, if any
+        :param base_url: URL of the site to sync from
+        """
+        self.cookies = client.session.cookies.get_dict() \
+            if client is not None else {}
+        self.rate_limiter = rate_limiter or \
+            (client.rate_limiter if client is not None else RateLimiter())
+        self.retry_policy = retry_policy or \
+            (client.retry_policy if client is not None else RetryPolicy())
+        self.circuit_breaker = circuit_breaker or \
+            (client.circuit_breaker if client is not None else None)
+        self.cache = cache or (client.cache if client is not None else None)
+        self.parser = parser or \
+            (client.parser if client is not None else SoupListingParser())
+        self.concurrency_limiter = concurrency_limiter or \
+            (client.concurrency_limiter if client is not None else None)
+        self.metrics = metrics or \
+            (client.metrics if client is not None else None)
+        self.base_url = base_url or \
+            (client.base_url if client is not None else BASE_URL)
+        self.limit = limit
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limit),
+            cookies=self.cookies)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _fetch(self, endpoint, url, headers=None, binary=False):
+        """
+        :returns: Tuple of the status and headers of the response, and its
+                  text, or bytes if binary, if the status is 200
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.circuit_breaker is not None:
+                delay = self.circuit_breaker.wait_time()
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = self.circuit_breaker.wait_time()
+            delay = self.rate_limiter.reserve(endpoint)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if self.concurrency_limiter is not None:
+                await self.concurrency_limiter.acquire_async()
+            started = time.monotonic()
+            status = response_headers = text = None
+            size = 0
+            try:
+                async with self.session.get(url, headers=headers) as res:
+                    status = res.status
+                    response_headers = res.headers
+                    if status == 200:
+                        body = await res.read()
+                        size = len(body)
+                        text = body if binary else await res.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = None
+                failure = e
+            finally:
+                latency = time.monotonic() - started
+                if self.concurrency_limiter is not None:
+                    self.concurrency_limiter.release(status, latency)
+
+            if self.metrics is not None:
+                self.metrics.observe(endpoint, status, latency, size)
+
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.observe(endpoint, status)
+
+            if not self.retry_policy.should_retry(attempt, status):
+                if status is None:
+                    raise failure
+                return (status, response_headers, text)
+
+            delay = self.retry_policy.delay(
+                attempt, response_headers.get('Retry-After')
+                if response_headers is not None else None)
+            logger.warning("Request to %s failed with %s, retrying in %.1fs" %
+                           (url, status or failure, delay))
+            await asyncio.sleep(delay)
+
+    async def _get_text(self, endpoint, url, error):
+        status, _, text = await self._fetch(endpoint, url)
+        if status != 200:
+            raise EDemocracyClientException(error)
+        return text
+
+    async def _get_json(self, endpoint, url, error):
+        cached = await self._in_cache(self.cache.get, url) \
+            if self.cache is not None else None
+        if cached is not None and self.cache.is_fresh(cached):
+            return json.loads(cached.body)
+
+        status, headers, text = await self._fetch(
+            endpoint, url,
+            self.cache.validators(cached) if cached is not None else None)
+        if status == 304 and cached is not None:
+            await self._in_cache(self.cache.refresh, url)
+            return json.loads(cached.body)
+        if status != 200:
+            raise EDemocracyClientException(error)
+
+        if self.cache is not None:
+            await self._in_cache(self.cache.put, url, headers.get('ETag'),
+                                 headers.get('Last-Modified'), text)
+        return json.loads(text)
+
+    async def _in_cache(self, method, *args):
+        """
+        Calls a method of the cache in the loop's default executor, so its
+        disk I/O does not block every other request in flight.
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            None, method, *args)
+
+    async def get_groups(self):
+        """Fetches the list of currently available groups from the E-Democracy
+        group list."""
+        return self.parser.parse_groups(await self._get_text(
+            'groups', '%s/groups/' % self.base_url,
+            'Problem retrieving groups from E-Democracy'))
+
+    async def get_group_members(self, group_id):
+        """Fetches the list of members of the provided group."""
+        return await self._get_json(
+            'members', '%s/groups/%s/members.json' % (self.base_url, group_id),
+            'Problem retrieving group membership for %s from '
+            'E-Democracy' % group_id)
+
+    async def get_profile_of_member(self, member_id):
+        """Fetches the profile of the provided member."""
+        return await self._get_json(
+            'profile', '%s/p/%s/profile.json' % (self.base_url, member_id),
+            'Problem retrieving profile for %s from '
+            'E-Democracy' % member_id)
+
+    async def get_messages_of_group_and_month(self, group_id, month):
+        """
+        Fetches a list of message IDs for messages posted to the specified
+        group in the specified month.
+
+        :param group_id: ID of the group to get messages for
+        :param month: Month to get messages for. String of the format 'YYYYMM'
+        :returns: List of messages posted to the group in the specified month.
+        """
+        return await self._get_json(
+            'posts',
+            '%s/groups/%s/messages/'
+            'gs-group-messages-export-posts.json?month=%s' %
+            (self.base_url, group_id, month),
+            'Problem retrieving list of messages for %s in %s from '
+            'E-Democracy' % (group_id, month))
+
+    async def get_message_of_group(self, group_id, message_id):
+        """
+        Fetches the body of a specific message from a specific group.
+
+        :param group_id: ID of the group to get message from
+        :param message_id: ID of the message to fetch
+        :returns: Raw bytes of the message
+        """
+        status, _, body = await self._fetch(
+            'mbox',
+            '%s/groups/%s/messages/gs-group-messages-export-mbox/%s' %
+            (self.base_url, group_id, message_id),
+            binary=True)
+        if status != 200:
+            raise EDemocracyClientException(
+                'Problem retrieving message %s from group %s '
+                'E-Democracy' % (message_id, group_id))
+        return body
+
+    async def get_message_months_of_group(self, group_id):
+        """
+        Fetches a list of all months that the specified group has messages in.
+
+        :param group_id: ID of group to fetch months of messages for.
+        :returns: List of months that have messages, in the format YYYYMM.
+        """
+        return self.parser.parse_message_months(await self._get_text(
+            'export',
+            '%s/groups/%s/messages/export.html' % (self.base_url, group_id),
+            'Problem retrieving groups from E-Democracy'))
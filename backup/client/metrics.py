@@ -0,0 +1,162 @@
+from bisect import bisect_left
+import os
+from threading import Lock
+
+# Upper bounds, in seconds, of the buckets request latencies are counted in
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+                   float('inf'))
+
+
+class EndpointMetrics:
+    """
+    Counts of the requests made to a single endpoint.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.statuses = {}
+        self.buckets = [0 for bound in LATENCY_BUCKETS]
+
+    def quantile(self, q):
+        """
+        Estimates a quantile of the latencies of the requests, by linear
+        interpolation within the bucket it falls in.
+
+        :param q: Quantile to estimate, between 0 and 1
+        :returns: Estimated latency in seconds, or 0 if there were no
+                  requests
+        """
+        rank = q * self.requests
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            if count and seen + count >= rank:
+                if bound == float('inf'):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return 0.0
+
+
+class Metrics:
+
+    def __init__(self):
+        """
+        Records the count, statuses, bytes and latency of the requests made
+        to each E-Democracy endpoint. Safe to share between threads.
+        """
+        self.endpoints = {}
+        self.lock = Lock()
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointMetrics()
+        return self.endpoints[endpoint]
+
+    def observe(self, endpoint, status, latency, size=0):
+        """
+        Records a finished request.
+
+        :param endpoint: Name of the endpoint requested
+        :param status: Status of the response, or None if the request raised
+        :param latency: Seconds the request took
+        :param size: Bytes of the response body read so far
+        """
+        with self.lock:
+            metrics = self._endpoint(endpoint)
+            metrics.requests += 1
+            metrics.errors += status is None or status == 429 or status >= 500
+            metrics.bytes += size
+            metrics.seconds += latency
+            key = str(status) if status is not None else 'error'
+            metrics.statuses[key] = metrics.statuses.get(key, 0) + 1
+            metrics.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def add_bytes(self, endpoint, size):
+        """
+        Records bytes of a response body read after its request was observed,
+        as with streamed downloads.
+
+        :param endpoint: Name of the endpoint requested
+        :param size: Bytes read
+        """
+        with self.lock:
+            self._endpoint(endpoint).bytes += size
+
+    def summary(self):
+        """
+        :returns: List of lines summarizing the requests to each endpoint,
+                  the endpoint that took the longest first
+        """
+        with self.lock:
+            endpoints = sorted(self.endpoints.items(),
+                               key=lambda item: -item[1].seconds)
+            return ['%-8s %7i requests %6i errors %10.1f MiB %9.1fs total  '
+                    'p50 %.2fs p95 %.2fs p99 %.2fs' %
+                    (endpoint, metrics.requests, metrics.errors,
+                     metrics.bytes / 1024 / 1024, metrics.seconds,
+                     metrics.quantile(0.5), metrics.quantile(0.95),
+                     metrics.quantile(0.99))
+                    for endpoint, metrics in endpoints]
+
+    def prometheus(self):
+        """
+        :returns: Text of the metrics, in the Prometheus exposition format
+        """
+        lines = [
+            '# HELP edemocracy_requests_total Requests made to E-Democracy.',
+            '# TYPE edemocracy_requests_total counter'
+        ]
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            for endpoint, metrics in endpoints:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append('edemocracy_requests_total{endpoint="%s",'
+                                 'status="%s"} %i' % (endpoint, status, count))
+
+            lines += [
+                '# HELP edemocracy_response_bytes_total Bytes of response '
+                'bodies read from E-Democracy.',
+                '# TYPE edemocracy_response_bytes_total counter'
+            ]
+            for endpoint, metrics in endpoints:
+                lines.append('edemocracy_response_bytes_total{endpoint="%s"} '
+                             '%i' % (endpoint, metrics.bytes))
+
+            lines += [
+                '# HELP edemocracy_request_duration_seconds Latency of '
+                'requests made to E-Democracy.',
+                '# TYPE edemocracy_request_duration_seconds histogram'
+            ]
+            for endpoint, metrics in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                    cumulative += count
+                    lines.append(
+                        'edemocracy_request_duration_seconds_bucket'
+                        '{endpoint="%s",le="%s"} %i' %
+                        (endpoint, '+Inf' if bound == float('inf')
+                         else repr(float(bound)), cumulative))
+                lines.append('edemocracy_request_duration_seconds_sum'
+                             '{endpoint="%s"} %f' %
+                             (endpoint, metrics.seconds))
+                lines.append('edemocracy_request_duration_seconds_count'
+                             '{endpoint="%s"} %i' %
+                             (endpoint, metrics.requests))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Writes the metrics to a file in the Prometheus exposition format,
+        replacing it whole so a scraper never reads a partial file.
+
+        :param path: Path of the file to write
+        """
+        temporary = '%s.tmp' % path
+        with open(temporary, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temporary, path)
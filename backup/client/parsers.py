@@ -0,0 +1,77 @@
+from abc import ABC, abstractmethod
+from bs4 import BeautifulSoup, SoupStrainer
+import re
+
+try:
+    import lxml  # noqa: F401
+    DEFAULT_FEATURES = 'lxml'
+except ImportError:
+    DEFAULT_FEATURES = 'html.parser'
+
+GROUP_LINK = re.compile('^/groups/')
+MONTH_BUTTON_CLASS = 'gs-group-messages-export-list-item-buttons-generate'
+
+
+class ListingParser(ABC):
+    """
+    Parses the data scraped from E-Democracy's HTML listing pages. Clients
+    may be given any subclass to parse pages with.
+    """
+
+    @abstractmethod
+    def parse_groups(self, html):
+        """
+        Parses the IDs of groups out of the E-Democracy group list page.
+
+        :param html: Text of the group list page
+        :returns: Sorted list of unique group IDs
+        :raises ValueError: If the page has no group list
+        """
+
+    @abstractmethod
+    def parse_message_months(self, html):
+        """
+        Parses the months that have messages out of a group's message export
+        page.
+
+        :param html: Text of the message export page
+        :returns: List of months that have messages, in the format YYYYMM.
+        :raises ValueError: If the page has no export list
+        """
+
+
+class SoupListingParser(ListingParser):
+    # Notes on parsing:
+    # - only the part of each page holding the listing is turned into a
+    #   tree, by handing BeautifulSoup a SoupStrainer. The rest of the page
+    #   is still tokenized, but none of it is kept;
+    # - lxml tokenizes far faster than Python's html.parser, so it is used
+    #   whenever it is installed.
+    def __init__(self, features=None):
+        """
+        A ListingParser built on BeautifulSoup.
+
+        :param features: Parser for BeautifulSoup to use. Defaults to lxml if
+                         it is installed, or else html.parser.
+        """
+        self.features = features or DEFAULT_FEATURES
+
+    def parse_groups(self, html):
+        soup = BeautifulSoup(html, self.features,
+                             parse_only=SoupStrainer(id='bodyblock'))
+        if soup.find(id='bodyblock') is None:
+            raise ValueError('Page has no group list')
+        links = soup.find_all('a', href=GROUP_LINK)
+        return sorted(list(set(
+            [link.get('href').split('/')[2] for link in links
+             if not link.get('href').startswith('/groups/leave.html')]
+        )))
+
+    def parse_message_months(self, html):
+        soup = BeautifulSoup(
+            html, self.features,
+            parse_only=SoupStrainer(id='gs-group-messages-export-list'))
+        if soup.find(id='gs-group-messages-export-list') is None:
+            raise ValueError('Page has no export list')
+        items = soup.find_all('button', class_=MONTH_BUTTON_CLASS)
+        return [item.get('data-month') for item in items]
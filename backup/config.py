@@ -41,5 +41,22 @@ class Config:
 class ConfigKey(Enum):
     COMMAND = 'COMMAND'
     DATABASE_PATH = 'DATABASE_PATH'
+    BASE_URL = 'BASE_URL'
     USERNAME = 'USERNAME'
     PASSWORD = 'PASSWORD'
+    ENGINE = 'ENGINE'
+    CONCURRENCY = 'CONCURRENCY'
+    ADAPTIVE_CONCURRENCY = 'ADAPTIVE_CONCURRENCY'
+    PARSE_PROCESSES = 'PARSE_PROCESSES'
+    REINDEX_SCOPE = 'REINDEX_SCOPE'
+    MONTH_SYNC = 'MONTH_SYNC'
+    PROFILE_TTL = 'PROFILE_TTL'
+    RUN_MODE = 'RUN_MODE'
+    RATE_LIMIT = 'RATE_LIMIT'
+    RATE_BURST = 'RATE_BURST'
+    ENDPOINT_RATE_LIMITS = 'ENDPOINT_RATE_LIMITS'
+    RETRIES = 'RETRIES'
+    CACHE_PATH = 'CACHE_PATH'
+    CACHE_SIZE = 'CACHE_SIZE'
+    CACHE_MAX_AGE = 'CACHE_MAX_AGE'
+    METRICS_PATH = 'METRICS_PATH'
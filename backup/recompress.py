@@ -0,0 +1,80 @@
+import logging
+
+from backup.reindex import Reindex
+from backup.store.sqlite import Store
+
+logger = logging.getLogger(__name__)
+
+
+def compress_range(db_path, start, end, codec):
+    """
+    Compresses the bodies of the messages in a range of rowids with the
+    latest body dictionary. Runs in a pool process, on its own store.
+
+    :param db_path: Path to the database
+    :param start: Rowid the range starts after
+    :param end: Last rowid of the range
+    :param codec: Name of the codec to compress with, whose bodies are left
+                  as they are
+    :returns: List of (message_id, body, codec) tuples
+    """
+    with Store(db_path) as store:
+        body_codec = store.get_body_codec()
+        if body_codec.codec != codec:
+            raise ValueError("Expected to compress with %s, not %s" %
+                             (codec, body_codec.codec))
+        return [(message_id,) + body_codec.compress(body)
+                for message_id, body
+                in store.fetch_group_message_bodies(start, end,
+                                                    skip_codec=codec)]
+
+
+class Recompress(Reindex):
+    # Notes on recompressing:
+    # - bodies are rewritten a range of rowids at a time, just as reindexing
+    #   derives metadata, each range compressed in a pool process and saved
+    #   and journaled in one transaction by the calling process;
+    # - bodies already saved with the latest codec are left alone, so bodies
+    #   synced while a run is stopped do not need compressing again;
+    # - a dictionary is only trained when a run starts, so a resumed run
+    #   compresses its remaining ranges with the dictionary it started with.
+    TASK = 'recompress'
+    VERB = 'Recompressed'
+
+    def __init__(self, db_path, journal, processes=None, range_size=10000,
+                 samples=10000):
+        """
+        Compresses the body of every message with the latest codec, training
+        a dictionary on the archive first when starting a new run.
+
+        :param db_path: Path to the database
+        :param journal: Journal of the run
+        :param processes: Number of processes to compress bodies in.
+                          Defaults to one per CPU.
+        :param range_size: Number of rowids to compress and commit at a time
+        :param samples: Most bodies to train the dictionary on, or 0 to
+                        compress with the latest dictionary already trained
+        """
+        super().__init__(db_path, journal, processes=processes,
+                         range_size=range_size)
+        self.samples = samples
+        self.codec = None
+
+    def ranges(self, store):
+        if self.journal.mode == 'new' and self.samples:
+            dictionary_id = store.train_body_dictionary(self.samples)
+            if dictionary_id is None:
+                logger.info("No body dictionary trained, compressing "
+                            "without one")
+            else:
+                logger.info("Trained body dictionary %i" % dictionary_id)
+        self.codec = store.get_body_codec().codec
+        logger.info("Compressing bodies with %s" % self.codec)
+        return super().ranges(store)
+
+    def submit(self, pool, item):
+        return pool.submit(compress_range, self.db_path, item[0], item[1],
+                           self.codec)
+
+    def write(self, store, result):
+        store.save_group_message_bodies(result)
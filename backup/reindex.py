@@ -0,0 +1,125 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import logging
+from multiprocessing import cpu_count
+
+from backup.store.sqlite import Store
+
+logger = logging.getLogger(__name__)
+
+
+def derive_range(db_path, start, end, missing_only):
+    """
+    Derives the metadata of the messages with bodies in a range of rowids.
+    Runs in a pool process, on its own store.
+
+    :param db_path: Path to the database
+    :param start: Rowid the range starts after
+    :param end: Last rowid of the range
+    :param missing_only: Whether to only derive the metadata of messages
+                         that have none yet
+    :returns: List of (message_id, metadata) tuples
+    """
+    with Store(db_path) as store:
+        messages = store.fetch_group_message_bodies(start, end, missing_only)
+        return [(message_id,
+                 store.email_message_utils.get_message_metadata(body))
+                for message_id, body in messages]
+
+
+class Reindex:
+    # Notes on reindexing:
+    # - the metadata columns of messages, such as from_address and
+    #   posted_at, are derived from their bodies again, a range of rowids at
+    #   a time;
+    # - pool processes each read and parse a range on their own store,
+    #   so bodies never cross between processes, only the metadata derived
+    #   from them;
+    # - the calling process writes each range's metadata in a single
+    #   transaction, along with marking the range done in the journal, so a
+    #   run that stops can be resumed without losing or redoing a range;
+    # - ranges are aligned to multiples of `range_size`, so they are the
+    #   same when a run is resumed, even if messages were added since.
+    TASK = 'reindex'
+    VERB = 'Reindexed'
+
+    def __init__(self, db_path, journal, processes=None, range_size=10000,
+                 missing_only=True):
+        """
+        Re-derives the metadata columns of every message with a body.
+
+        :param db_path: Path to the database
+        :param journal: Journal of the run
+        :param processes: Number of processes to parse bodies in. Defaults
+                          to one per CPU.
+        :param range_size: Number of rowids to derive and commit at a time
+        :param missing_only: Whether to only derive the metadata of messages
+                             that have none yet, rather than of every message
+        """
+        self.db_path = db_path
+        self.journal = journal
+        self.processes = processes or cpu_count()
+        self.range_size = range_size
+        self.missing_only = missing_only
+
+    def ranges(self, store):
+        """
+        :param store: Store to find the messages in
+        :returns: List of [start, end] rowid ranges covering every message
+        """
+        last = store.fetch_last_group_message_rowid()
+        return [[start, start + self.range_size]
+                for start in range(0, last, self.range_size)]
+
+    def __call__(self):
+        with Store(self.db_path) as store, \
+                ProcessPoolExecutor(self.processes) as pool:
+            ranges = self.ranges(store)
+            done = 0
+            pending = {}
+            items = self.journal.sources(self.TASK, ranges, store)
+            while True:
+                # Keep every process busy, with one range queued behind it
+                for item in items:
+                    pending[self.submit(pool, item)] = item
+                    if len(pending) >= self.processes * 2:
+                        break
+                if not pending:
+                    break
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = pending.pop(future)
+                    done += 1
+                    self.save(store, item, future)
+                    logger.info("%s rowids %i to %i, range %i of %i" %
+                                (self.VERB, item[0] + 1, item[1], done,
+                                 len(ranges)))
+
+    def submit(self, pool, item):
+        """
+        :param pool: Pool of processes
+        :param item: [start, end] rowid range
+        :returns: Future of the range's derived metadata
+        """
+        return pool.submit(derive_range, self.db_path, item[0], item[1],
+                           self.missing_only)
+
+    def write(self, store, result):
+        store.save_group_message_metadata(result)
+
+    def save(self, store, item, future):
+        """
+        Saves the result of a range, and journals the range as done, in one
+        transaction.
+
+        :param store: Store to save to
+        :param item: [start, end] rowid range
+        :param future: Future of the range's result
+        """
+        try:
+            with store.transaction():
+                self.write(store, future.result())
+                self.journal.done(self.TASK, item, store)
+        except Exception as e:
+            logger.exception(e)
+            self.journal.failed(self.TASK, item, e, store)
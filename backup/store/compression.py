@@ -0,0 +1,113 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+# Bytes of a trained dictionary, zstd's own default
+DICTIONARY_SIZE = 112640
+
+
+class BodyCodecError(Exception):
+    pass
+
+
+class BodyCodec:
+    # Notes on body compression:
+    # - bodies are compressed with zstd when the zstandard package is
+    #   installed, and with zlib otherwise. zstd uses the dictionary it is
+    #   given, trained on the archive's own bodies, which captures the
+    #   headers, footers and quoting every message of a list repeats;
+    # - each body is saved along with the name of its codec: 'zlib', 'zstd',
+    #   or 'zstd:<id>' for zstd with the dictionary of that ID. Bodies saved
+    #   with no codec are stored as they are, so bodies written before
+    #   compression, or by any codec since, can all be read back;
+    # - bodies are compressed as bytes. Bodies given as strings are encoded
+    #   as UTF-8 first, and so are read back as bytes.
+    def __init__(self, dictionary_id=None, load_dictionary=None):
+        """
+        Compresses and decompresses message bodies.
+
+        :param dictionary_id: ID of the dictionary to compress with, if any.
+                              Ignored without zstandard.
+        :param load_dictionary: Function returning the bytes of the
+                                dictionary with a given ID, to decompress
+                                bodies compressed with it
+        """
+        self.load_dictionary = load_dictionary
+        self.dictionaries = {}
+        self.decompressors = {}
+        if zstandard is None:
+            self.codec = 'zlib'
+            self.compressor = None
+        elif dictionary_id is None:
+            self.codec = 'zstd'
+            self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        else:
+            self.codec = 'zstd:%i' % dictionary_id
+            self.compressor = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL, dict_data=self._dictionary(dictionary_id))
+
+    def compress(self, body):
+        """
+        :param body: Body of a message, as raw bytes or a string
+        :returns: Tuple of the compressed body, and the name of its codec
+        """
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8', 'surrogateescape')
+        if self.compressor is None:
+            return zlib.compress(body, ZLIB_LEVEL), self.codec
+        return self.compressor.compress(body), self.codec
+
+    def decompress(self, data, codec):
+        """
+        :param data: Body of a message, as saved
+        :param codec: Name of the codec the body was saved with, or None if
+                      it was saved as it was
+        :returns: Body of the message
+        """
+        if data is None or codec is None:
+            return data
+        if codec == 'zlib':
+            return zlib.decompress(data)
+        if not codec.startswith('zstd'):
+            raise BodyCodecError("Unknown body codec %s" % codec)
+        if zstandard is None:
+            raise BodyCodecError("Decompressing bodies saved with %s needs "
+                                 "the zstandard package" % codec)
+
+        if codec not in self.decompressors:
+            dictionary_id = codec.partition(':')[2]
+            self.decompressors[codec] = zstandard.ZstdDecompressor(
+                dict_data=self._dictionary(int(dictionary_id))) \
+                if dictionary_id else zstandard.ZstdDecompressor()
+        return self.decompressors[codec].decompress(data)
+
+    def _dictionary(self, dictionary_id):
+        if dictionary_id not in self.dictionaries:
+            data = self.load_dictionary(dictionary_id)
+            if data is None:
+                raise BodyCodecError("No body dictionary %i" % dictionary_id)
+            self.dictionaries[dictionary_id] = \
+                zstandard.ZstdCompressionDict(data)
+        return self.dictionaries[dictionary_id]
+
+    @staticmethod
+    def train_dictionary(samples, size=DICTIONARY_SIZE):
+        """
+        Trains a zstd dictionary on sample bodies.
+
+        :param samples: List of bodies, as raw bytes
+        :param size: Most bytes the dictionary may take
+        :returns: Bytes of the dictionary, or None if zstandard is not
+                  installed, or there were too few samples to train on
+        """
+        if zstandard is None:
+            return None
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            return None
@@ -1,20 +1,70 @@
+from contextlib import contextmanager
+import hashlib
 import json
+import logging
+import random
 import sqlite3
+import time
+from backup.store.compression import BodyCodec
 from backup.utils.email_message_utility import EmailMessageUtility
 
+logger = logging.getLogger(__name__)
+
 
 class Store:
     def __init__(self, db_file):
         self.db_file = db_file
         self.email_message_utils = EmailMessageUtility()
+        self.body_codec = None
+        self.in_transaction = False
 
     def __enter__(self):
         self.db = sqlite3.connect(self.db_file)
+        # WAL lets readers carry on while a writer holds the write lock, and
+        # only needs an fsync at checkpoints rather than on every commit.
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
         return self
 
     def __exit__(self, *args):
         self.db.close()
 
+    @contextmanager
+    def transaction(self):
+        """
+        Groups every write made within the context into a single database
+        transaction. The transaction is committed when the context exits, or
+        rolled back if the context raises. Within another transaction, the
+        writes are simply part of it.
+        """
+        if self.in_transaction:
+            yield self
+            return
+
+        self.in_transaction = True
+        try:
+            yield self
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            raise e
+        finally:
+            self.in_transaction = False
+
+    def _commit(self):
+        """
+        Commits pending writes, unless they are part of a transaction opened
+        with transaction().
+        """
+        if self.in_transaction:
+            return
+
+        try:
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
     ########################################
     # Groups
     ########################################
@@ -41,6 +91,10 @@ class Store:
         Saves the provided membership of the specified group. Any existing
         membership will be overwritten.
 
+        Only the difference from the existing membership is written to the
+        membership table: members that left are removed and members that
+        joined are added, along with the time they were added.
+
         :param group_id: String ID of the group to save members for.
         :param members: List of string IDs of members of the group.
         """
@@ -48,7 +102,22 @@ class Store:
         cursor.execute('''
             INSERT OR REPLACE into group_members values(?, ?)
         ''', (group_id, json.dumps(members)))
-        self.db.commit()
+
+        cursor.execute('''
+        SELECT member_id FROM group_memberships WHERE group_id = ?
+        ''', (group_id,))
+        existing = set(member[0] for member in cursor)
+        members = set(members)
+
+        cursor.executemany('''
+            DELETE FROM group_memberships WHERE group_id = ? AND member_id = ?
+        ''', [(group_id, member) for member in existing - members])
+        added_at = time.time()
+        cursor.executemany('''
+            INSERT into group_memberships (group_id, member_id, added_at)
+            values(?, ?, ?)
+        ''', [(group_id, member, added_at) for member in members - existing])
+        self._commit()
 
     def fetch_members_of_group(self, group_id):
         """
@@ -61,10 +130,16 @@ class Store:
         """
         cursor = self.db.cursor()
         cursor.execute('''
-        SELECT member_ids FROM group_members WHERE group_id = ?
+        SELECT member_id FROM group_memberships WHERE group_id = ?
         ''', (group_id,))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
+        members = [member[0] for member in cursor]
+        if members:
+            return members
+
+        cursor.execute('''
+        SELECT 1 FROM group_members WHERE group_id = ?
+        ''', (group_id,))
+        return [] if cursor.fetchone() else None
 
     def fetch_all_unique_group_members(self):
         """
@@ -74,8 +149,8 @@ class Store:
         """
         cursor = self.db.cursor()
         cursor.execute('''
-        SELECT DISTINCT json_each.value
-        FROM group_members, json_each(group_members.member_ids)
+        SELECT DISTINCT member_id
+        FROM group_memberships
         ''')
         return [member[0] for member in cursor]
 
@@ -90,8 +165,8 @@ class Store:
         cursor = self.db.cursor()
         cursor.execute('''
         SELECT group_id
-        FROM group_members, json_each(group_members.member_ids)
-        WHERE json_each.value = ?
+        FROM group_memberships
+        WHERE member_id = ?
         ''', (member_id,))
         return [group[0] for group in cursor]
 
@@ -110,47 +185,49 @@ class Store:
 
         Any individual 'message' can be a dict or a string. If a 'message' is a
         dict, the 'id' and 'body' attributes will be used to create the message
-        id, from_address, and body. If a 'message' is a string, then that
-        string will be used as a message_id and no body will be saved. In both
-        cases, all writes will take place in a single database transaction.
+        id and compressed body, and the metadata derived from the body, such as
+        from_address and posted_at, unless the dict already has the metadata
+        returned by EmailMessageUtility.get_message_metadata. If a 'message'
+        is a string, then that string will be used as a message_id and no body
+        will be saved. In both cases, all writes will take place in a single
+        database transaction.
+
+        Messages that already exist are left untouched. Messages are inserted
+        in bulk, with one statement for every distinct set of attributes.
 
         :param group_id: ID of the group to save messages for
         :param messages: The message or messages to save
+        :returns: Tuple of the number of messages inserted, and the number
+                  skipped because they already existed.
         """
         if type(messages) is not list:
             messages = [messages]
 
-        cursor = self.db.cursor()
+        messages = [message.copy() if type(message) is dict else {
+            'id': message,
+            'body': None
+        } for message in messages]
+        self._derive_metadata(messages)
+        self._compress_bodies(messages)
 
+        rows = {}
         for message in messages:
-            message = message.copy() if type(message) is dict else {
-                'id': message,
-                'body': None
-            }
             message['group_id'] = group_id
-            if message['body'] is not None:
-                message['from_address'] = self\
-                                          .email_message_utils\
-                                          .get_sender_address(message['body'])
+            columns = tuple(sorted(message.keys()))
+            rows.setdefault(columns, []).append(
+                tuple(message[column] for column in columns))
 
-            columns = ', '.join(message.keys())
-            placeholders = ', '.join('?' * len(message))
+        cursor = self.db.cursor()
+        inserted = 0
+        for columns, values in rows.items():
             sql = '''
-                INSERT into group_messages ({}) values({})
-            '''.format(columns, placeholders)
+                INSERT OR IGNORE into group_messages ({}) values({})
+            '''.format(', '.join(columns), ', '.join('?' * len(columns)))
+            cursor.executemany(sql, values)
+            inserted += cursor.rowcount
 
-            try:
-                cursor.execute(sql, tuple(message.values()))
-            except sqlite3.IntegrityError as e:
-                if str(e) == 'UNIQUE constraint failed: group_messages.id':
-                    continue
-                raise e
-
-        try:
-            self.db.commit()
-        except Exception as e:
-            self.db.rollback()
-            raise e
+        self._commit()
+        return (inserted, len(messages) - inserted)
 
     def update_group_messages(self, messages):
         """
@@ -162,23 +239,27 @@ class Store:
         will take place in a single database transaction.
 
         Messages must be a dict. The 'id' attribute will be used to find the
-        message, and any other specified attributes will be updated.
-        from_address will be derived from 'body'.
+        message, and any other specified attributes will be updated. The
+        metadata columns, such as from_address and posted_at, will be derived
+        from 'body', unless the dict already has the metadata returned by
+        EmailMessageUtility.get_message_metadata. The body is saved
+        compressed.
 
         :param messages: The message or messages to update
         """
         if type(messages) is not list:
             messages = [messages]
 
-        cursor = self.db.cursor()
-
         for message in messages:
             if type(message) is not dict:
                 raise TypeError("Message must be a dict")
-            message = message.copy()
+        messages = [message.copy() for message in messages]
+        self._derive_metadata(messages)
+        self._compress_bodies(messages)
+
+        cursor = self.db.cursor()
+        for message in messages:
             message_id = message.pop('id')
-            message['from_address'] = self.email_message_utils\
-                                          .get_sender_address(message['body'])
             sets = ','.join(["%s = ?" % c for c in message.keys()])
             sql = '''
                 UPDATE group_messages
@@ -187,27 +268,304 @@ class Store:
             '''.format(sets)
             cursor.execute(sql, tuple(message.values()) + (message_id,))
 
-        try:
-            self.db.commit()
-        except Exception as e:
-            self.db.rollback()
-            raise e
+        self._commit()
 
-    def fetch_empty_group_messages(self):
+    def iter_empty_group_messages(self, page_size=1000):
         """
-        Fetches IDs and groups of all group messages that do not currently have
-        a body. Returned list includes dicts with 'id' for message ID and
-        'group_id' for group ID.
+        Iterates over the IDs and groups of all group messages that do not
+        currently have a body, as (message_id, group_id) tuples.
+
+        Messages are read a page at a time, each page in its own short read,
+        so iteration can be interleaved with writes to the same messages
+        without holding a snapshot of the whole table open.
 
-        :return Iterable of dicts of messages that have no body
+        :param page_size: Number of messages to read at a time
+        :return Iterator of (message_id, group_id) tuples of messages that
+                have no body
+        """
+        cursor = self.db.cursor()
+        last_rowid = 0
+        while True:
+            cursor.execute('''
+            SELECT rowid, id, group_id
+            FROM group_messages
+            WHERE from_address IS NULL AND rowid > ?
+            ORDER BY rowid
+            LIMIT ?
+            ''', (last_rowid, page_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+
+            last_rowid = rows[-1][0]
+            for row in rows:
+                yield row[1:]
+
+    def filter_empty_group_messages(self, message_ids):
+        """
+        Filters out the messages that currently have a body. Messages that
+        are not in the store at all are kept.
+
+        :param message_ids: List of IDs of messages to filter
+        :return List of the provided message IDs, in order, of messages that
+                have no body
+        """
+        cursor = self.db.cursor()
+        full = set()
+        # Stay well under SQLite's limit on the number of bound parameters
+        for i in range(0, len(message_ids), 500):
+            page = message_ids[i:i + 500]
+            cursor.execute('''
+            SELECT id
+            FROM group_messages
+            WHERE from_address IS NOT NULL AND id IN ({})
+            '''.format(', '.join('?' * len(page))), page)
+            full.update(row[0] for row in cursor)
+        return [message_id for message_id in message_ids
+                if message_id not in full]
+
+    def count_empty_group_messages(self):
+        """
+        Counts the group messages that do not currently have a body.
+
+        :return Number of messages that have no body
         """
         cursor = self.db.cursor()
         cursor.execute('''
-        SELECT id, group_id
+        SELECT count(*)
         FROM group_messages
         WHERE from_address IS NULL
         ''')
-        return [{'message_id': m[0], 'group_id': m[1]} for m in cursor]
+        return cursor.fetchone()[0]
+
+    def _derive_metadata(self, messages):
+        """
+        Adds the metadata derived from their bodies to message dicts that
+        have a body, but not yet their metadata.
+
+        :param messages: List of message dicts to update in place
+        """
+        pending = [message for message in messages
+                   if message.get('body') is not None and
+                   'from_address' not in message]
+        metadata = self.email_message_utils.get_messages_metadata(
+            [message['body'] for message in pending])
+        for message, columns in zip(pending, metadata):
+            message.update(columns)
+
+    def _compress_bodies(self, messages):
+        """
+        Compresses the bodies of message dicts, noting the codec of each.
+
+        :param messages: List of message dicts to update in place
+        """
+        for message in messages:
+            if 'body' not in message:
+                continue
+            if message['body'] is None:
+                message['body_codec'] = None
+            else:
+                message['body'], message['body_codec'] = \
+                    self.get_body_codec().compress(message['body'])
+
+    def get_body_codec(self):
+        """
+        :return BodyCodec that bodies are saved and read with, compressing
+                with the latest body dictionary as of its first use
+        """
+        if self.body_codec is None:
+            self.body_codec = BodyCodec(self.fetch_last_body_dictionary_id(),
+                                        self.fetch_body_dictionary)
+        return self.body_codec
+
+    def fetch_group_message_body(self, message_id):
+        """
+        :param message_id: ID of the message
+        :return Body of the message, decompressed, or None if the message
+                has no body
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT body, body_codec FROM group_messages WHERE id = ?
+        ''', (message_id,))
+        row = cursor.fetchone()
+        return self.get_body_codec().decompress(*row) if row else None
+
+    def fetch_group_message_bodies(self, start, end, missing_only=False,
+                                   skip_codec=None):
+        """
+        Fetches the bodies of the messages within a range of rowids.
+
+        :param start: Rowid the range starts after
+        :param end: Last rowid of the range
+        :param missing_only: Whether to only fetch the bodies of messages
+                             whose metadata has not been derived
+        :param skip_codec: Name of a codec whose bodies to leave out
+        :return List of (message_id, body) tuples of the messages with
+                bodies, the bodies decompressed
+        """
+        conditions = ['rowid > ?', 'rowid <= ?', 'body IS NOT NULL']
+        parameters = [start, end]
+        if missing_only:
+            conditions.append('size IS NULL')
+        if skip_codec is not None:
+            conditions.append('body_codec IS NOT ?')
+            parameters.append(skip_codec)
+
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT id, body, body_codec
+        FROM group_messages
+        WHERE {}
+        '''.format(' AND '.join(conditions)), parameters)
+        codec = self.get_body_codec()
+        return [(message_id, codec.decompress(body, body_codec))
+                for message_id, body, body_codec in cursor]
+
+    def save_group_message_bodies(self, messages):
+        """
+        Saves bodies of messages that are already compressed. Their metadata
+        is left as it is.
+
+        :param messages: List of (message_id, body, codec) tuples, each body
+                         and codec as returned by BodyCodec.compress
+        """
+        cursor = self.db.cursor()
+        cursor.executemany('''
+            UPDATE group_messages SET body = ?, body_codec = ? WHERE id = ?
+        ''', [(body, codec, message_id)
+              for message_id, body, codec in messages])
+        self._commit()
+
+    def save_group_message_metadata(self, messages):
+        """
+        Saves metadata already derived from the bodies of messages, such as
+        from_address and posted_at. The bodies themselves are not rewritten.
+
+        :param messages: List of (message_id, metadata) tuples, each metadata
+                         dict as returned by
+                         EmailMessageUtility.get_message_metadata
+        """
+        cursor = self.db.cursor()
+        cursor.executemany('''
+            UPDATE group_messages
+            SET from_address = :from_address, posted_at = :posted_at,
+                rfc_message_id = :rfc_message_id, subject = :subject,
+                in_reply_to = :in_reply_to, size = :size
+            WHERE id = :id
+        ''', [dict(metadata, id=message_id)
+              for message_id, metadata in messages])
+        self._commit()
+
+    def fetch_last_group_message_rowid(self):
+        """
+        :return The largest rowid of any group message, or 0 if there are
+                none
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT coalesce(max(rowid), 0) FROM group_messages
+        ''')
+        return cursor.fetchone()[0]
+
+    def fetch_group_messages_between(self, group_id, start, end):
+        """
+        Fetches the messages posted to a group within a range of time.
+
+        :param group_id: ID of the group to fetch messages of
+        :param start: Seconds since the epoch the range starts at, inclusive
+        :param end: Seconds since the epoch the range ends at, exclusive
+        :return List of IDs of the messages, oldest first
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT id
+        FROM group_messages
+        WHERE group_id = ? AND posted_at >= ? AND posted_at < ?
+        ORDER BY posted_at
+        ''', (group_id, start, end))
+        return [message[0] for message in cursor]
+
+    def fetch_replies_to_message(self, rfc_message_id):
+        """
+        Fetches the messages sent in reply to a message.
+
+        :param rfc_message_id: Message-ID header of the message, without its
+                               angle brackets
+        :return List of (message_id, group_id) tuples of the replies, oldest
+                first
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT id, group_id
+        FROM group_messages
+        WHERE in_reply_to = ?
+        ORDER BY posted_at
+        ''', (rfc_message_id,))
+        return cursor.fetchall()
+
+    ########################################
+    # Group Message Months
+    ########################################
+
+    def save_group_message_month(self, group_id, month, fetched_at, closed):
+        """
+        Records when the message IDs of a month of a group were last fetched,
+        replacing any earlier record of the same month.
+
+        :param group_id: ID of the group the month belongs to
+        :param month: Month fetched, in the format YYYYMM
+        :param fetched_at: Time the message IDs were fetched, in seconds
+                           since the epoch
+        :param closed: True if no more messages are expected in the month
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE into group_message_months values(?, ?, ?, ?)
+        ''', (group_id, month, fetched_at, int(closed)))
+        self._commit()
+
+    def create_group_messages_of_month(self, group_id, month, messages,
+                                       fetched_at, closed):
+        """
+        Creates the messages of a month of a group, as create_group_messages
+        does, and records the month as fetched, as save_group_message_month
+        does, in one transaction. A month is never recorded without its
+        messages. The number of messages inserted and skipped is logged.
+
+        :param group_id: ID of the group to save messages for
+        :param month: Month fetched, in the format YYYYMM
+        :param messages: The message or messages to save
+        :param fetched_at: Time the message IDs were fetched, in seconds
+                           since the epoch
+        :param closed: True if no more messages are expected in the month
+        :returns: Tuple of the number of messages inserted, and the number
+                  skipped because they already existed.
+        """
+        with self.transaction():
+            inserted, skipped = self.create_group_messages(group_id, messages)
+            self.save_group_message_month(group_id, month, fetched_at, closed)
+        logger.info("Saved %i new message IDs of %s in %s, %i already saved" %
+                    (inserted, group_id, month, skipped))
+        return inserted, skipped
+
+    def fetch_group_message_months(self, group_id):
+        """
+        Fetches the record of every month of the group that has had its
+        message IDs fetched.
+
+        :param group_id: ID of the group to fetch months of
+        :returns: Dict of months, in the format YYYYMM, to tuples of when
+                  the month was last fetched and whether it is closed
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT month, fetched_at, closed
+        FROM group_message_months
+        WHERE group_id = ?
+        ''', (group_id,))
+        return {month: (fetched_at, bool(closed))
+                for month, fetched_at, closed in cursor}
 
     ########################################
     # Member Profiles
@@ -219,13 +577,58 @@ class Store:
         matches the provided profile's 'id' attribute, that profile will be
         overwritten by the provided one.
 
+        The time of the save is recorded as the time the profile was fetched.
+        If the saved profile has the same content as the provided one, only
+        that time is written.
+
         :param profile: Dict of a profile to save.
+        :returns: True if the profile was new or had changed
         """
+        content_hash = hashlib.sha1(
+            json.dumps(profile, sort_keys=True).encode('utf-8')).hexdigest()
+        fetched_at = time.time()
+
         cursor = self.db.cursor()
         cursor.execute('''
-            INSERT OR REPLACE into member_profiles values(?, ?)
-        ''', (profile['id'], json.dumps(profile)))
-        self.db.commit()
+            UPDATE member_profiles
+            SET fetched_at = ?
+            WHERE id = ? AND content_hash = ?
+        ''', (fetched_at, profile['id'], content_hash))
+        changed = cursor.rowcount == 0
+        if changed:
+            cursor.execute('''
+                INSERT OR REPLACE into member_profiles
+                (id, profile, fetched_at, content_hash) values(?, ?, ?, ?)
+            ''', (profile['id'], json.dumps(profile), fetched_at,
+                  content_hash))
+        self._commit()
+        return changed
+
+    def fetch_members_due_for_profile(self, ttl):
+        """
+        Returns the unique members of all groups whose profiles are due to be
+        fetched: members without a profile, members who joined a group since
+        their profile was fetched, and members whose profile was fetched more
+        than ttl seconds ago. They are listed in that order, the stale ones
+        from the least recently fetched.
+
+        :param ttl: Seconds after being fetched that a profile goes stale
+        :returns: List of member IDs
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT member_id
+        FROM (
+            SELECT m.member_id, p.fetched_at, max(m.added_at) > p.fetched_at
+                AS joined
+            FROM group_memberships m
+            LEFT JOIN member_profiles p ON p.id = m.member_id
+            GROUP BY m.member_id
+        )
+        WHERE fetched_at IS NULL OR joined OR fetched_at < ?
+        ORDER BY fetched_at IS NOT NULL, joined IS NOT 1, fetched_at
+        ''', (time.time() - ttl,))
+        return [member[0] for member in cursor]
 
     def fetch_profile_of_member(self, member_id):
         """
@@ -241,3 +644,274 @@ class Store:
         ''', (member_id,))
         row = cursor.fetchone()
         return json.loads(row[0]) if row else None
+
+    ########################################
+    # Body Dictionaries
+    ########################################
+
+    def train_body_dictionary(self, samples=10000):
+        """
+        Trains a dictionary to compress bodies with on a random sample of the
+        bodies already saved. Bodies saved from then on are compressed with
+        it, by stores that have not yet used their codec.
+
+        :param samples: Most bodies to train the dictionary on
+        :return ID of the new dictionary, or None if no dictionary could be
+                trained
+        """
+        bodies = self.fetch_sample_group_message_bodies(samples)
+        dictionary = BodyCodec.train_dictionary(
+            [body if isinstance(body, bytes) else
+             body.encode('utf-8', 'surrogateescape') for body in bodies])
+        if dictionary is None:
+            return None
+
+        cursor = self.db.cursor()
+        cursor.execute('''
+            INSERT into body_dictionaries (dictionary, trained_at)
+            values(?, ?)
+        ''', (dictionary, time.time()))
+        self._commit()
+        self.body_codec = None
+        return cursor.lastrowid
+
+    def fetch_sample_group_message_bodies(self, samples):
+        """
+        Fetches a random sample of the bodies saved, spread across the whole
+        archive. The rowids are split into as many strides as there are
+        samples, and the first body at a random rowid of each stride is
+        fetched, so only the sampled rows are read, rather than every body.
+
+        :param samples: Most bodies to fetch
+        :return List of bodies, decompressed
+        """
+        last = self.fetch_last_group_message_rowid()
+        stride = max(1.0, last / max(samples, 1))
+        starts = sorted({int((i + random.random()) * stride) + 1
+                         for i in range(min(samples, last))})
+
+        cursor = self.db.cursor()
+        rows = {}
+        for start in starts:
+            cursor.execute('''
+            SELECT rowid, body, body_codec
+            FROM group_messages
+            WHERE rowid >= ? AND body IS NOT NULL
+            ORDER BY rowid
+            LIMIT 1
+            ''', (start,))
+            row = cursor.fetchone()
+            if row is not None:
+                rows[row[0]] = row[1:]
+
+        codec = self.get_body_codec()
+        return [codec.decompress(body, body_codec)
+                for rowid, (body, body_codec) in sorted(rows.items())]
+
+    def fetch_body_dictionary(self, dictionary_id):
+        """
+        :param dictionary_id: ID of the dictionary
+        :return Bytes of the dictionary, or None if there is no such
+                dictionary
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT dictionary FROM body_dictionaries WHERE id = ?
+        ''', (dictionary_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def fetch_last_body_dictionary_id(self):
+        """
+        :return ID of the most recently trained dictionary, or None if none
+                has been trained
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT max(id) FROM body_dictionaries
+        ''')
+        return cursor.fetchone()[0]
+
+    def vacuum(self):
+        """
+        Rebuilds the database file, returning the space of deleted and
+        shrunken rows to the file system.
+        """
+        self.db.commit()
+        self.db.execute('VACUUM')
+
+    ########################################
+    # Sync Journal
+    ########################################
+
+    def create_sync_run(self, command):
+        """
+        Starts a new run of the named command in the journal.
+
+        :param command: Name of the command being run
+        :returns: ID of the new run
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+            INSERT into sync_runs (command, started_at) values(?, ?)
+        ''', (command, time.time()))
+        self._commit()
+        return cursor.lastrowid
+
+    def finish_sync_run(self, run_id):
+        """
+        Marks a run as having run to the end, and forgets the items it
+        synced, keeping those that failed so that they can be retried.
+
+        :param run_id: ID of the run
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+            UPDATE sync_runs SET finished_at = ? WHERE id = ?
+        ''', (time.time(), run_id))
+        cursor.execute('''
+            DELETE FROM sync_jobs WHERE run_id = ? AND state = 'done'
+        ''', (run_id,))
+        self._commit()
+
+    def fetch_last_sync_run(self, command, unfinished=False):
+        """
+        Fetches the most recently started run of the named command.
+
+        :param command: Name of the command
+        :param unfinished: Whether to only fetch a run that has not finished
+        :returns: ID of the run, or None if the command was never run, or
+                  its last run finished when only unfinished runs are
+                  fetched
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT id, finished_at FROM sync_runs WHERE command = ?
+        ORDER BY id DESC LIMIT 1
+        ''', (command,))
+        row = cursor.fetchone()
+        if row is None or (unfinished and row[1] is not None):
+            return None
+        return row[0]
+
+    def save_sync_jobs(self, run_id, task, items):
+        """
+        Records items that a run is going to sync with a task, as pending.
+        Items already recorded for the run and task are left untouched.
+
+        :param run_id: ID of the run
+        :param task: Name of the task the items are synced with
+        :param items: List of items, each encoded as JSON
+        """
+        now = time.time()
+        cursor = self.db.cursor()
+        cursor.executemany('''
+            INSERT OR IGNORE into sync_jobs
+            (run_id, task, item, state, updated_at)
+            values(?, ?, ?, 'pending', ?)
+        ''', [(run_id, task, item, now) for item in items])
+        self._commit()
+
+    def update_sync_job(self, run_id, task, item, state, error=None):
+        """
+        Records an attempt to sync an item, and its outcome.
+
+        :param run_id: ID of the run
+        :param task: Name of the task the item was synced with
+        :param item: The item, encoded as JSON
+        :param state: 'done' or 'failed'
+        :param error: Description of why the attempt failed, if it did
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+            UPDATE sync_jobs
+            SET state = ?, error = ?, attempts = attempts + 1, updated_at = ?
+            WHERE run_id = ? AND task = ? AND item = ?
+        ''', (state, error, time.time(), run_id, task, item))
+        self._commit()
+
+    def settle_sync_job(self, run_id, task, item, writes):
+        """
+        Records an item as done, or as failed if any of the writes its task
+        queued failed.
+
+        :param run_id: ID of the run
+        :param task: Name of the task the item was synced with
+        :param item: The item, encoded as JSON
+        :param writes: Futures of the writes the item's task queued to a
+                       Writer before this one. Any not yet resolved are part
+                       of the same transaction as this write, and so succeed
+                       or fail along with it.
+        """
+        errors = [write.exception() for write in writes
+                  if write.done() and write.exception() is not None]
+        if errors:
+            self.update_sync_job(run_id, task, item, 'failed', '%s: %s' %
+                                 (type(errors[0]).__name__, errors[0]))
+        else:
+            self.update_sync_job(run_id, task, item, 'done')
+
+    def fetch_sync_job_state(self, run_id, task, item):
+        """
+        :param run_id: ID of the run
+        :param task: Name of the task the item is synced with
+        :param item: The item, encoded as JSON
+        :returns: State of the item, or None if it is not in the journal
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT state FROM sync_jobs WHERE run_id = ? AND task = ? AND item = ?
+        ''', (run_id, task, item))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def fetch_last_sync_job_rowid(self, run_id, task):
+        """
+        :param run_id: ID of the run
+        :param task: Name of the task the items are synced with
+        :return Rowid of the item of the run and task journaled last, or 0
+                if there are none
+        """
+        cursor = self.db.cursor()
+        cursor.execute('''
+        SELECT coalesce(max(rowid), 0)
+        FROM sync_jobs
+        WHERE run_id = ? AND task = ?
+        ''', (run_id, task))
+        return cursor.fetchone()[0]
+
+    def iter_sync_jobs(self, run_id, task, state, through_rowid=None,
+                       page_size=1000):
+        """
+        Iterates over the items of a run and task that are in a state. Items
+        are read a page at a time, as in iter_empty_group_messages.
+
+        :param run_id: ID of the run
+        :param task: Name of the task the items are synced with
+        :param state: 'pending', 'done' or 'failed'
+        :param through_rowid: Rowid of the last item to read, such as from
+                              fetch_last_sync_job_rowid, so that items
+                              journaled while iterating are left out. Reads
+                              every item if None.
+        :param page_size: Number of items to read at a time
+        :return Iterator of items, each encoded as JSON
+        """
+        cursor = self.db.cursor()
+        last_rowid = 0
+        while True:
+            cursor.execute('''
+            SELECT rowid, item
+            FROM sync_jobs
+            WHERE run_id = ? AND task = ? AND state = ? AND rowid > ?
+                AND (? IS NULL OR rowid <= ?)
+            ORDER BY rowid
+            LIMIT ?
+            ''', (run_id, task, state, last_rowid, through_rowid,
+                  through_rowid, page_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+
+            last_rowid = rows[-1][0]
+            for row in rows:
+                yield row[1]
@@ -0,0 +1,281 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+import logging
+from queue import Empty, Queue
+from threading import Thread
+import time
+
+from backup.store.sqlite import Store
+from backup.utils.email_message_utility import EmailMessageUtility
+
+logger = logging.getLogger(__name__)
+
+# Store methods whose messages have metadata derived from their bodies, and
+# the position of the messages among their arguments
+PARSED_WRITES = {'create_group_messages': 1, 'update_group_messages': 0}
+
+email_message_utility = EmailMessageUtility()
+
+
+def get_message_metadata(body):
+    """
+    Derives the metadata of a message body, in a parsing process.
+    """
+    return email_message_utility.get_message_metadata(body)
+
+
+class Writer:
+    # Notes on the writer:
+    # - workers hand their writes to the writer through a queue rather than
+    #   applying them on their own connections, so only one connection ever
+    #   contends for the SQLite write lock;
+    # - queued writes are applied in batches, each in a single transaction.
+    #   A batch is flushed once `batch_size` writes are waiting, or
+    #   `flush_interval` seconds after its first write was queued;
+    # - if a batch fails, its writes are retried one at a time, so a single
+    #   bad write does not lose the rest of the batch;
+    # - if given parse processes, the metadata of every message body in a
+    #   batch is derived in a pool of processes before the batch is applied,
+    #   rather than by the store on the writer thread. Parsing headers is
+    #   pure Python, so on the writer thread it would hold the GIL the
+    #   workers need to keep requests in flight.
+    def __init__(self, db_file, batch_size=500, flush_interval=1.0,
+                 max_pending=10000, parse_processes=0):
+        """
+        Applies writes queued from any thread to the store on a single
+        connection, owned by a dedicated thread.
+
+        :param db_file: Path to the database to write to
+        :param batch_size: Most writes to apply in one transaction
+        :param flush_interval: Most seconds a queued write waits for a batch
+                               to fill
+        :param max_pending: Most writes that may be queued before submitting
+                            blocks
+        :param parse_processes: Number of processes to derive the metadata of
+                                message bodies in, or 0 to leave it to the
+                                store
+        """
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.parse_processes = parse_processes
+        self.queue = Queue(max_pending)
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = Thread(target=self.run)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Flushes every queued write, then stops the writer thread.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, method, *args):
+        """
+        Queues a call to the named write method of the store.
+
+        :param method: Name of the Store method to call
+        :param args: Arguments to call the method with
+        :returns: Future of the method's result, resolved once the write has
+                  been committed.
+        """
+        future = Future()
+        self.queue.put((method, args, future))
+        return future
+
+    def run(self):
+        pool = ProcessPoolExecutor(self.parse_processes) \
+            if self.parse_processes else None
+        try:
+            with Store(self.db_file) as store:
+                self.drain(store, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def drain(self, store, pool):
+        """
+        Applies queued writes in batches until the writer is closed.
+
+        :param store: Store to apply the writes to
+        :param pool: Pool of processes to parse message bodies in, if any
+        """
+        closed = False
+        while not closed:
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else \
+                    max(0, deadline - time.monotonic())
+                try:
+                    write = self.queue.get(timeout=timeout)
+                except Empty:
+                    break
+
+                if write is None:
+                    closed = True
+                    break
+
+                batch.append(write)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch:
+                if pool is not None:
+                    batch = self.parse(pool, batch)
+                self.flush(store, batch)
+
+    def parse(self, pool, batch):
+        """
+        Derives the metadata of every message body in a batch of writes, in
+        parallel. Should parsing fail, the batch is returned as it was, for
+        the store to parse.
+
+        :param pool: Pool of processes to parse bodies in
+        :param batch: List of (method, args, future) writes
+        :returns: List of the writes, their messages carrying their metadata
+        """
+        parsed = []
+        messages = []
+        for method, args, future in batch:
+            if method in PARSED_WRITES:
+                # Copy the messages rather than updating the caller's
+                args = list(args)
+                position = PARSED_WRITES[method]
+                items = args[position] if type(args[position]) is list \
+                    else [args[position]]
+                args[position] = [dict(item) if type(item) is dict else item
+                                  for item in items]
+                messages += [item for item in args[position]
+                             if type(item) is dict and
+                             item.get('body') is not None and
+                             'from_address' not in item]
+                args = tuple(args)
+            parsed.append((method, args, future))
+
+        try:
+            chunksize = max(1, len(messages) // (self.parse_processes * 4))
+            metadata = list(pool.map(get_message_metadata,
+                                     [message['body'] for message in messages],
+                                     chunksize=chunksize))
+        except Exception as e:
+            logger.warning("Parsing %i messages failed, leaving them to the "
+                           "store: %s" % (len(messages), e))
+            return batch
+
+        for message, columns in zip(messages, metadata):
+            message.update(columns)
+        return parsed
+
+    def flush(self, store, batch):
+        """
+        Applies a batch of writes in a single transaction.
+
+        :param store: Store to apply the writes to
+        :param batch: List of (method, args, future) writes
+        """
+        try:
+            with store.transaction():
+                results = [getattr(store, method)(*args)
+                           for method, args, _ in batch]
+        except Exception:
+            logger.warning("Batch of %i writes failed, retrying them "
+                           "individually" % len(batch))
+            for write in batch:
+                self.apply(store, write)
+            return
+
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def apply(self, store, write):
+        method, args, future = write
+        try:
+            with store.transaction():
+                result = getattr(store, method)(*args)
+        except Exception as e:
+            logger.exception(e)
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+
+class QueuedStore(Store):
+    """
+    A Store whose writes are handed to a Writer instead of being applied on
+    its own connection. Reads still use its own connection, so they only see
+    writes that the Writer has already committed. Each write returns a Future
+    of the underlying Store method's result.
+    """
+
+    def __init__(self, db_file, writer):
+        super().__init__(db_file)
+        self.writer = writer
+
+    def save_group_members(self, group_id, members):
+        return self.writer.submit('save_group_members', group_id, members)
+
+    def create_group_messages(self, group_id, messages):
+        return self.writer.submit('create_group_messages', group_id, messages)
+
+    def update_group_messages(self, messages):
+        return self.writer.submit('update_group_messages', messages)
+
+    def save_group_message_month(self, group_id, month, fetched_at, closed):
+        return self.writer.submit('save_group_message_month', group_id, month,
+                                  fetched_at, closed)
+
+    def create_group_messages_of_month(self, group_id, month, messages,
+                                       fetched_at, closed):
+        return self.writer.submit('create_group_messages_of_month', group_id,
+                                  month, messages, fetched_at, closed)
+
+    def save_member_profile(self, profile):
+        return self.writer.submit('save_member_profile', profile)
+
+    def save_sync_jobs(self, run_id, task, items):
+        return self.writer.submit('save_sync_jobs', run_id, task, items)
+
+    def update_sync_job(self, run_id, task, item, state, error=None):
+        return self.writer.submit('update_sync_job', run_id, task, item,
+                                  state, error)
+
+    def settle_sync_job(self, run_id, task, item, writes):
+        return self.writer.submit('settle_sync_job', run_id, task, item,
+                                  writes)
+
+
+# Methods of QueuedStore that queue writes
+QUEUED_WRITES = {name for name in vars(QueuedStore)
+                 if not name.startswith('_')}
+
+
+class RecordingStore:
+    """
+    Passes every call through to a QueuedStore, keeping the Futures of the
+    writes made through it, so the item a task syncs can be journaled by
+    whether the writes it queued succeed.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        if name not in QUEUED_WRITES:
+            return method
+
+        def write(*args):
+            future = method(*args)
+            self.writes.append(future)
+            return future
+        return write
@@ -1,15 +1,174 @@
+import asyncio
+import calendar
+import json
 import logging
 from multiprocessing import cpu_count, Value
-from queue import Empty, Queue
-import random
+from queue import Queue
 from threading import Thread
 import time
 
-from backup.client.edemocracy import EDemocracyClient
-from backup.store.sqlite import Store
+from backup.client.edemocracy import AsyncEDemocracyClient, \
+    EDemocracyClient
+from backup.store.writer import QueuedStore, RecordingStore, Writer
 
 logger = logging.getLogger(__name__)
 
+# Placed on a work queue, once per worker, after the last item
+DONE = object()
+
+# Messages can still turn up in a month for a while after it ends, so a
+# month's message IDs are only final once fetched this many seconds after
+# the month ended.
+MONTH_CLOSE_DELAY = 8 * 24 * 60 * 60
+
+
+def is_month_closed(month, fetched_at):
+    """
+    :param month: Month, in the format YYYYMM
+    :param fetched_at: Time the month's message IDs were fetched, in seconds
+                       since the epoch
+    :returns: True if no more messages are expected in the month
+    """
+    year, month = int(month[:4]), int(month[4:])
+    end = calendar.timegm((year + month // 12, month % 12 + 1, 1, 0, 0, 0))
+    return fetched_at >= end + MONTH_CLOSE_DELAY
+
+
+def open_months(group, months, store):
+    """
+    :returns: List of dicts of arguments for message_ids_of_group_and_month,
+              one for each of the months that is not closed in the store
+    """
+    closed = {month for month, (_, is_closed)
+              in store.fetch_group_message_months(group).items()
+              if is_closed}
+    return [{'group': group, 'month': month}
+            for month in months if month not in closed]
+
+
+def concurrency_note(concurrency_limiter):
+    """
+    :param concurrency_limiter: ConcurrencyLimiter of a sync, if any
+    :returns: Note of the current concurrency limit, for progress logs
+    """
+    if concurrency_limiter is None:
+        return ''
+    return ' at concurrency %i' % concurrency_limiter.limit
+
+
+class Journal:
+    # Notes on the journal:
+    # - every item a runner syncs is recorded in the store, per run and
+    #   task, as pending when it is queued, then as done or failed, with
+    #   the error and number of attempts, once its task returns;
+    # - an item whose task returned is journaled through the writer after
+    #   the writes its task queued, as failed if any of them failed, so an
+    #   item is never left done when its data was not saved;
+    # - a resumed run walks its items again, skipping those already done
+    #   or failed, and picks the pending items of later pipeline stages
+    #   back up from the journal, as they stood when it started, so items
+    #   the run produces itself are not also picked back up;
+    # - a retried run only syncs the items that failed;
+    # - journal writes go through the runner's store, so the writer
+    #   batches them along with the writes of the tasks themselves.
+    def __init__(self, run_id, mode='new'):
+        """
+        Records the progress of a run of a command.
+
+        :param run_id: ID of the run in the store
+        :param mode: 'new' for a run that is just starting, 'resume' to carry
+                     on a run that stopped, or 'retry' to sync the items that
+                     failed in a run again
+        """
+        self.run_id = run_id
+        self.mode = mode
+
+    @staticmethod
+    def encode(item):
+        return json.dumps(item, sort_keys=True)
+
+    def sources(self, task, items, store):
+        """
+        Journals and yields the provided items of the first stage of a run,
+        leaving out those this run has already synced.
+
+        :param task: Name of the task the items are synced with
+        :param items: Items of the run
+        :param store: Store to journal to
+        :returns: Iterator of items to sync
+        """
+        if self.mode == 'retry':
+            for item in self.backlog(task, store):
+                yield item
+            return
+
+        for item in items:
+            key = self.encode(item)
+            state = None if self.mode == 'new' else \
+                store.fetch_sync_job_state(self.run_id, task, key)
+            if state is None:
+                store.save_sync_jobs(self.run_id, task, [key])
+            elif state != 'pending':
+                continue
+            yield item
+
+    def backlog(self, task, store):
+        """
+        Finds the journaled items of a task that are still to be synced:
+        pending items when resuming, or failed items when retrying. Only
+        items journaled before this is called are found, so items produced
+        by the run as it goes are not synced again from the journal.
+
+        :param task: Name of the task the items are synced with
+        :param store: Store to read the journal from
+        :returns: Iterator of items to sync
+        """
+        state = {'resume': 'pending', 'retry': 'failed'}.get(self.mode)
+        if state is None:
+            return iter([])
+
+        # Bound the items now, rather than once iterating starts
+        keys = store.iter_sync_jobs(
+            self.run_id, task, state,
+            store.fetch_last_sync_job_rowid(self.run_id, task))
+        return (json.loads(key) for key in keys)
+
+    def produced(self, task, items, store):
+        """
+        Journals items returned by one pipeline stage for the next.
+
+        :param task: Name of the task the items are synced with
+        :param items: Items returned
+        :param store: Store to journal to
+        :returns: List of the items that were not already journaled
+        """
+        new = [item for item in items
+               if self.mode == 'new' or store.fetch_sync_job_state(
+                   self.run_id, task, self.encode(item)) is None]
+        if new:
+            store.save_sync_jobs(self.run_id, task,
+                                 [self.encode(item) for item in new])
+        return new
+
+    def done(self, task, item, store):
+        store.update_sync_job(self.run_id, task, self.encode(item), 'done')
+
+    def settle(self, task, item, writes, store):
+        """
+        Journals an item whose task returned as done, unless any of the
+        writes it queued fail, in which case it is journaled as failed.
+
+        :param task: Name of the task the item was synced with
+        :param item: Item synced
+        :param writes: Futures of the writes the task queued
+        :param store: QueuedStore to journal to, after the writes
+        """
+        store.settle_sync_job(self.run_id, task, self.encode(item), writes)
+
+    def failed(self, task, item, error, store):
+        store.update_sync_job(self.run_id, task, self.encode(item), 'failed',
+                              '%s: %s' % (type(error).__name__, error))
+
 
 class Sync:
     def group_members(group, client, store):
@@ -40,75 +199,441 @@ class Sync:
                      'month': Month of the group to sync, in the format YYYYMM
         :param client: Client to sync from
         :param store: Store to sync to
+        :returns: List of the message IDs of the group and month
         """
-        store.create_group_messages(args['group'],
-            client.get_messages_of_group_and_month(args['group'],
-                                                   args['month']))
+        fetched_at = time.time()
+        messages = client.get_messages_of_group_and_month(
+            args['group'], args['month'])
+        store.create_group_messages_of_month(
+            args['group'], args['month'], messages, fetched_at,
+            is_month_closed(args['month'], fetched_at))
+        return messages
 
     def message(args, client, store):
         """
         Syncs an individual message from a group.
 
-        :param args: Dict of arguments for the sync. Arguments include:
-                     'group_id': ID of the group to sync
-                     'message_id': ID of the message to sync.
+        :param args: Tuple of the ID of the message to sync, and the ID of the
+                     group to sync it from.
         :param client: Client to sync from
         :param store: Store to sync to
         """
+        message_id, group_id = args
         store.update_group_messages({
-            'id': args['message_id'],
-            'body': client.get_message_of_group(args['group_id'],
-                                                args['message_id'])
+            'id': message_id,
+            'body': client.get_message_of_group(group_id, message_id)
+        })
+
+
+class AsyncSync:
+    # Coroutine counterparts of Sync, for use with an AsyncEDemocracyClient.
+    async def group_members(group, client, store):
+        """
+        Syncs the membership of provided group.
+        :param groups: ID of the group to sync
+        :param client: Async client to sync from
+        :param store: Store to sync to
+        """
+        store.save_group_members(group, await client.get_group_members(group))
+
+    async def member_profile(member, client, store):
+        """
+        Syncs the profile of the provided member.
+        :param members: ID of the member to sync
+        :param client: Async client to sync from
+        :param store: Store to sync to
+        """
+        store.save_member_profile(await client.get_profile_of_member(member))
+
+    async def message_ids_of_group_and_month(args, client, store):
+        """
+        Saves all of the message ids of the given group and month from
+        the client to the store.
+
+        :param args: Dict of arguments for the sync. Arguments include:
+                     'group': ID of the group to sync
+                     'month': Month of the group to sync, in the format YYYYMM
+        :param client: Async client to sync from
+        :param store: Store to sync to
+        :returns: List of the message IDs of the group and month
+        """
+        fetched_at = time.time()
+        messages = await client.get_messages_of_group_and_month(
+            args['group'], args['month'])
+        store.create_group_messages_of_month(
+            args['group'], args['month'], messages, fetched_at,
+            is_month_closed(args['month'], fetched_at))
+        return messages
+
+    async def new_messages_of_group_and_month(args, client, store):
+        """
+        Saves all of the message ids of the given group and month from
+        the client to the store, as message_ids_of_group_and_month does.
+
+        :param args: Dict of arguments for the sync, as for
+                     message_ids_of_group_and_month
+        :param client: Async client to sync from
+        :param store: Store to sync to
+        :returns: List of arguments for message, one for each message of the
+                  group and month that does not yet have a body
+        """
+        messages = await AsyncSync.message_ids_of_group_and_month(
+            args, client, store)
+        return [(message_id, args['group']) for message_id
+                in store.filter_empty_group_messages(messages)]
+
+    async def message_months_of_group(group, client, store):
+        """
+        Finds the months that the given group has messages in.
+
+        :param group: ID of the group to find months of
+        :param client: Async client to sync from
+        :param store: Store to sync to
+        :returns: List of dicts of arguments for
+                  message_ids_of_group_and_month, one for each month
+        """
+        return [{'group': group, 'month': month}
+                for month in await client.get_message_months_of_group(group)]
+
+    async def open_message_months_of_group(group, client, store):
+        """
+        Finds the months that the given group has messages in, leaving out
+        months that are closed in the store.
+
+        :param group: ID of the group to find months of
+        :param client: Async client to sync from
+        :param store: Store to sync to
+        :returns: List of dicts of arguments for
+                  message_ids_of_group_and_month, one for each month
+                  still to be fetched
+        """
+        return open_months(group,
+                           await client.get_message_months_of_group(group),
+                           store)
+
+    async def message(args, client, store):
+        """
+        Syncs an individual message from a group.
+
+        :param args: Tuple of the ID of the message to sync, and the ID of the
+                     group to sync it from.
+        :param client: Async client to sync from
+        :param store: Store to sync to
+        """
+        message_id, group_id = args
+        store.update_group_messages({
+            'id': message_id,
+            'body': await client.get_message_of_group(group_id, message_id)
         })
 
 
 class Threaded:
     # Notes on multithreaded steps:
-    # - item lists act as a work queue for syncing;
-    # - each worker has it's own client (request sessions are not thread safe);
+    # - items are streamed into a bounded work queue by the calling thread as
+    #   workers take them, so items may come from a store cursor opened on
+    #   that thread and are never all held in memory at once;
+    # - each worker has it's own client (request sessions are not thread safe),
+    #   but every client draws from the master client's rate limiter;
     # - every worker has it's own data store (sqlite objects are not
-    #   threadsafe, though file access is thread safe).
-    def __init__(self, func, items, master_client, db_path):
+    #   threadsafe, though file access is thread safe), but hands its writes
+    #   to a single shared writer, which commits them in batches;
+    # - if given a journal, the progress of every item is recorded in it;
+    # - there is one worker per CPU, unless given a concurrency limiter, in
+    #   which case there is one for each request it could allow in flight,
+    #   and the limiter decides how many of them are making requests;
+    # - if given parse processes, the writer parses message bodies in that
+    #   many processes, rather than on a thread competing with the workers.
+    def __init__(self, func, items, master_client, db_path, total=None,
+                 max_pending=1000, journal=None, concurrency_limiter=None,
+                 parse_processes=0):
         self.func = func
+        self.items = items
         self.master_client = master_client
         self.db_path = db_path
-        self.queue = Queue()
-
-        for item in items:
-            self.queue.put(item)
+        self.queue = Queue(max_pending)
+        self.journal = journal
+        self.concurrency_limiter = concurrency_limiter
+        self.parse_processes = parse_processes
+        self.workers = cpu_count() if concurrency_limiter is None \
+            else concurrency_limiter.maximum
 
         self.current_count = Value('i', 0)
-        self.total_count = Value('i', self.queue.qsize())
+        self.total_count = Value('i', len(items) if total is None else total)
 
-    def worker(func, queue, master_client, db_path,
-               current_count, total_count):
+    def worker(func, queue, master_client, db_path, writer,
+               current_count, total_count, journal=None,
+               concurrency_limiter=None):
         client = EDemocracyClient(master_client)
-        with Store(db_path) as store:
+        with QueuedStore(db_path, writer) as store:
             while True:
-                try:
-                    item = queue.get(False)
-                except Empty:
+                item = queue.get()
+                if item is DONE:
                     break
 
                 with current_count.get_lock():
                     current_count.value += 1
-                    logger.info("Syncing item %s of %s" %
-                                (current_count.value, total_count.value))
+                    logger.info("Syncing item %s of %s%s" %
+                                (current_count.value, total_count.value,
+                                 concurrency_note(concurrency_limiter)))
 
+                task_store = store if journal is None else \
+                    RecordingStore(store)
                 try:
-                    func(item, client, store)
+                    func(item, client, task_store)
                 except Exception as e:
                     logger.exception(e)
-                finally:
-                    queue.task_done()
-                    time.sleep(random.uniform(0.5, 1.5))
+                    if journal is not None:
+                        journal.failed(func.__name__, item, e, store)
+                else:
+                    if journal is not None:
+                        journal.settle(func.__name__, item,
+                                       task_store.writes, store)
+
+    def __call__(self):
+        with Writer(self.db_path,
+                    parse_processes=self.parse_processes) as writer:
+            workers = [Thread(target=Threaded.worker,
+                              args=(self.func, self.queue,
+                                    self.master_client, self.db_path,
+                                    writer, self.current_count,
+                                    self.total_count, self.journal,
+                                    self.concurrency_limiter))
+                       for i in range(self.workers)]
+            for worker in workers:
+                worker.start()
+
+            try:
+                with QueuedStore(self.db_path, writer) as store:
+                    items = self.items if self.journal is None else \
+                        self.journal.sources(self.func.__name__, self.items,
+                                             store)
+                    for item in items:
+                        self.queue.put(item)
+            finally:
+                for worker in workers:
+                    self.queue.put(DONE)
+                for worker in workers:
+                    worker.join()
+
+
+class Asynchronous:
+    # Notes on asyncio steps:
+    # - items are streamed into a bounded work queue as workers take them,
+    #   so items may come from a store cursor and are never all held in
+    #   memory at once;
+    # - every worker is a coroutine on one event loop in the calling thread,
+    #   so up to `concurrency` requests are in flight without extra threads;
+    # - workers share one client, whose connection pool is sized to the
+    #   concurrency limit, and which draws from the master client's rate
+    #   limiter;
+    # - workers share one data store, as only one of them runs at a time;
+    #   its writes are handed to a writer thread, which commits them in
+    #   batches without blocking the event loop;
+    # - if given a journal, the progress of every item is recorded in it;
+    # - if given a concurrency limiter, it decides how many of the workers
+    #   are making requests at once;
+    # - if given parse processes, the writer parses message bodies in that
+    #   many processes, rather than on a thread competing with the event
+    #   loop.
+    def __init__(self, func, items, master_client, db_path, concurrency=100,
+                 total=None, max_pending=1000, journal=None,
+                 concurrency_limiter=None, parse_processes=0):
+        self.func = func
+        self.items = items
+        self.master_client = master_client
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.journal = journal
+        self.concurrency_limiter = concurrency_limiter
+        self.parse_processes = parse_processes
+
+        self.current_count = 0
+        self.total_count = len(items) if total is None else total
+
+    async def feed(self, queue, workers, store):
+        items = self.items if self.journal is None else \
+            self.journal.sources(self.func.__name__, self.items, store)
+        try:
+            for item in items:
+                await queue.put(item)
+        finally:
+            for i in range(workers):
+                await queue.put(DONE)
+
+    async def worker(self, queue, client, store):
+        while True:
+            item = await queue.get()
+            if item is DONE:
+                break
+
+            self.current_count += 1
+            logger.info("Syncing item %s of %s%s" %
+                        (self.current_count, self.total_count,
+                         concurrency_note(self.concurrency_limiter)))
+
+            task_store = store if self.journal is None else \
+                RecordingStore(store)
+            try:
+                await self.func(item, client, task_store)
+            except Exception as e:
+                logger.exception(e)
+                if self.journal is not None:
+                    self.journal.failed(self.func.__name__, item, e, store)
+            else:
+                if self.journal is not None:
+                    self.journal.settle(self.func.__name__, item,
+                                        task_store.writes, store)
+
+    async def run(self):
+        queue = asyncio.Queue(self.max_pending)
+        workers = max(1, min(self.concurrency, self.total_count))
+
+        async with AsyncEDemocracyClient(self.master_client,
+                                         self.concurrency) as client:
+            with Writer(self.db_path,
+                        parse_processes=self.parse_processes) as writer, \
+                    QueuedStore(self.db_path, writer) as store:
+                await asyncio.gather(
+                    self.feed(queue, workers, store),
+                    *[self.worker(queue, client, store)
+                      for i in range(workers)])
+
+    def __call__(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.run())
+        finally:
+            loop.close()
+
+
+class Pipeline:
+    # Notes on pipelined steps:
+    # - a pipeline is a chain of stages, each running its own AsyncSync
+    #   task; there is no threaded pipeline. The first stage's items are
+    #   those provided; every later stage's items are those returned by the
+    #   tasks of the stage before it;
+    # - stages are connected by bounded work queues, and an item is passed
+    #   on as soon as the task that returned it finishes, so stages overlap
+    #   rather than each waiting for the whole of the stage before;
+    # - every stage has up to `concurrency` workers, all coroutines sharing
+    #   one client, whose connection pool bounds the requests in flight
+    #   across every stage, and one data store, as with Asynchronous;
+    # - if given a journal, the progress of every item of every stage is
+    #   recorded in it, and items a resumed or retried run picks back up
+    #   from the journal are fed into their own stage alongside those
+    #   passed on from the stage before;
+    # - if given a concurrency limiter, it decides how many of the workers
+    #   of every stage are making requests at once;
+    # - if given parse processes, the writer parses message bodies in that
+    #   many processes, rather than on a thread competing with the event
+    #   loop.
+    def __init__(self, funcs, items, master_client, db_path, concurrency=100,
+                 total=None, max_pending=1000, journal=None,
+                 concurrency_limiter=None, parse_processes=0):
+        self.funcs = funcs
+        self.items = items
+        self.master_client = master_client
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.journal = journal
+        self.concurrency_limiter = concurrency_limiter
+        self.parse_processes = parse_processes
+
+        self.current_counts = [0 for func in funcs]
+        self.total_counts = [len(items) if total is None else total] + \
+            [0 for func in funcs[1:]]
+
+    async def feed(self, queue, store):
+        items = self.items if self.journal is None else \
+            self.journal.sources(self.funcs[0].__name__, self.items, store)
+        try:
+            for item in items:
+                await queue.put(item)
+        finally:
+            for i in range(self.concurrency):
+                await queue.put(DONE)
+
+    async def feed_backlog(self, stage, queue, items):
+        for item in items:
+            self.total_counts[stage] += 1
+            await queue.put(item)
+
+    async def worker(self, stage, queue, next_queue, client, store):
+        func = self.funcs[stage]
+        while True:
+            item = await queue.get()
+            if item is DONE:
+                break
+
+            self.current_counts[stage] += 1
+            logger.info("Syncing %s item %s of %s found so far%s" %
+                        (func.__name__, self.current_counts[stage],
+                         self.total_counts[stage],
+                         concurrency_note(self.concurrency_limiter)))
+
+            task_store = store if self.journal is None else \
+                RecordingStore(store)
+            try:
+                results = await func(item, client, task_store)
+            except Exception as e:
+                logger.exception(e)
+                if self.journal is not None:
+                    self.journal.failed(func.__name__, item, e, store)
+                continue
+
+            results = results or []
+            if next_queue is not None and self.journal is not None:
+                results = self.journal.produced(
+                    self.funcs[stage + 1].__name__, results, store)
+            if self.journal is not None:
+                self.journal.settle(func.__name__, item, task_store.writes,
+                                    store)
+
+            if next_queue is not None:
+                for result in results:
+                    self.total_counts[stage + 1] += 1
+                    await next_queue.put(result)
+
+    async def stage(self, stage, queues, backlogs, client, store):
+        next_queue = queues[stage + 1] if stage + 1 < len(queues) else None
+        try:
+            await asyncio.gather(*[
+                self.worker(stage, queues[stage], next_queue, client, store)
+                for i in range(self.concurrency)])
+        finally:
+            if next_queue is not None:
+                # The next stage may still be picking items back up from the
+                # journal, which must all be queued before its workers stop
+                await backlogs[stage + 1]
+                for i in range(self.concurrency):
+                    await next_queue.put(DONE)
+
+    async def run(self):
+        queues = [asyncio.Queue(self.max_pending) for func in self.funcs]
+
+        async with AsyncEDemocracyClient(self.master_client,
+                                         self.concurrency) as client:
+            with Writer(self.db_path,
+                        parse_processes=self.parse_processes) as writer, \
+                    QueuedStore(self.db_path, writer) as store:
+                # The backlog of each stage is bounded before any stage
+                # runs, so it leaves out the items this run produces
+                backlogs = [None] + [
+                    asyncio.ensure_future(self.feed_backlog(
+                        stage, queues[stage],
+                        [] if self.journal is None else self.journal.backlog(
+                            self.funcs[stage].__name__, store)))
+                    for stage in range(1, len(self.funcs))]
+                await asyncio.gather(
+                    self.feed(queues[0], store),
+                    *[self.stage(stage, queues, backlogs, client, store)
+                      for stage in range(len(self.funcs))])
 
     def __call__(self):
-        for i in range(cpu_count()):
-            worker = Thread(target=Threaded.worker,
-                            args=(self.func, self.queue,
-                                  self.master_client, self.db_path,
-                                  self.current_count, self.total_count))
-            worker.start()
-
-        self.queue.join()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.run())
+        finally:
+            loop.close()
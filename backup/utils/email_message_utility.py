@@ -1,17 +1,198 @@
-from email.parser import HeaderParser
-from email.utils import parseaddr
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser, HeaderParser
+from email.utils import mktime_tz, parseaddr, parsedate_tz
+import re
+
+# Matches the header block of a message up to and including its first From
+# header, capturing the header's value along with any folded lines. Header
+# names are as email.feedparser accepts them; any other line ends the match.
+# Lines are matched up to their line break, never across it, so each line of
+# a block can only be matched one way and a failed match does not backtrack
+# through every way of splitting CRLF line endings.
+LINE = r'[^\r\n]*'
+SENDER_PATTERN = (r'(?:From ' + LINE + r'\r?\n)?'
+                  r'(?:[\x21-\x39\x3b-\x7e]*:' + LINE + r'\r?\n|'
+                  r'[ \t]' + LINE + r'\r?\n)*?'
+                  r'from:(' + LINE + r'(?:\r?\n[ \t]' + LINE + r')*)')
+SENDER = re.compile(SENDER_PATTERN, re.IGNORECASE)
+BYTES_SENDER = re.compile(SENDER_PATTERN.encode('ascii'), re.IGNORECASE)
+# Matches the whole header block of a message, and each header within it
+HEADER_BLOCK_PATTERN = (r'(?:From ' + LINE + r'\r?\n)?'
+                        r'(?:[\x21-\x39\x3b-\x7e]*:' + LINE + r'\r?\n|'
+                        r'[ \t]' + LINE + r'\r?\n)*')
+HEADER_PATTERN = (r'^([\x21-\x39\x3b-\x7e]*):(' + LINE +
+                  r'(?:\r?\n[ \t]' + LINE + r')*)')
+HEADER_BLOCK = re.compile(HEADER_BLOCK_PATTERN)
+BYTES_HEADER_BLOCK = re.compile(HEADER_BLOCK_PATTERN.encode('ascii'))
+HEADER = re.compile(HEADER_PATTERN, re.MULTILINE)
+BYTES_HEADER = re.compile(HEADER_PATTERN.encode('ascii'), re.MULTILINE)
+MESSAGE_ID = re.compile(r'<([^>]*)>')
+# Headers that metadata is read from
+METADATA_HEADERS = ('from', 'date', 'message-id', 'subject', 'in-reply-to')
+FOLD = re.compile(r'\r?\n')
+BYTES_FOLD = re.compile(br'\r?\n')
+ASCII = re.compile(r'[\x00-\x7f]*\Z')
 
 
 class EmailMessageUtility:
+    # Notes on sender extraction:
+    # - the stdlib parsers build a Message of every header just to read one,
+    #   so the From header is found with a single regular expression match
+    #   instead, which stops at the first From header;
+    # - anything the match can't vouch for is handed to the stdlib parser:
+    #   messages with no From header among well formed headers, and senders
+    #   with non-ASCII addresses;
+    # - RFC 2047 encoded words are only decoded when the address itself is
+    #   inside one, as display names are never needed;
+    # - metadata is read in a single pass over the header block, picking
+    #   out the first of each header needed, and likewise falls back to the
+    #   stdlib parser when the block has no From header.
     def __init__(self):
         self.hp = HeaderParser()
+        self.bhp = BytesHeaderParser()
 
     def get_sender_address(self, msg):
         """
         Get the email address of the sender of a message.
 
-        :param msg: Complete email message with headers as a string
+        :param msg: Complete email message with headers, as raw bytes or a
+                    string
         :returns: Email address of the sender as a string
         """
-        headers = self.hp.parsestr(msg)
-        return parseaddr(headers['from'])[1]
+        if isinstance(msg, bytes):
+            match = BYTES_SENDER.match(msg)
+            sender = BYTES_FOLD.sub(b'', match.group(1)).decode(
+                'ascii', 'surrogateescape') if match else None
+        else:
+            match = SENDER.match(msg)
+            sender = FOLD.sub('', match.group(1)) if match else None
+
+        return self._sender_address(msg, sender)
+
+    def get_message_metadata(self, msg):
+        """
+        Get the metadata of a message that the store indexes: its sender,
+        date, Message-ID, subject and the message it replies to.
+
+        :param msg: Complete email message with headers, as raw bytes or a
+                    string
+        :returns: Dict of 'from_address', 'posted_at' as seconds since the
+                  epoch, 'rfc_message_id' and 'in_reply_to' without their
+                  angle brackets, the decoded 'subject', and the 'size' of
+                  the message in bytes. Any missing or unreadable header
+                  is None.
+        """
+        if isinstance(msg, bytes):
+            block = BYTES_HEADER_BLOCK.match(msg).group(0)
+            headers = self._scan_headers(BYTES_HEADER.finditer(block))
+            headers = {name: BYTES_FOLD.sub(b'', value).decode(
+                'ascii', 'surrogateescape')
+                for name, value in headers.items()}
+            size = len(msg)
+        else:
+            block = HEADER_BLOCK.match(msg).group(0)
+            headers = {name: FOLD.sub('', value) for name, value
+                       in self._scan_headers(HEADER.finditer(block)).items()}
+            size = len(msg.encode('utf-8', 'surrogateescape'))
+
+        if 'from' not in headers:
+            parsed = self.bhp.parsebytes(msg) if isinstance(msg, bytes) \
+                else self.hp.parsestr(msg)
+            headers = {name: str(parsed[name]) for name in METADATA_HEADERS
+                       if parsed[name] is not None}
+
+        return {
+            'from_address': self._sender_address(msg, headers.get('from')),
+            'posted_at': self._date(headers.get('date')),
+            'rfc_message_id': self._message_id(headers.get('message-id')),
+            'subject': self._text(headers.get('subject')),
+            'in_reply_to': self._message_id(headers.get('in-reply-to')),
+            'size': size
+        }
+
+    def get_messages_metadata(self, msgs):
+        """
+        Get the metadata of several messages.
+
+        :param msgs: List of complete email messages, each as raw bytes or a
+                     string
+        :returns: List of dicts of the metadata of each message, in order, as
+                  returned by get_message_metadata
+        """
+        return [self.get_message_metadata(msg) for msg in msgs]
+
+    def get_sender_addresses(self, msgs):
+        """
+        Get the email addresses of the senders of several messages.
+
+        :param msgs: List of complete email messages, each as raw bytes or a
+                     string
+        :returns: List of the email addresses of the senders, in order
+        """
+        return [self.get_sender_address(msg) for msg in msgs]
+
+    def _scan_headers(self, matches):
+        headers = {}
+        for match in matches:
+            name = match.group(1).lower()
+            if isinstance(name, bytes):
+                name = name.decode('ascii')
+            if name in METADATA_HEADERS and name not in headers:
+                headers[name] = match.group(2)
+        return headers
+
+    def _sender_address(self, msg, sender):
+        if sender is not None:
+            address = parseaddr(sender)[1]
+            if '=?' in address or not address and '=?' in sender:
+                address = self._decode_sender_address(sender)
+            if address is not None and ASCII.match(address):
+                return address
+        return self._parse_sender_address(msg)
+
+    def _date(self, value):
+        if value is None:
+            return None
+        try:
+            date = parsedate_tz(value)
+            return float(mktime_tz(date)) if date is not None else None
+        except (OverflowError, TypeError, ValueError):
+            return None
+
+    def _message_id(self, value):
+        if value is None:
+            return None
+        match = MESSAGE_ID.search(value)
+        return match.group(1) if match else value.strip() or None
+
+    def _text(self, value):
+        """
+        Decodes a header value, along with any RFC 2047 encoded words in it.
+        Raw bytes that are not ASCII are read as UTF-8.
+        """
+        if value is None:
+            return None
+        value = value.encode('utf-8', 'surrogateescape').decode(
+            'utf-8', 'replace').strip()
+        if '=?' not in value:
+            return value
+        try:
+            return str(make_header(decode_header(value)))
+        except (HeaderParseError, LookupError, UnicodeError):
+            return value
+
+    def _decode_sender_address(self, sender):
+        try:
+            return parseaddr(str(make_header(decode_header(sender))))[1]
+        except (HeaderParseError, LookupError, UnicodeError):
+            return None
+
+    def _parse_sender_address(self, msg):
+        if isinstance(msg, bytes):
+            headers = self.bhp.parsebytes(msg)
+        else:
+            headers = self.hp.parsestr(msg)
+        sender = headers['from']
+        # Headers with undecodable bytes are returned as Header objects
+        return parseaddr(str(sender) if sender is not None else '')[1]
@@ -0,0 +1,104 @@
+"""
+Times script.py commands end to end against the local fake E-Democracy
+server, reporting the items each command synced per second.
+
+Run from the root of the repo with:
+
+    python -m benchmarks.end_to_end [--commands 1,4,5] [--engine async] ...
+
+Each run syncs into a new, temporary database. Options of the fake server,
+such as --latency and --error-rate, are also accepted.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_server import add_arguments, serve_in_background, \
+    server_from_arguments
+from benchmarks.synthetic_archive import create_database
+
+# Items that commands sync, and how to count them
+COUNTS = [
+    ('memberships', 'SELECT count(*) FROM group_memberships'),
+    ('profiles', 'SELECT count(*) FROM member_profiles'),
+    ('message IDs', 'SELECT count(*) FROM group_messages'),
+    ('bodies', 'SELECT count(*) FROM group_messages WHERE body IS NOT NULL')
+]
+
+
+def count_items(path):
+    db = sqlite3.connect(path)
+    try:
+        return [db.execute(query).fetchone()[0] for name, query in COUNTS]
+    finally:
+        db.close()
+
+
+def run_command(command, env):
+    env = dict(env)
+    env['BENCHMARK_EDEM_BACKUP_COMMAND'] = command
+    started = time.perf_counter()
+    subprocess.run([sys.executable, 'script.py'], env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    argparser.add_argument('--commands', default='1,4,5',
+                           help='Comma separated script.py commands to run, '
+                                'in order')
+    argparser.add_argument('--engine', default='async',
+                           help='Sync engine to run the commands with')
+    argparser.add_argument('--concurrency', type=int, default=100)
+    argparser.add_argument('--rate', type=float, default=1000,
+                           help='Requests per second the client may make')
+    argparser.add_argument('--parse-processes', type=int, default=0,
+                           help='Processes to parse message headers in')
+    add_arguments(argparser)
+    args = argparser.parse_args()
+
+    server = server_from_arguments(args)
+    base_url = serve_in_background(server)
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'benchmark.sqlite')
+    create_database(db_path)
+
+    env = dict(os.environ)
+    env.update({
+        'EDEM_BACKUP_ENV': 'BENCHMARK',
+        'BENCHMARK_EDEM_BACKUP_DATABASE_PATH': db_path,
+        'BENCHMARK_EDEM_BACKUP_BASE_URL': base_url,
+        'BENCHMARK_EDEM_BACKUP_USERNAME': 'benchmark',
+        'BENCHMARK_EDEM_BACKUP_PASSWORD': 'benchmark',
+        'BENCHMARK_EDEM_BACKUP_ENGINE': args.engine,
+        'BENCHMARK_EDEM_BACKUP_CONCURRENCY': str(args.concurrency),
+        'BENCHMARK_EDEM_BACKUP_RATE_LIMIT': str(args.rate),
+        'BENCHMARK_EDEM_BACKUP_PARSE_PROCESSES': str(args.parse_processes)
+    })
+
+    print('Engine %s, concurrency %i, against %s' %
+          (args.engine, args.concurrency, base_url))
+    try:
+        for command in args.commands.split(','):
+            before = count_items(db_path)
+            seconds = run_command(command.strip(), env)
+            after = count_items(db_path)
+            synced = ['%i %s (%.1f/s)' % (end - start, name,
+                                          (end - start) / seconds)
+                      for (name, query), start, end
+                      in zip(COUNTS, before, after) if end > start]
+            print('  command %s %8.2fs  %s' %
+                  (command, seconds, ', '.join(synced) or 'nothing synced'))
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+A local stand-in for the E-Democracy forums, serving deterministic
+synthetic groups, members, profiles and messages, for benchmarking syncs
+end to end without touching the real site.
+
+Run from the root of the repo with:
+
+    python -m benchmarks.fake_server [--port N] [--groups N] ...
+
+then point a sync at it by setting BASE_URL to http://localhost:N.
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import math
+import random
+import re
+from socketserver import ThreadingMixIn
+from threading import Thread
+import time
+from urllib.parse import parse_qs, urlparse
+import zlib
+
+from backup.client.edemocracy import TokenBucket
+
+PAGE = '''<html>
+  <head><title>E-Democracy</title></head>
+  <body>
+    <div id="header"><a href="/groups/">Groups</a></div>
+    <div id="bodyblock">%s</div><!--bodyblock-->
+  </body>
+</html>
+'''
+
+GROUP = '''
+<dl>
+  <dt><a href="/groups/%(group)s">Group %(group)s</a> (discussion group)</dt>
+  <dd>You may <a href="/groups/%(group)s/join.html">join</a>.</dd>
+</dl>'''
+
+MONTH = '''
+<li>
+  <button class="btn gs-group-messages-export-list-item-buttons-generate"
+          data-month="%s">Generate</button>
+</li>'''
+
+MESSAGE = '''From: %(name)s <%(address)s>
+To: %(group)s@forums.e-democracy.org
+Subject: Message %(id)s
+Date: Mon, 1 %(month)s 12:00:00 -0000
+Message-ID: <%(id)s@forums.e-democracy.org>
+Content-Type: text/plain; charset="utf-8"
+
+%(body)s
+'''
+
+WORDS = ['neighborhood', 'council', 'park', 'meeting', 'street', 'library',
+         'budget', 'school', 'snow', 'bus', 'garden', 'police', 'vote']
+
+
+class Archive:
+
+    def __init__(self, groups=20, members=500, members_per_group=50,
+                 months=24, messages_per_month=20, message_size=2048,
+                 seed=0):
+        """
+        A synthetic forum archive. Every page of it is generated on request,
+        the same way every time for the same parameters.
+
+        :param groups: Number of groups
+        :param members: Number of members, shared among the groups
+        :param members_per_group: Number of members of each group
+        :param months: Number of months each group has messages in
+        :param messages_per_month: Number of messages each group has in each
+                                   month
+        :param message_size: Approximate bytes of each message body
+        :param seed: Seed that every page is generated from
+        """
+        self.groups = ['group%03i' % i for i in range(groups)]
+        self.members = ['member%05i' % i for i in range(members)]
+        self.members_per_group = min(members_per_group, members)
+        self.months = ['%04i%02i' % (2018 - i // 12, 12 - i % 12)
+                       for i in range(months)]
+        self.messages_per_month = messages_per_month
+        self.message_size = message_size
+        self.seed = seed
+
+    def random(self, *keys):
+        return random.Random(zlib.crc32(
+            ('%s/%s' % (self.seed, '/'.join(keys))).encode('utf-8')))
+
+    def groups_page(self):
+        return PAGE % ''.join(GROUP % {'group': group}
+                              for group in self.groups)
+
+    def members_of_group(self, group):
+        return sorted(self.random('members', group).sample(
+            self.members, self.members_per_group))
+
+    def profile(self, member):
+        rng = self.random('profile', member)
+        return {
+            'id': member,
+            'fn': 'Member %s' % member[6:],
+            'biography': ' '.join(rng.choice(WORDS) for i in range(30)),
+            'email': ['%s@example.com' % member]
+        }
+
+    def export_page(self):
+        return PAGE % ('<ul id="gs-group-messages-export-list">%s</ul>' %
+                       ''.join(MONTH % month for month in self.months))
+
+    def messages_of_month(self, group, month):
+        return ['%s-%s-%04i' % (group, month, i)
+                for i in range(self.messages_per_month)]
+
+    def message(self, group, message_id):
+        rng = self.random('message', message_id)
+        member = rng.choice(self.members)
+        words = []
+        size = 0
+        while size < self.message_size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        month = message_id.split('-')[-2]
+        return MESSAGE % {
+            'name': 'Member %s' % member[6:],
+            'address': '%s@example.com' % member,
+            'group': group,
+            'id': message_id,
+            'month': time.strftime('%b %Y', time.strptime(month, '%Y%m')),
+            'body': ' '.join(words)
+        }
+
+
+class Latency:
+
+    def __init__(self, text):
+        """
+        A distribution of response latencies.
+
+        :param text: 'fixed:SECONDS', 'uniform:LOW:HIGH' or
+                     'lognormal:MEDIAN:SIGMA'
+        """
+        parts = text.split(':')
+        self.kind = parts[0]
+        self.args = [float(arg) for arg in parts[1:]]
+        if self.kind not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError('Unknown latency distribution %s' % self.kind)
+
+    def sample(self):
+        if self.kind == 'fixed':
+            return self.args[0]
+        if self.kind == 'uniform':
+            return random.uniform(*self.args)
+        return random.lognormvariate(math.log(self.args[0]), self.args[1])
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Set on the subclass that make_server creates
+    archive = None
+    latency = None
+    error_rate = 0
+    rate_limiter = None
+
+    ROUTES = [
+        ('GET', re.compile('^/logout.html$'), 'logout'),
+        ('HEAD', re.compile('^/p/$'), 'whoami'),
+        ('GET', re.compile('^/groups/$'), 'groups'),
+        ('GET', re.compile('^/groups/([^/]+)/members.json$'), 'members'),
+        ('GET', re.compile('^/p/([^/]+)/profile.json$'), 'profile'),
+        ('GET', re.compile('^/groups/([^/]+)/messages/export.html$'),
+         'export'),
+        ('GET', re.compile('^/groups/([^/]+)/messages/'
+                           'gs-group-messages-export-posts.json$'), 'posts'),
+        ('GET', re.compile('^/groups/([^/]+)/messages/'
+                           'gs-group-messages-export-mbox/([^/]+)$'), 'mbox'),
+        ('POST', re.compile('^/login.html$'), 'login')
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_HEAD(self):
+        self.route('HEAD')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def route(self, method):
+        if self.latency is not None:
+            time.sleep(self.latency.sample())
+
+        if self.rate_limiter is not None and \
+                not self.rate_limiter.try_take():
+            return self.respond(429, 'Too Many Requests', 'text/plain',
+                                {'Retry-After': '1'})
+        if random.random() < self.error_rate:
+            return self.respond(503, 'Service Unavailable', 'text/plain')
+
+        url = urlparse(self.path)
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                return getattr(self, name)(parse_qs(url.query),
+                                           *match.groups())
+        self.respond(404, 'Not Found', 'text/plain')
+
+    def respond(self, status, body, content_type, headers=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def respond_json(self, value):
+        self.respond(200, json.dumps(value), 'application/json')
+
+    def login(self, query):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        self.respond(302, '', 'text/plain', {
+            'Location': '/',
+            'Set-Cookie': '__ac=fake; Path=/'
+        })
+
+    def logout(self, query):
+        self.respond(200, 'Logged out', 'text/plain')
+
+    def whoami(self, query):
+        self.respond(302, '', 'text/plain', {'Location': '/p/benchmark'})
+
+    def groups(self, query):
+        self.respond(200, self.archive.groups_page(), 'text/html')
+
+    def members(self, query, group):
+        self.respond_json(self.archive.members_of_group(group))
+
+    def profile(self, query, member):
+        self.respond_json(self.archive.profile(member))
+
+    def export(self, query, group):
+        self.respond(200, self.archive.export_page(), 'text/html')
+
+    def posts(self, query, group):
+        self.respond_json(self.archive.messages_of_month(
+            group, query.get('month', [''])[0]))
+
+    def mbox(self, query, group, message_id):
+        self.respond(200, self.archive.message(group, message_id),
+                     'application/mbox')
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_server(archive, port=0, latency=None, error_rate=0,
+                rate_limit=None):
+    """
+    Creates a server for an archive, listening on localhost.
+
+    :param archive: Archive to serve
+    :param port: Port to listen on, or 0 for any free port
+    :param latency: Latency to delay every response by, if any
+    :param error_rate: Fraction of requests to fail with a 503
+    :param rate_limit: Requests per second to allow, failing the rest with
+                       a 429, if any
+    :returns: The server, which is not yet serving
+    """
+    handler = type('ArchiveHandler', (Handler,), {
+        'archive': archive,
+        'latency': latency,
+        'error_rate': error_rate,
+        'rate_limiter': TokenBucket(rate_limit, max(1, rate_limit))
+        if rate_limit else None
+    })
+    return ThreadedHTTPServer(('localhost', port), handler)
+
+
+def serve_in_background(server):
+    """
+    Serves requests on a daemon thread.
+
+    :returns: Base URL of the server
+    """
+    Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://localhost:%i' % server.server_address[1]
+
+
+def add_arguments(argparser):
+    argparser.add_argument('--groups', type=int, default=20)
+    argparser.add_argument('--members', type=int, default=500)
+    argparser.add_argument('--members-per-group', type=int, default=50)
+    argparser.add_argument('--months', type=int, default=24)
+    argparser.add_argument('--messages-per-month', type=int, default=20)
+    argparser.add_argument('--message-size', type=int, default=2048,
+                           help='Approximate bytes of each message')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--latency', type=Latency, default=None,
+                           help="Response latency: 'fixed:SECONDS', "
+                                "'uniform:LOW:HIGH' or "
+                                "'lognormal:MEDIAN:SIGMA'")
+    argparser.add_argument('--error-rate', type=float, default=0,
+                           help='Fraction of requests to fail with a 503')
+    argparser.add_argument('--rate-limit', type=float, default=None,
+                           help='Requests per second to allow before '
+                                'responding with a 429')
+
+
+def server_from_arguments(args, port=0):
+    archive = Archive(args.groups, args.members, args.members_per_group,
+                      args.months, args.messages_per_month,
+                      args.message_size, args.seed)
+    return make_server(archive, port, args.latency, args.error_rate,
+                       args.rate_limit)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    argparser.add_argument('--port', type=int, default=8080)
+    add_arguments(argparser)
+    args = argparser.parse_args()
+
+    server = server_from_arguments(args, args.port)
+    print('Serving a fake E-Democracy at http://localhost:%i' %
+          server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+Times the hot paths of a sync: bulk writes and reads of the store, parsing
+the sender out of message headers, compressing bodies and scraping listing
+pages.
+
+Run from the root of the repo with:
+
+    python -m benchmarks.hot_paths [--messages N] [--members N] ...
+
+Every benchmark is run at least --runs times, and until it has taken
+--min-time seconds, and its median run is reported. Save the results with
+--output, and compare a later run against them with --baseline, which exits
+with an error when any benchmark's median has slowed by more than
+--tolerance. Baselines are only comparable between runs of the same sizes on
+the same machine, and a baseline of other sizes is refused.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from backup.client.parsers import SoupListingParser
+from backup.store.compression import BodyCodec
+from backup.store.sqlite import Store
+from backup.utils.email_message_utility import EmailMessageUtility
+from benchmarks.fake_server import Archive
+from benchmarks.parse_listings import export_page, groups_page
+from benchmarks.synthetic_archive import create_database
+
+GROUPS = 100
+MESSAGES_PER_GROUP_MONTH = 50
+
+
+class Timer:
+    """
+    Accumulates the time spent within its context.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.seconds += time.perf_counter() - self.started
+
+
+class HotPaths:
+
+    def __init__(self, directory, messages, members, bodies):
+        """
+        Builds the synthetic data the benchmarks run over.
+
+        :param directory: Directory to keep benchmark databases in
+        :param messages: Number of message IDs to write and read
+        :param members: Number of members to spread among the groups
+        :param bodies: Number of message bodies to write and parse
+        """
+        self.directory = directory
+        self.template = os.path.join(directory, 'template.sqlite')
+        create_database(self.template)
+
+        months = max(1, messages // GROUPS // MESSAGES_PER_GROUP_MONTH)
+        self.archive = Archive(groups=GROUPS, members=members,
+                               members_per_group=max(1, members // 10),
+                               months=months,
+                               messages_per_month=MESSAGES_PER_GROUP_MONTH)
+        self.messages = {}
+        for group in self.archive.groups:
+            self.messages[group] = [
+                message_id for month in self.archive.months
+                for message_id in self.archive.messages_of_month(group, month)]
+        # Bodies of messages spread evenly across groups and months
+        all_messages = [(group, message_id)
+                        for group, messages in self.messages.items()
+                        for message_id in messages]
+        step = max(1, len(all_messages) // bodies)
+        self.bodies = [
+            {'id': message_id,
+             'body': self.archive.message(group, message_id).encode('utf-8')}
+            for group, message_id in all_messages[::step][:bodies]]
+
+    def store(self, name):
+        """
+        :returns: Store of a new database, holding nothing but the schema
+        """
+        path = os.path.join(self.directory, '%s.sqlite' % name)
+        shutil.copyfile(self.template, path)
+        return Store(path)
+
+    def filled_store(self, name):
+        """
+        :returns: Store of a new database holding every message ID and
+                  membership
+        """
+        store = self.store(name)
+        with store:
+            for group, messages in self.messages.items():
+                store.create_group_messages(group, messages)
+                store.save_group_members(
+                    group, self.archive.members_of_group(group))
+        return store
+
+    def create_group_messages(self, timer):
+        with self.store('create') as store:
+            for group, messages in self.messages.items():
+                with timer:
+                    store.create_group_messages(group, messages)
+        return sum(len(messages) for messages in self.messages.values())
+
+    def update_group_messages(self, timer):
+        with self.filled_store('update') as store:
+            for i in range(0, len(self.bodies), 100):
+                with timer:
+                    store.update_group_messages(self.bodies[i:i + 100])
+        return len(self.bodies)
+
+    def iter_empty_group_messages(self, timer):
+        with self.filled_store('iterate') as store:
+            with timer:
+                return sum(1 for message in store.iter_empty_group_messages())
+
+    def fetch_groups_of_member(self, timer):
+        with self.filled_store('groups') as store:
+            with timer:
+                for member in self.archive.members:
+                    store.fetch_groups_of_member(member)
+        return len(self.archive.members)
+
+    def get_sender_address(self, timer):
+        utility = EmailMessageUtility()
+        with timer:
+            for message in self.bodies:
+                utility.get_sender_address(message['body'])
+        return len(self.bodies)
+
+    def compress_bodies(self, timer):
+        codec = BodyCodec()
+        with timer:
+            for message in self.bodies:
+                codec.decompress(*codec.compress(message['body']))
+        return len(self.bodies)
+
+    def parse_groups(self, timer):
+        html = groups_page(1000)
+        parser = SoupListingParser()
+        with timer:
+            for i in range(10):
+                parser.parse_groups(html)
+        return 10
+
+    def parse_message_months(self, timer):
+        html = export_page(240)
+        parser = SoupListingParser()
+        with timer:
+            for i in range(10):
+                parser.parse_message_months(html)
+        return 10
+
+    BENCHMARKS = [
+        'create_group_messages',
+        'update_group_messages',
+        'iter_empty_group_messages',
+        'fetch_groups_of_member',
+        'get_sender_address',
+        'compress_bodies',
+        'parse_groups',
+        'parse_message_months'
+    ]
+
+    def run(self, name, runs, min_time):
+        """
+        Runs a benchmark several times.
+
+        :param name: Name of the benchmark to run
+        :param runs: Least times to run it
+        :param min_time: Least seconds to spend timing it, running it more
+                         than `runs` times if need be
+        :returns: Dict of the median seconds a run took, the median items
+                  processed per second, and the number of runs
+        """
+        seconds = []
+        rates = []
+        while len(seconds) < runs or sum(seconds) < min_time:
+            timer = Timer()
+            items = getattr(self, name)(timer)
+            seconds.append(timer.seconds)
+            rates.append(items / timer.seconds)
+        return {'seconds': statistics.median(seconds),
+                'per_second': statistics.median(rates),
+                'runs': len(seconds)}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results against a baseline.
+
+    :param results: Dict of results of each benchmark
+    :param baseline: Dict of earlier results of each benchmark
+    :param tolerance: Fraction a benchmark may slow by before it counts as a
+                      regression
+    :returns: List of names of the benchmarks that regressed
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        change = result['per_second'] / baseline[name]['per_second'] - 1
+        regressed = change < -tolerance
+        print('  %-28s %+7.1f%%%s' %
+              (name, change * 100, '  REGRESSED' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    argparser.add_argument('--messages', type=int, default=10000,
+                           help='Message IDs to write and read')
+    argparser.add_argument('--members', type=int, default=10000,
+                           help='Members to spread among the groups')
+    argparser.add_argument('--bodies', type=int, default=2000,
+                           help='Message bodies to write and parse')
+    argparser.add_argument('--runs', type=int, default=5,
+                           help='Least times to run each benchmark')
+    argparser.add_argument('--min-time', type=float, default=1.0,
+                           help='Least seconds to time each benchmark for')
+    argparser.add_argument('--only', action='append',
+                           choices=HotPaths.BENCHMARKS,
+                           help='Benchmark to run, rather than all of them')
+    argparser.add_argument('--output', help='File to save the results to')
+    argparser.add_argument('--baseline',
+                           help='File of earlier results to compare against')
+    argparser.add_argument('--tolerance', type=float, default=0.2,
+                           help='Fraction a benchmark may slow by before it '
+                                'counts as a regression')
+    args = argparser.parse_args()
+
+    sizes = {'messages': args.messages, 'members': args.members,
+             'bodies': min(args.bodies, args.messages)}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['sizes'] != sizes:
+            sys.exit('Baseline %s was run at different sizes: %s' %
+                     (args.baseline, baseline['sizes']))
+    directory = tempfile.mkdtemp()
+    try:
+        hot_paths = HotPaths(directory, **sizes)
+        results = {}
+        for name in args.only or HotPaths.BENCHMARKS:
+            results[name] = hot_paths.run(name, args.runs, args.min_time)
+            print('  %-28s %9.3fs %12.0f/s %5i runs' %
+                  (name, results[name]['seconds'],
+                   results[name]['per_second'], results[name]['runs']))
+    finally:
+        shutil.rmtree(directory)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'sizes': sizes, 'results': results}, f, indent=2,
+                      sort_keys=True)
+
+    if baseline is not None:
+        print('Against %s:' % args.baseline)
+        if compare(results, baseline['results'], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Times parsing of large E-Democracy listing pages with each available
+ListingParser, against the full-tree html.parser parse they replaced.
+
+Run from the root of the repo with:
+
+    python -m benchmarks.parse_listings [--groups N] [--months N] [--runs N]
+"""
+import argparse
+from bs4 import BeautifulSoup
+import re
+import timeit
+
+from backup.client.parsers import MONTH_BUTTON_CLASS, SoupListingParser
+
+PAGE = '''<html>
+  <head><title>E-Democracy</title></head>
+  <body>
+    <div id="header">%(padding)s</div>
+    <div id="bodyblock">%(body)s</div><!--bodyblock-->
+    <div id="footer">%(padding)s</div>
+  </body>
+</html>
+'''
+
+PADDING = '''<ul class="nav">%s</ul>''' % ''.join(
+    '<li><a href="/s/topic%i.html" class="topic">Topic %i</a></li>' % (i, i)
+    for i in range(500))
+
+GROUP = '''
+<dl>
+  <dt><a href="/groups/group%(i)i">Group %(i)i</a> (discussion group)</dt>
+  <dd>You may <a href="/groups/group%(i)i/email_settings.html">change email
+  settings</a> or <a href="/groups/leave.html?groupId=group%(i)i">leave</a>
+  </dd>
+</dl>'''
+
+MONTH = '''
+<li class="gs-group-messages-export-list-item">
+  <span>%(month)s</span>
+  <button class="btn %(button)s" data-month="%(month)s">Generate</button>
+  <a class="btn gs-group-messages-export-list-item-buttons-save" href="#"
+     download="main-posts-%(month)s.mbox">Save</a>
+</li>'''
+
+
+def groups_page(count):
+    return PAGE % {
+        'padding': PADDING,
+        'body': ''.join(GROUP % {'i': i} for i in range(count))
+    }
+
+
+def export_page(count):
+    months = ['%04i%02i' % (2000 + i // 12, i % 12 + 1)
+              for i in range(count)]
+    return PAGE % {
+        'padding': PADDING,
+        'body': '<ul id="gs-group-messages-export-list">%s</ul>' % ''.join(
+            MONTH % {'month': month, 'button': MONTH_BUTTON_CLASS}
+            for month in months)
+    }
+
+
+def full_tree_groups(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    links = soup.find(id='bodyblock') \
+                .find_all('a', href=re.compile("^/groups/"))
+    return sorted(list(set(
+        [link.get('href').split('/')[2] for link in links
+         if not link.get('href').startswith('/groups/leave.html')]
+    )))
+
+
+def full_tree_months(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    items = soup.find(id='bodyblock') \
+                .find(id='gs-group-messages-export-list') \
+                .find_all('button', class_=MONTH_BUTTON_CLASS)
+    return [item.get('data-month') for item in items]
+
+
+def available_parsers():
+    parsers = [('strained html.parser', SoupListingParser('html.parser'))]
+    try:
+        import lxml  # noqa: F401
+        parsers.append(('strained lxml', SoupListingParser('lxml')))
+    except ImportError:
+        pass
+    return parsers
+
+
+def report(name, func, html, runs, baseline=None):
+    seconds = min(timeit.repeat(lambda: func(html), number=1, repeat=runs))
+    speedup = '' if baseline is None else '  (%.1fx)' % (baseline / seconds)
+    print('  %-24s %8.2f ms%s' % (name, seconds * 1000, speedup))
+    return seconds
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    argparser.add_argument('--groups', type=int, default=1000,
+                           help='Groups listed on the group list page')
+    argparser.add_argument('--months', type=int, default=240,
+                           help='Months listed on the export page')
+    argparser.add_argument('--runs', type=int, default=10,
+                           help='Times to parse each page, keeping the best')
+    args = argparser.parse_args()
+
+    for title, html, full_tree, method in [
+            ('Group list, %i groups' % args.groups, groups_page(args.groups),
+             full_tree_groups, 'parse_groups'),
+            ('Export page, %i months' % args.months, export_page(args.months),
+             full_tree_months, 'parse_message_months')]:
+        print('%s (%i KiB)' % (title, len(html) // 1024))
+        expected = full_tree(html)
+        baseline = report('full tree html.parser', full_tree, html, args.runs)
+        for name, parser in available_parsers():
+            func = getattr(parser, method)
+            assert func(html) == expected, '%s parsed differently' % name
+            report(name, func, html, args.runs, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""
+Generates a synthetic E-Democracy archive database, at up to production
+scale, for profiling the store, migrations and queries.
+
+Run from the root of the repo with:
+
+    python -m benchmarks.synthetic_archive PATH [--groups N] [--months N] ...
+
+The same options and --seed always generate the same database. Pass
+--through MIGRATION to stop migrating after that migration, then run
+`yoyo apply --database sqlite:///PATH` to profile the rest. Bodies are
+compressed as the store saves them; pass --raw-bodies to save them as they
+are, to profile compressing them.
+"""
+import argparse
+import base64
+import calendar
+import email.utils
+import hashlib
+import json
+import os
+import quopri
+import random
+import sqlite3
+import string
+import sys
+import time
+from yoyo import get_backend, read_migrations
+
+from backup.store.compression import BodyCodec
+from backup.utils.email_message_utility import EmailMessageUtility
+
+MIGRATIONS_PATH = 'db/migrations'
+
+WORDS = ['neighborhood', 'council', 'park', 'meeting', 'street', 'library',
+         'budget', 'school', 'snow', 'bus', 'garden', 'police', 'vote',
+         'housing', 'crosswalk', 'permit', 'zoning', 'potluck', 'trash',
+         'bike', 'lane', 'tree', 'festival', 'crime', 'recycling', 'the',
+         'and', 'a', 'to', 'of', 'we', 'is', 'on', 'for', 'this', 'at']
+
+FIRST_NAMES = ['Ana', 'Bob', 'Chao', 'Dana', 'Eero', 'Fatima', 'Gus',
+               'Hmong', 'Iris', 'Jose', 'Kai', 'Lena']
+# Names that E-Democracy members' mail clients encode in RFC 2047 words
+ENCODED_NAMES = ['Renée', 'Jürgen', 'François',
+                 'Björk', 'Người', 'Søren']
+LAST_NAMES = ['Anderson', 'Berg', 'Chavez', 'Dahl', 'Johnson', 'Lee',
+              'Nguyen', 'Olson', 'Peterson', 'Vang', 'Xiong', 'Yang']
+
+# Columns of a message derived from its body
+METADATA = {'from_address': None, 'posted_at': None, 'rfc_message_id': None,
+            'subject': None, 'in_reply_to': None, 'size': None}
+
+FOOTER = b'''
+_____________________________________________
+Post to the group: %s@forums.e-democracy.org
+Change your email settings or leave:
+http://forums.e-democracy.org/groups/%s
+'''
+
+
+def create_database(path, through=None):
+    """
+    Creates a database with the schema of the migrations.
+
+    :param path: Path of the database to create
+    :param through: ID of the last migration to apply, or None to apply
+                    them all
+    """
+    backend = get_backend('sqlite:///%s' % path)
+    with backend.lock():
+        migrations = backend.to_apply(read_migrations(MIGRATIONS_PATH))
+        if through is not None:
+            ids = [migration.id for migration in migrations]
+            if through not in ids:
+                raise ValueError('No migration %s to apply' % through)
+            migrations = migrations[:ids.index(through) + 1]
+        backend.apply_migrations(migrations)
+
+
+def month_range(end, months):
+    """
+    :param end: Last month, in the format YYYYMM
+    :param months: Number of months
+    :returns: List of the months up to and including end, oldest first
+    """
+    year, month = int(end[:4]), int(end[4:])
+    index = year * 12 + month - 1
+    return ['%04i%02i' % (i // 12, i % 12 + 1)
+            for i in range(index - months + 1, index + 1)]
+
+
+class SyntheticArchive:
+
+    def __init__(self, db, groups=50, members=10000, members_per_group=500,
+                 months=180, messages_per_month=5, bodies=1.0,
+                 attachment_rate=0.02, attachment_size=1024 * 1024,
+                 end_month='201812', derived=True, seed=0,
+                 compressed=True):
+        """
+        Fills a database with a synthetic archive of groups, members and
+        messages. Message bodies are mbox text shaped like E-Democracy's:
+        quoted replies, list footers, folded headers, RFC 2047 encoded
+        senders, Latin-1 and quoted-printable bodies and base64 MIME
+        attachments.
+
+        Only the columns that exist in the database are filled, so an archive
+        can be generated into a database migrated part of the way.
+
+        :param db: sqlite3 connection of a migrated database
+        :param groups: Number of groups
+        :param members: Number of members, shared among the groups
+        :param members_per_group: Number of members of each group
+        :param months: Number of months each group has messages in
+        :param messages_per_month: Number of messages each group has in each
+                                   month
+        :param bodies: Fraction of messages to save bodies of, the rest
+                       being saved as IDs only
+        :param attachment_rate: Fraction of messages with an attachment
+        :param attachment_size: Most bytes of each attachment
+        :param end_month: Last month of the archive, in the format YYYYMM
+        :param derived: Whether to fill the columns derived from bodies, such
+                        as from_address and posted_at. Leave them empty to
+                        profile backfilling them.
+        :param seed: Seed that everything is generated from
+        :param compressed: Whether to compress bodies, as the store saves
+                           them. Save them raw to profile compressing them.
+                           Bodies are always saved raw into a database
+                           migrated to before bodies were compressed.
+        """
+        self.db = db
+        self.rng = random.Random(seed)
+        self.groups = ['group%03i' % i for i in range(groups)]
+        self.members = ['member%06i' % i for i in range(members)]
+        self.members_per_group = min(members_per_group, members)
+        self.months = month_range(end_month, months)
+        self.messages_per_month = messages_per_month
+        self.bodies = bodies
+        self.attachment_rate = attachment_rate
+        self.attachment_size = attachment_size
+        self.derived = derived
+        self.utility = EmailMessageUtility()
+        self.columns = {}
+        self.codec = BodyCodec() \
+            if compressed and 'body_codec' in self._columns('group_messages') \
+            else None
+        # Stands in for the time the archive was synced, so that it is the
+        # same on every run
+        year, month = int(end_month[:4]), int(end_month[4:])
+        self.synced_at = calendar.timegm(
+            (year + month // 12, month % 12 + 1, 1, 0, 0, 0))
+
+    def _columns(self, table):
+        if table not in self.columns:
+            self.columns[table] = [row[1] for row in self.db.execute(
+                'PRAGMA table_info(%s)' % table)]
+        return self.columns[table]
+
+    def _insert(self, table, rows):
+        """
+        Inserts rows, given as dicts, keeping only the columns the table
+        has. Nothing is inserted into tables that do not exist yet.
+        """
+        if not rows or not self._columns(table):
+            return
+        columns = [column for column in self._columns(table)
+                   if column in rows[0]]
+        self.db.executemany(
+            'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' %
+            (table, ', '.join(columns), ', '.join('?' * len(columns))),
+            [tuple(row[column] for column in columns) for row in rows])
+
+    def generate(self, progress=None):
+        """
+        Generates the whole archive, committing as it goes.
+
+        :param progress: Function called with a line of text after each
+                         group, if any
+        """
+        self.generate_members()
+        for group in self.groups:
+            count = self.generate_messages(group)
+            self.db.commit()
+            if progress is not None:
+                progress('%s: %i messages' % (group, count))
+
+    def generate_members(self):
+        memberships = []
+        for group in self.groups:
+            members = sorted(self.rng.sample(self.members,
+                                             self.members_per_group))
+            self._insert('group_members', [
+                {'group_id': group, 'member_ids': json.dumps(members)}])
+            memberships += [{'group_id': group, 'member_id': member,
+                             'added_at': self.synced_at}
+                            for member in members]
+        self._insert('group_memberships', memberships)
+
+        profiles = []
+        for member in self.members:
+            profile = json.dumps(self.profile(member), sort_keys=True)
+            profiles.append({
+                'id': member,
+                'profile': profile,
+                'fetched_at': self.synced_at,
+                'content_hash': hashlib.sha1(
+                    profile.encode('utf-8')).hexdigest()
+            })
+        self._insert('member_profiles', profiles)
+        self.db.commit()
+
+    def profile(self, member):
+        return {
+            'id': member,
+            'fn': '%s %s' % (self.rng.choice(FIRST_NAMES),
+                             self.rng.choice(LAST_NAMES)),
+            'biography': self.words(self.rng.randint(0, 60)),
+            'email': ['%s@example.com' % member]
+        }
+
+    def words(self, count):
+        return ' '.join(self.rng.choice(WORDS) for i in range(count))
+
+    def message_id(self):
+        return ''.join(self.rng.choice(string.ascii_letters + string.digits)
+                       for i in range(22))
+
+    def generate_messages(self, group):
+        """
+        Generates every message of a group.
+
+        :returns: Number of messages generated
+        """
+        rows = []
+        previous = []
+        for month in self.months:
+            for i in range(self.messages_per_month):
+                message_id = self.message_id()
+                row = dict(METADATA, id=message_id, group_id=group,
+                           body=None, body_codec=None)
+                if self.rng.random() < self.bodies:
+                    sender = self.rng.choice(self.members)
+                    reply_to = self.rng.choice(previous) \
+                        if previous and self.rng.random() < 0.6 else None
+                    row['body'] = self.message(group, month, message_id,
+                                               sender, reply_to)
+                    if self.derived:
+                        row.update(self.utility.get_message_metadata(
+                            row['body']))
+                    if self.codec is not None:
+                        row['body'], row['body_codec'] = \
+                            self.codec.compress(row['body'])
+                rows.append(row)
+                previous = (previous + [message_id])[-20:]
+        self._insert('group_messages', rows)
+        return len(rows)
+
+    def message(self, group, month, message_id, sender, reply_to):
+        """
+        :returns: Raw bytes of a message
+        """
+        rng = self.rng
+        posted_at = calendar.timegm((int(month[:4]), int(month[4:]),
+                                     rng.randint(1, 28), rng.randint(0, 23),
+                                     rng.randint(0, 59), rng.randint(0, 59)))
+        address = '%s@example.com' % sender
+        kind = rng.random()
+        if kind < 0.15:
+            name = '=?utf-8?b?%s?=' % base64.b64encode(
+                rng.choice(ENCODED_NAMES).encode('utf-8')).decode('ascii')
+        elif kind < 0.2:
+            name = '=?iso-8859-1?q?%s?=' % quopri.encodestring(
+                rng.choice(ENCODED_NAMES[:4]).encode('latin-1'),
+                header=True).decode('ascii')
+        else:
+            name = '"%s %s"' % (rng.choice(FIRST_NAMES),
+                                rng.choice(LAST_NAMES))
+
+        subject = self.words(rng.randint(2, 16)).capitalize()
+        if reply_to is not None:
+            subject = 'Re: [%s] %s' % (group, subject)
+        fold = subject.rfind(' ', 0, 60) if len(subject) > 60 else -1
+        headers = [
+            'From %s %s' % (address, time.asctime(time.gmtime(posted_at))),
+            'Return-Path: <%s>' % address,
+            'Received: from mail.example.com (mail.example.com [10.0.0.1])\n'
+            '\tby forums.e-democracy.org (Postfix) with ESMTP id %s\n'
+            '\tfor <%s@forums.e-democracy.org>; %s' %
+            (message_id[:10], group, email.utils.formatdate(posted_at)),
+            # Long names and subjects arrive folded over several lines
+            'From: %s\n <%s>' % (name, address) if len(name) > 40
+            else 'From: %s <%s>' % (name, address),
+            'To: %s@forums.e-democracy.org' % group,
+            'Subject: %s' % (subject[:fold] + '\n' + subject[fold:]
+                             if fold > 0 else subject),
+            'Date: %s' % email.utils.formatdate(posted_at),
+            'Message-ID: <%s@forums.e-democracy.org>' % message_id,
+            'MIME-Version: 1.0'
+        ]
+        if reply_to is not None:
+            headers.append('In-Reply-To: <%s@forums.e-democracy.org>' %
+                           reply_to)
+
+        text = self.words(rng.randint(20, 400))
+        text = '\n'.join(text[i:i + 72] for i in range(0, len(text), 72))
+        if reply_to is not None:
+            quoted = self.words(rng.randint(20, 200))
+            text += '\n\nOn %s, a neighbor wrote:\n%s' % (
+                email.utils.formatdate(posted_at - 86400),
+                '\n'.join('> ' + quoted[i:i + 70]
+                          for i in range(0, len(quoted), 70)))
+
+        encoding = rng.random()
+        if encoding < 0.1:
+            part_headers = ['Content-Type: text/plain; charset="iso-8859-1"',
+                            'Content-Transfer-Encoding: 8bit']
+            body = (text + '\n\nMerci, Renée').encode('latin-1')
+        elif encoding < 0.2:
+            part_headers = ['Content-Type: text/plain; charset="utf-8"',
+                            'Content-Transfer-Encoding: quoted-printable']
+            body = quopri.encodestring(
+                (text + '\n\nThanks — Người').encode('utf-8'))
+        else:
+            part_headers = ['Content-Type: text/plain; charset="utf-8"',
+                            'Content-Transfer-Encoding: 7bit']
+            body = text.encode('utf-8')
+        body += FOOTER % (group.encode('ascii'), group.encode('ascii'))
+
+        if rng.random() < self.attachment_rate:
+            boundary = '===============%019i==' % rng.getrandbits(60)
+            size = rng.randint(1, self.attachment_size)
+            attachment = base64.encodebytes(
+                rng.getrandbits(size * 8).to_bytes(size, 'little'))
+            headers.append('Content-Type: multipart/mixed; boundary="%s"' %
+                           boundary)
+            body = b'\n'.join([
+                b'--' + boundary.encode('ascii'),
+                '\n'.join(part_headers).encode('ascii'), b'', body,
+                b'--' + boundary.encode('ascii'),
+                b'Content-Type: application/pdf; name="minutes.pdf"',
+                b'Content-Disposition: attachment; filename="minutes.pdf"',
+                b'Content-Transfer-Encoding: base64', b'', attachment,
+                b'--' + boundary.encode('ascii') + b'--', b''])
+        else:
+            headers += part_headers
+
+        return '\n'.join(headers).encode('ascii') + b'\n\n' + body
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    argparser.add_argument('path', help='Path of the database to create')
+    argparser.add_argument('--groups', type=int, default=50)
+    argparser.add_argument('--members', type=int, default=10000)
+    argparser.add_argument('--members-per-group', type=int, default=500)
+    argparser.add_argument('--months', type=int, default=180)
+    argparser.add_argument('--messages-per-month', type=int, default=5)
+    argparser.add_argument('--bodies', type=float, default=1.0,
+                           help='Fraction of messages to save bodies of')
+    argparser.add_argument('--attachment-rate', type=float, default=0.02,
+                           help='Fraction of messages with an attachment')
+    argparser.add_argument('--attachment-size', type=int, default=1024 * 1024,
+                           help='Most bytes of each attachment')
+    argparser.add_argument('--end-month', default='201812',
+                           help='Last month of the archive, as YYYYMM')
+    argparser.add_argument('--no-derived', dest='derived',
+                           action='store_false',
+                           help='Leave columns derived from bodies, such as '
+                                'from_address, empty')
+    argparser.add_argument('--raw-bodies', dest='compressed',
+                           action='store_false',
+                           help='Save bodies uncompressed, to profile '
+                                'compressing them')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--through',
+                           help='ID of the last migration to apply')
+    args = argparser.parse_args()
+
+    if os.path.exists(args.path):
+        sys.exit('%s already exists' % args.path)
+
+    started = time.perf_counter()
+    create_database(args.path, args.through)
+    db = sqlite3.connect(args.path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=OFF')
+    try:
+        SyntheticArchive(
+            db, args.groups, args.members, args.members_per_group,
+            args.months, args.messages_per_month, args.bodies,
+            args.attachment_rate, args.attachment_size, args.end_month,
+            args.derived, args.seed, args.compressed).generate(print)
+    finally:
+        db.close()
+    print('Generated %s (%.1f MiB) in %.1fs' %
+          (args.path, os.path.getsize(args.path) / 1024 / 1024,
+           time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+create_group_memberships
+"""
+
+from yoyo import step
+
+__depends__ = {'20180630_02_udGcP-backfill-message-from-addresses'}
+
+steps = [
+    step("""
+        CREATE TABLE IF NOT EXISTS
+        group_memberships
+        (group_id TEXT, member_id TEXT, PRIMARY KEY (group_id, member_id))
+        WITHOUT ROWID
+    """, """
+        DROP TABLE group_memberships
+    """),
+    step("""
+        CREATE INDEX IF NOT EXISTS group_membership_member_id
+            ON group_memberships (member_id)
+    """, """
+        DROP INDEX IF EXISTS group_membership_member_id
+    """),
+    step("""
+        INSERT OR IGNORE INTO group_memberships (group_id, member_id)
+        SELECT group_id, json_each.value
+        FROM group_members, json_each(group_members.member_ids)
+    """, """
+        DELETE FROM group_memberships
+    """)
+]
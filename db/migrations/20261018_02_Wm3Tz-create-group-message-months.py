@@ -0,0 +1,19 @@
+"""
+create_group_message_months
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_01_Kq7Ph-create-group-memberships'}
+
+steps = [
+    step("""
+        CREATE TABLE IF NOT EXISTS
+        group_message_months
+        (group_id TEXT, month TEXT, fetched_at REAL, closed INTEGER,
+         PRIMARY KEY (group_id, month))
+        WITHOUT ROWID
+    """, """
+        DROP TABLE group_message_months
+    """)
+]
@@ -0,0 +1,28 @@
+"""
+add profile freshness columns
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_02_Wm3Tz-create-group-message-months'}
+
+steps = [
+    step("""
+        ALTER TABLE member_profiles
+            ADD COLUMN fetched_at REAL
+    """),
+    step("""
+        ALTER TABLE member_profiles
+            ADD COLUMN content_hash TEXT
+    """),
+    step("""
+        CREATE INDEX IF NOT EXISTS member_profile_fetched_at
+            ON member_profiles (fetched_at)
+    """, """
+        DROP INDEX IF EXISTS member_profile_fetched_at
+    """),
+    step("""
+        ALTER TABLE group_memberships
+            ADD COLUMN added_at REAL
+    """)
+]
@@ -0,0 +1,33 @@
+"""
+create sync journal
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_03_Rf8Dn-add-profile-freshness-columns'}
+
+steps = [
+    step("""
+        CREATE TABLE IF NOT EXISTS
+        sync_runs
+        (id INTEGER PRIMARY KEY, command TEXT, started_at REAL,
+         finished_at REAL)
+    """, """
+        DROP TABLE sync_runs
+    """),
+    step("""
+        CREATE TABLE IF NOT EXISTS
+        sync_jobs
+        (run_id INTEGER, task TEXT, item TEXT, state TEXT,
+         attempts INTEGER DEFAULT 0, error TEXT, updated_at REAL,
+         PRIMARY KEY (run_id, task, item))
+    """, """
+        DROP TABLE sync_jobs
+    """),
+    step("""
+        CREATE INDEX IF NOT EXISTS sync_job_state
+            ON sync_jobs (run_id, task, state)
+    """, """
+        DROP INDEX IF EXISTS sync_job_state
+    """)
+]
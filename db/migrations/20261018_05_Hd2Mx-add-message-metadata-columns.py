@@ -0,0 +1,48 @@
+"""
+add message metadata columns
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_04_Jt5Qa-create-sync-journal'}
+
+steps = [
+    step("""
+        ALTER TABLE group_messages
+            ADD COLUMN posted_at REAL
+    """),
+    step("""
+        ALTER TABLE group_messages
+            ADD COLUMN rfc_message_id TEXT
+    """),
+    step("""
+        ALTER TABLE group_messages
+            ADD COLUMN subject TEXT
+    """),
+    step("""
+        ALTER TABLE group_messages
+            ADD COLUMN in_reply_to TEXT
+    """),
+    step("""
+        ALTER TABLE group_messages
+            ADD COLUMN size INTEGER
+    """),
+    step("""
+        CREATE INDEX IF NOT EXISTS group_message_posted_at
+            ON group_messages (group_id, posted_at)
+    """, """
+        DROP INDEX IF EXISTS group_message_posted_at
+    """),
+    step("""
+        CREATE INDEX IF NOT EXISTS group_message_rfc_message_id
+            ON group_messages (rfc_message_id)
+    """, """
+        DROP INDEX IF EXISTS group_message_rfc_message_id
+    """),
+    step("""
+        CREATE INDEX IF NOT EXISTS group_message_in_reply_to
+            ON group_messages (in_reply_to)
+    """, """
+        DROP INDEX IF EXISTS group_message_in_reply_to
+    """)
+]
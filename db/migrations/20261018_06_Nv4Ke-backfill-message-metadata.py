@@ -0,0 +1,28 @@
+from yoyo import step
+
+"""
+backfill message metadata
+"""
+
+__depends__ = {'20261018_05_Hd2Mx-add-message-metadata-columns'}
+
+
+def backfill(conn):
+    # Deriving the metadata of every body here would take a single process
+    # hours on a large archive, and start over if interrupted, so it is left
+    # to the reindex command, which does so in parallel and resumably.
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT count(*)
+    FROM group_messages
+    WHERE body IS NOT NULL AND size IS NULL
+    ''')
+    count = cursor.fetchone()[0]
+    if count:
+        print("%i messages need their metadata derived; run command 9 of "
+              "script.py to reindex them" % count)
+
+
+steps = [
+    step(backfill)
+]
@@ -0,0 +1,23 @@
+"""
+add body compression
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_06_Nv4Ke-backfill-message-metadata'}
+
+steps = [
+    step("""
+        ALTER TABLE group_messages
+            ADD COLUMN body_codec TEXT
+    """),
+    step("""
+        CREATE TABLE IF NOT EXISTS
+        body_dictionaries
+        (id INTEGER PRIMARY KEY,
+         dictionary BLOB NOT NULL,
+         trained_at REAL NOT NULL)
+    """, """
+        DROP TABLE body_dictionaries
+    """)
+]
@@ -3,11 +3,16 @@ import json
 import logging
 import logging.config
 import os.path
-import time
 from backup.config import Config, ConfigKey
-from backup.client.edemocracy import EDemocracyClient
+from backup.client.cache import ResponseCache
+from backup.client.metrics import Metrics
+from backup.client.edemocracy import CircuitBreaker, ConcurrencyLimiter, \
+    EDemocracyClient, RateLimiter, RetryPolicy
+from backup.recompress import Recompress
+from backup.reindex import Reindex
 from backup.store.sqlite import Store
-from backup.sync import Sync, Threaded
+from backup.sync import AsyncSync, Asynchronous, Journal, Pipeline, Sync, \
+    Threaded
 
 LOG_CONFIG_PATH = 'config/logging.conf'
 
@@ -16,6 +21,29 @@ if os.path.isfile(LOG_CONFIG_PATH):
 logger = logging.getLogger('backup')
 DB_PATH = Config.get(ConfigKey.DATABASE_PATH)
 logger.info("Using Database at %s" % DB_PATH)
+ENGINE = (Config.get(ConfigKey.ENGINE) or 'async').lower()
+CONCURRENCY = int(Config.get(ConfigKey.CONCURRENCY) or 100)
+ADAPTIVE_CONCURRENCY = (Config.get(ConfigKey.ADAPTIVE_CONCURRENCY) or
+                        'true').lower() == 'true'
+CONCURRENCY_LIMITER = ConcurrencyLimiter(maximum=CONCURRENCY) \
+    if ADAPTIVE_CONCURRENCY else None
+PARSE_PROCESSES = int(Config.get(ConfigKey.PARSE_PROCESSES) or 0)
+REINDEX_SCOPE = (Config.get(ConfigKey.REINDEX_SCOPE) or 'missing').lower()
+MONTH_SYNC = (Config.get(ConfigKey.MONTH_SYNC) or 'incremental').lower()
+PROFILE_TTL = float(Config.get(ConfigKey.PROFILE_TTL) or 30)
+RUN_MODE = (Config.get(ConfigKey.RUN_MODE) or 'new').lower()
+RATE_LIMIT = float(Config.get(ConfigKey.RATE_LIMIT) or 3)
+RATE_LIMITER = RateLimiter(
+    RATE_LIMIT,
+    int(Config.get(ConfigKey.RATE_BURST) or max(1, RATE_LIMIT)),
+    RateLimiter.parse_endpoints(Config.get(ConfigKey.ENDPOINT_RATE_LIMITS)))
+RETRIES = int(Config.get(ConfigKey.RETRIES) or 5)
+CACHE_PATH = Config.get(ConfigKey.CACHE_PATH)
+CACHE_SIZE = int(Config.get(ConfigKey.CACHE_SIZE) or 256) * 1024 * 1024
+CACHE_MAX_AGE = int(Config.get(ConfigKey.CACHE_MAX_AGE) or 0)
+METRICS_PATH = Config.get(ConfigKey.METRICS_PATH)
+BASE_URL = Config.get(ConfigKey.BASE_URL)
+METRICS = Metrics()
 
 
 def get_command():
@@ -41,33 +69,113 @@ def get_username_password():
     return (Config.get(ConfigKey.USERNAME), Config.get(ConfigKey.PASSWORD))
 
 
+def create_master_client():
+    """
+    Creates the client that commands log in with. Worker clients share its
+    session, rate limiter, retry policy, circuit breaker, cache,
+    concurrency limiter and metrics. The response cache, if CACHE_PATH is
+    set, is opened here and closed along with the client.
+    """
+    cache = ResponseCache(CACHE_PATH, CACHE_SIZE, CACHE_MAX_AGE) \
+        if CACHE_PATH else None
+    return EDemocracyClient(rate_limiter=RATE_LIMITER,
+                            retry_policy=RetryPolicy(RETRIES),
+                            circuit_breaker=CircuitBreaker(),
+                            cache=cache,
+                            concurrency_limiter=CONCURRENCY_LIMITER,
+                            metrics=METRICS,
+                            base_url=BASE_URL)
+
+
+def report_metrics():
+    """
+    Logs a summary of the requests made by the command, and writes them to
+    METRICS_PATH, if set.
+    """
+    for line in METRICS.summary():
+        logger.info(line)
+    if METRICS_PATH:
+        METRICS.write(METRICS_PATH)
+
+
+def open_journal(command, store):
+    """
+    Opens the journal of a run of the named command. Unless RUN_MODE is
+    'new', the last run of the command is resumed or retried, if there is
+    one. Only a run that did not finish can be resumed, as a finished run
+    no longer records the items it synced.
+
+    :param command: Name of the command being run
+    :param store: Store to keep the journal in
+    """
+    run_id = None
+    if RUN_MODE != 'new':
+        run_id = store.fetch_last_sync_run(command,
+                                           unfinished=RUN_MODE == 'resume')
+        if run_id is None:
+            logger.info("No earlier run of %s to %s, starting a new run" %
+                        (command, RUN_MODE))
+    if run_id is None:
+        return Journal(store.create_sync_run(command))
+
+    logger.info("Running %s in %s mode, continuing run %i" %
+                (command, RUN_MODE, run_id))
+    return Journal(run_id, RUN_MODE)
+
+
+def run_sync(task, items, master_client, journal, total=None):
+    """
+    Runs the named Sync task over every item, using the configured engine.
+
+    :param task: Name of the Sync task to run, such as 'group_members'
+    :param items: Items to run the task over
+    :param master_client: Logged in client to share the session of
+    :param journal: Journal of the run
+    :param total: Number of items, if items is an iterator
+    """
+    if ENGINE == 'threaded':
+        Threaded(getattr(Sync, task), items, master_client, DB_PATH,
+                 total=total, journal=journal,
+                 concurrency_limiter=CONCURRENCY_LIMITER,
+                 parse_processes=PARSE_PROCESSES)()
+    else:
+        Asynchronous(getattr(AsyncSync, task), items, master_client, DB_PATH,
+                     CONCURRENCY, total=total, journal=journal,
+                     concurrency_limiter=CONCURRENCY_LIMITER,
+                     parse_processes=PARSE_PROCESSES)()
+
+
 def sync_group_members_and_profiles():
     (username, password) = get_username_password()
 
-    with EDemocracyClient() as master_client, \
+    with create_master_client() as master_client, \
             Store(DB_PATH) as master_store:
         try:
             # Login to the site; worker clients will use the same server
             # session
             master_client.login(username, password)
+            journal = open_journal('sync_group_members_and_profiles',
+                                   master_store)
 
             # Fetch list of groups
             logger.info("Fetching list of groups")
             groups = master_client.get_groups()
             logger.info("Fetching list of groups complete")
 
-            # Multithreaded sync of group membership
+            # Concurrent sync of group membership
             logger.info("%i groups to sync membership of" % len(groups))
-            Threaded(Sync.group_members, groups, master_client, DB_PATH)()
+            run_sync('group_members', groups, master_client, journal)
             logger.info("Group membership syncing complete")
 
-            # List of all members to get profiles for
-            members = master_store.fetch_all_unique_group_members()
+            # List of members whose profiles are new or stale
+            members = master_store.fetch_members_due_for_profile(
+                PROFILE_TTL * 24 * 60 * 60)
 
             logger.info("%i member profiles to sync" % len(members))
-            # Multithreaded sync of member profiles
-            Threaded(Sync.member_profile, members, master_client, DB_PATH)()
+            # Concurrent sync of member profiles
+            run_sync('member_profile', members, master_client, journal)
             logger.info("Member Profile syncing complete")
+            master_store.finish_sync_run(journal.run_id)
         finally:
             master_client.logout()
 
@@ -76,22 +184,24 @@ def sync_message_ids_for_month(month):
     (username, password) = get_username_password()
     logger.info("Getting ids for month %s" % month)
 
-    with EDemocracyClient() as master_client, \
+    with create_master_client() as master_client, \
             Store(DB_PATH) as master_store:
         try:
             # Login to the site; worker clients will use the same server
             # session
             master_client.login(username, password)
+            journal = open_journal('sync_message_ids_for_month', master_store)
 
             # Get groups already in the store
             groups = master_store.fetch_all_groups()
             args = [{'group': group, 'month': month} for group in groups]
 
-            # Multithreaded sync of message IDs
+            # Concurrent sync of message IDs
             logger.info("%i groups to message IDs for" % len(groups))
-            Threaded(Sync.message_ids_of_group_and_month, args,
-                     master_client, DB_PATH)()
+            run_sync('message_ids_of_group_and_month', args, master_client,
+                     journal)
             logger.info("Group message ID syncing complete")
+            master_store.finish_sync_run(journal.run_id)
         finally:
             master_client.logout()
 
@@ -111,44 +221,70 @@ def prompt_and_sync_message_ids_for_month():
 
 
 def sync_message_ids_for_all_months():
-    def get_months(group, client):
-        logger.info("Fetching months for group %s" % group)
+    (username, password) = get_username_password()
+
+    with create_master_client() as master_client, \
+            Store(DB_PATH) as master_store:
         try:
-            time.sleep(0.5)
-            return client.get_message_months_of_group(group)
-        except Exception as e:
-            logger.exception(e)
-            return []
+            # Login to the site; worker clients will use the same server
+            # session
+            master_client.login(username, password)
+            journal = open_journal('sync_message_ids_for_all_months',
+                                   master_store)
+
+            # Get groups already in the store
+            groups = master_store.fetch_all_groups()
 
+            # Pipelined sync of the months of each group, and the message IDs
+            # of each month as soon as it is found. Incremental syncs skip
+            # months that are already closed in the store.
+            months = AsyncSync.message_months_of_group \
+                if MONTH_SYNC == 'full' \
+                else AsyncSync.open_message_months_of_group
+            logger.info("%i groups to gather months and message IDs of" %
+                        len(groups))
+            Pipeline([months, AsyncSync.message_ids_of_group_and_month],
+                     groups, master_client, DB_PATH, CONCURRENCY,
+                     journal=journal,
+                     concurrency_limiter=CONCURRENCY_LIMITER,
+                     parse_processes=PARSE_PROCESSES)()
+            logger.info("Group message ID syncing complete")
+            master_store.finish_sync_run(journal.run_id)
+        finally:
+            master_client.logout()
+
+
+def sync_messages_for_all_months():
     (username, password) = get_username_password()
 
-    with EDemocracyClient() as master_client, \
+    with create_master_client() as master_client, \
             Store(DB_PATH) as master_store:
         try:
             # Login to the site; worker clients will use the same server
             # session
             master_client.login(username, password)
+            journal = open_journal('sync_messages_for_all_months',
+                                   master_store)
 
             # Get groups already in the store
             groups = master_store.fetch_all_groups()
 
-            # Get months to fetch for each group
-            # This does a serial fetch of months from each group.
-            logger.info(
-                "Gathering all months which have posts from all groups")
-            args = [
-                {'group': group, 'month': month}
-                for group in groups
-                for month in get_months(group, master_client)
-            ]
-            logger.info("Finished gathering all months from all groups")
-
-            # Multithreaded sync of message IDs
-            logger.info("%i groups X months to get message IDs for" %
-                        len(args))
-            Threaded(Sync.message_ids_of_group_and_month, args,
-                     master_client, DB_PATH)()
-            logger.info("Group message ID syncing complete")
+            # Pipelined sync of the months of each group, the message IDs of
+            # each month as soon as it is found, and the bodies of those
+            # messages as soon as their IDs are found
+            months = AsyncSync.message_months_of_group \
+                if MONTH_SYNC == 'full' \
+                else AsyncSync.open_message_months_of_group
+            logger.info("%i groups to gather months, message IDs and "
+                        "messages of" % len(groups))
+            Pipeline([months, AsyncSync.new_messages_of_group_and_month,
+                      AsyncSync.message],
+                     groups, master_client, DB_PATH, CONCURRENCY,
+                     journal=journal,
+                     concurrency_limiter=CONCURRENCY_LIMITER,
+                     parse_processes=PARSE_PROCESSES)()
+            logger.info("Group message syncing complete")
+            master_store.finish_sync_run(journal.run_id)
         finally:
             master_client.logout()
 
@@ -156,24 +292,46 @@ def sync_message_ids_for_all_months():
 def sync_empty_messages():
     (username, password) = get_username_password()
 
-    with EDemocracyClient() as master_client, \
+    with create_master_client() as master_client, \
             Store(DB_PATH) as master_store:
         try:
             # Login to the site; worker clients will use the same server
             # session
             master_client.login(username, password)
+            journal = open_journal('sync_empty_messages', master_store)
 
-            # Get empty messages in the store
-            messages = master_store.fetch_empty_group_messages()
+            # Stream empty messages from the store
+            count = master_store.count_empty_group_messages()
+            messages = master_store.iter_empty_group_messages()
 
-            # Multithreaded sync of message IDs
-            logger.info("%i message bodies to sync" % len(messages))
-            Threaded(Sync.message, messages, master_client, DB_PATH)()
+            # Concurrent sync of message bodies
+            logger.info("%i message bodies to sync" % count)
+            run_sync('message', messages, master_client, journal, total=count)
             logger.info("Message syncing complete")
+            master_store.finish_sync_run(journal.run_id)
         finally:
             master_client.logout()
 
 
+def reindex_messages():
+    with Store(DB_PATH) as master_store:
+        journal = open_journal('reindex_messages', master_store)
+        logger.info("Reindexing %s message metadata" % REINDEX_SCOPE)
+        Reindex(DB_PATH, journal, processes=PARSE_PROCESSES or None,
+                missing_only=REINDEX_SCOPE != 'all')()
+        logger.info("Message reindexing complete")
+        master_store.finish_sync_run(journal.run_id)
+
+
+def compress_messages():
+    with Store(DB_PATH) as master_store:
+        journal = open_journal('compress_messages', master_store)
+        Recompress(DB_PATH, journal, processes=PARSE_PROCESSES or None)()
+        logger.info("Message compression complete, reclaiming space")
+        master_store.vacuum()
+        master_store.finish_sync_run(journal.run_id)
+
+
 def print_group_member_email_addresses():
     group = input('Group ID: ')
     output_file = input('Output File: ')
@@ -199,12 +357,22 @@ if __name__ == '__main__':
     print("\t 5: Sync messages in the DB that do not currently have a body")
     print("\t 6: Export email addresses of member of a group to a file")
     print("\t 7: Print Settings")
-    {
+    print("\t 8: Sync messages IDs and bodies across all groups for all time")
+    print("\t 9: Reindex the metadata of messages from their bodies")
+    print("\t10: Compress the bodies of messages")
+    commands = {
         '1': sync_group_members_and_profiles,
         '2': sync_message_ids_for_current_months,
         '3': prompt_and_sync_message_ids_for_month,
         '4': sync_message_ids_for_all_months,
         '5': sync_empty_messages,
         '6': print_group_member_email_addresses,
-        '7': print_settings
-    }[get_command()]()
+        '7': print_settings,
+        '8': sync_messages_for_all_months,
+        '9': reindex_messages,
+        '10': compress_messages
+    }
+    try:
+        commands[get_command()]()
+    finally:
+        report_metrics()
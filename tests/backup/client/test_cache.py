@@ -0,0 +1,69 @@
+from mock import patch
+import os
+import tempfile
+import unittest
+
+from backup.client.cache import ResponseCache
+
+
+@patch('backup.client.cache.time.time')
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_and_get(self, now):
+        now.return_value = 100
+        with ResponseCache(self.path) as cache:
+            cache.put('http://a', '"etag"', 'Mon, 01 Jan 2018 00:00:00 GMT',
+                      '["member0"]')
+
+        # Assert that responses survive reopening the cache
+        with ResponseCache(self.path) as cache:
+            cached = cache.get('http://a')
+            self.assertEqual('["member0"]', cached.body)
+            self.assertEqual({
+                'If-None-Match': '"etag"',
+                'If-Modified-Since': 'Mon, 01 Jan 2018 00:00:00 GMT'
+            }, cache.validators(cached))
+            self.assertIsNone(cache.get('http://b'))
+
+    def test_put_without_validators(self, now):
+        now.return_value = 100
+        with ResponseCache(self.path) as cache:
+            cache.put('http://a', None, None, '[]')
+            self.assertIsNone(cache.get('http://a'))
+
+    def test_is_fresh(self, now):
+        now.return_value = 100
+        with ResponseCache(self.path, max_age=60) as cache:
+            cache.put('http://a', None, None, '[]')
+            cached = cache.get('http://a')
+            self.assertTrue(cache.is_fresh(cached))
+
+            now.return_value = 200
+            self.assertFalse(cache.is_fresh(cached))
+
+            cache.refresh('http://a')
+            self.assertTrue(cache.is_fresh(cache.get('http://a')))
+
+    def test_evicts_least_recently_used(self, now):
+        with ResponseCache(self.path, max_size=20) as cache:
+            now.return_value = 100
+            cache.put('http://a', 'a', None, '0123456789')
+            now.return_value = 101
+            cache.put('http://b', 'b', None, '0123456789')
+
+            # Use a, then add c, which evicts b
+            now.return_value = 102
+            cache.get('http://a')
+            now.return_value = 103
+            cache.put('http://c', 'c', None, '0123456789')
+
+            self.assertIsNotNone(cache.get('http://a'))
+            self.assertIsNone(cache.get('http://b'))
+            self.assertIsNotNone(cache.get('http://c'))
+            self.assertEqual(20, cache.size)
@@ -1,10 +1,33 @@
+from aioresponses import aioresponses
+import asyncio
+import gzip
 import json
+from mock import Mock, patch
+import os
 import requests_mock
+import tempfile
+from threading import current_thread, Thread
 import unittest
 
-from backup.client.edemocracy import EDemocracyClient, \
+from backup.client.cache import ResponseCache
+from backup.client.metrics import Metrics
+
+from backup.client.edemocracy import AsyncEDemocracyClient, \
+    CircuitBreaker, \
+    ConcurrencyLimiter, \
+    EDemocracyClient, \
     EDemocracyClientException, \
-    EDemocracyLoginException
+    EDemocracyLoginException, \
+    RateLimiter, \
+    RetryPolicy, \
+    TokenBucket
+
+
+def returning(value):
+    """Creates a coroutine function that returns the provided value."""
+    async def coroutine(*args):
+        return value
+    return coroutine
 
 
 @requests_mock.Mocker()
@@ -55,6 +78,120 @@ class EDemocracyClientTestCase(unittest.TestCase):
         new_client = EDemocracyClient(self.client)
         self.assertEqual('foo', new_client.session.cookies['__ac'])
         self.assertEqual('bar', new_client.session.cookies['SERVERID'])
+        self.assertIs(self.client.rate_limiter, new_client.rate_limiter)
+        self.assertIs(self.client.parser, new_client.parser)
+
+    def test_get_groups_with_parser(self, mr):
+        mr.get('http://forums.e-democracy.org/groups/', text='page')
+        parser = Mock()
+        parser.parse_groups.return_value = ['hub']
+        client = EDemocracyClient(parser=parser)
+
+        self.assertEqual(['hub'], client.get_groups())
+        parser.parse_groups.assert_called_once_with('page')
+
+    def test_base_url(self, mr):
+        mr.get('http://localhost:8080/groups/a_group/members.json',
+               text=self.group_a_members_json)
+        client = EDemocracyClient(base_url='http://localhost:8080')
+
+        self.assertEqual(['member0', 'member1'],
+                         client.get_group_members('a_group'))
+        self.assertEqual('http://localhost:8080',
+                         EDemocracyClient(client).base_url)
+
+    def test_requests_are_rate_limited(self, mr):
+        mr.get('http://forums.e-democracy.org/groups/a_group/members.json',
+               text=self.group_a_members_json)
+        rate_limiter = Mock()
+        client = EDemocracyClient(rate_limiter=rate_limiter)
+
+        client.get_group_members('a_group')
+        rate_limiter.wait.assert_called_once_with('members')
+
+    @patch('backup.client.edemocracy.time.sleep')
+    def test_requests_are_retried(self, mr, sleep):
+        mr.get('http://forums.e-democracy.org/groups/a_group/members.json',
+               [{'status_code': 502},
+                {'status_code': 503, 'headers': {'Retry-After': '7'}},
+                {'text': self.group_a_members_json}])
+        client = EDemocracyClient(retry_policy=RetryPolicy(2))
+
+        self.assertEqual(client.get_group_members('a_group'),
+                         ['member0', 'member1'])
+        self.assertEqual(3, mr.call_count)
+        self.assertEqual(7, sleep.call_args_list[1][0][0])
+
+    @patch('backup.client.edemocracy.time.sleep')
+    def test_requests_retries_exhausted(self, mr, sleep):
+        mr.get('http://forums.e-democracy.org/groups/a_group/members.json',
+               status_code=502)
+        client = EDemocracyClient(retry_policy=RetryPolicy(2))
+
+        with self.assertRaises(EDemocracyClientException):
+            client.get_group_members('a_group')
+        self.assertEqual(3, mr.call_count)
+
+    @patch('backup.client.edemocracy.time.sleep')
+    def test_requests_not_found_not_retried(self, mr, sleep):
+        mr.get('http://forums.e-democracy.org/groups/a_group/members.json',
+               status_code=404)
+        client = EDemocracyClient(retry_policy=RetryPolicy(2))
+
+        with self.assertRaises(EDemocracyClientException):
+            client.get_group_members('a_group')
+        self.assertEqual(1, mr.call_count)
+
+    def test_conditional_requests(self, mr):
+        url = 'http://forums.e-democracy.org/p/member0/profile.json'
+        mr.get(url, [{'text': self.member_profile_json,
+                      'headers': {'ETag': '"v1"'}},
+                     {'status_code': 304}])
+
+        with tempfile.TemporaryDirectory() as directory, \
+                ResponseCache(os.path.join(directory, 'cache.sqlite')) \
+                as cache:
+            client = EDemocracyClient(EDemocracyClient(cache=cache))
+            self.assertEqual(client.get_profile_of_member('member0'),
+                             self.member_profile)
+            self.assertEqual(client.get_profile_of_member('member0'),
+                             self.member_profile)
+
+        self.assertNotIn('If-None-Match', mr.request_history[0].headers)
+        self.assertEqual('"v1"',
+                         mr.request_history[1].headers['If-None-Match'])
+
+    def test_close_closes_own_cache(self, mr):
+        cache = Mock()
+        with EDemocracyClient(cache=cache) as client:
+            EDemocracyClient(client).close()
+            cache.close.assert_not_called()
+        cache.close.assert_called_once_with()
+
+    def test_requests_observed_by_circuit_breaker(self, mr):
+        mr.get('http://forums.e-democracy.org/groups/a_group/members.json',
+               status_code=500)
+        circuit_breaker = Mock()
+        circuit_breaker.wait_time.return_value = 0
+        client = EDemocracyClient(circuit_breaker=circuit_breaker)
+        new_client = EDemocracyClient(client)
+
+        with self.assertRaises(EDemocracyClientException):
+            new_client.get_group_members('a_group')
+        circuit_breaker.wait.assert_called_once_with()
+        circuit_breaker.observe.assert_called_once_with('members', 500)
+
+    def test_requests_take_concurrency_slots(self, mr):
+        mr.get('http://forums.e-democracy.org/groups/a_group/members.json',
+               text=self.group_a_members_json)
+        concurrency_limiter = Mock()
+        client = EDemocracyClient(concurrency_limiter=concurrency_limiter)
+        new_client = EDemocracyClient(client)
+
+        new_client.get_group_members('a_group')
+        concurrency_limiter.acquire.assert_called_once_with()
+        self.assertEqual(200,
+                         concurrency_limiter.release.call_args[0][0])
 
     ########################################
     # Group Membership
@@ -133,8 +270,41 @@ class EDemocracyClientTestCase(unittest.TestCase):
                'gs-group-messages-export-mbox/message0',
                text=self.group_a_message0)
 
-        self.assertCountEqual(self.client.get_message_of_group(
-            'a_group', 'message0'), self.group_a_message0)
+        self.assertEqual(self.client.get_message_of_group(
+            'a_group', 'message0'), self.group_a_message0.encode())
+
+    def test_get_message_of_group_metrics(self, mr):
+        mr.get('http://forums.e-democracy.org/groups/a_group/messages/'
+               'gs-group-messages-export-mbox/message0',
+               text=self.group_a_message0)
+        metrics = Metrics()
+        client = EDemocracyClient(metrics=metrics)
+
+        # Assert that the streamed body is counted once it is read
+        EDemocracyClient(client).get_message_of_group('a_group', 'message0')
+        mbox = metrics.endpoints['mbox']
+        self.assertEqual(1, mbox.requests)
+        self.assertEqual({'200': 1}, mbox.statuses)
+        self.assertEqual(len(self.group_a_message0.encode()), mbox.bytes)
+
+    def test_get_message_of_group_raw_bytes(self, mr):
+        body = 'From: Se\xf1or <senor@example.com>\n\nCaf\xe9' \
+            .encode('latin-1')
+        mr.get('http://forums.e-democracy.org/groups/a_group/messages/'
+               'gs-group-messages-export-mbox/message0',
+               content=body)
+
+        self.assertEqual(self.client.get_message_of_group(
+            'a_group', 'message0'), body)
+
+    def test_get_message_of_group_compressed(self, mr):
+        mr.get('http://forums.e-democracy.org/groups/a_group/messages/'
+               'gs-group-messages-export-mbox/message0',
+               content=gzip.compress(self.group_a_message0.encode()),
+               headers={'Content-Encoding': 'gzip'})
+
+        self.assertEqual(self.client.get_message_of_group(
+            'a_group', 'message0'), self.group_a_message0.encode())
 
     def test_get_message_of_group_retrieval_error(self, mr):
         mr.get('http://forums.e-democracy.org/groups/a_group/messages/'
@@ -205,3 +375,434 @@ class EDemocracyClientTestCase(unittest.TestCase):
 
         with self.assertRaises(EDemocracyClientException):
             self.client.whoami()
+
+
+@patch('backup.client.edemocracy.time.monotonic')
+class RateLimiterTestCase(unittest.TestCase):
+    def test_token_bucket(self, monotonic):
+        monotonic.return_value = 100
+        bucket = TokenBucket(2, burst=2)
+
+        # A full bucket allows a burst without waiting
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0, bucket.reserve())
+
+        # An empty bucket makes callers wait their turn
+        self.assertEqual(0.5, bucket.reserve())
+        self.assertEqual(1, bucket.reserve())
+
+        # A bucket refills over time, but never beyond its burst
+        monotonic.return_value = 110
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0.5, bucket.reserve())
+
+    def test_token_bucket_try_take(self, monotonic):
+        monotonic.return_value = 100
+        bucket = TokenBucket(2, burst=2)
+
+        # Takes succeed until the bucket is empty
+        self.assertTrue(bucket.try_take())
+        self.assertTrue(bucket.try_take())
+
+        # Refused takes do not borrow from the tokens yet to be added
+        for i in range(10):
+            self.assertFalse(bucket.try_take())
+        monotonic.return_value = 100.5
+        self.assertTrue(bucket.try_take())
+        self.assertFalse(bucket.try_take())
+
+    def test_rate_limiter(self, monotonic):
+        monotonic.return_value = 100
+        rate_limiter = RateLimiter(10, 1, {'mbox': (1, 1)})
+
+        # The overall limit applies to every endpoint
+        self.assertEqual(0, rate_limiter.reserve('profile'))
+        self.assertEqual(0.1, rate_limiter.reserve('profile'))
+
+        # Endpoint limits apply on top of the overall limit
+        monotonic.return_value = 110
+        self.assertEqual(0, rate_limiter.reserve('mbox'))
+        self.assertEqual(1, rate_limiter.reserve('mbox'))
+
+    def test_rate_limiter_unlimited(self, monotonic):
+        rate_limiter = RateLimiter()
+        for i in range(10):
+            self.assertEqual(0, rate_limiter.reserve('mbox'))
+
+    def test_parse_endpoints(self, monotonic):
+        self.assertEqual({'mbox': (5, 10), 'profile': (0.5, 1)},
+                         RateLimiter.parse_endpoints('mbox=5:10, profile=0.5'))
+        self.assertEqual({}, RateLimiter.parse_endpoints(None))
+
+    def test_parse_endpoints_invalid(self, monotonic):
+        for text in ['mbox=0', 'mbox=-1:2', 'mbox=nan', 'mbox=1:0', 'mbox']:
+            with self.assertRaises(ValueError):
+                RateLimiter.parse_endpoints(text)
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+    def test_should_retry(self):
+        policy = RetryPolicy(2)
+        self.assertTrue(policy.should_retry(1, 503))
+        self.assertTrue(policy.should_retry(2, None))
+        self.assertFalse(policy.should_retry(3, 503))
+        self.assertFalse(policy.should_retry(1, 404))
+        self.assertFalse(RetryPolicy().should_retry(1, 503))
+
+    def test_delay(self):
+        policy = RetryPolicy(10, base_delay=1, max_delay=30)
+        for attempt in range(1, 10):
+            self.assertLessEqual(0, policy.delay(attempt))
+            self.assertGreaterEqual(min(30, 2 ** (attempt - 1)),
+                                    policy.delay(attempt))
+
+    def test_delay_retry_after(self):
+        policy = RetryPolicy(10, max_delay=30)
+        self.assertEqual(7, policy.delay(1, '7'))
+        self.assertEqual(30, policy.delay(1, '120'))
+        self.assertEqual(0, policy.delay(1, 'Wed, 21 Oct 2015 07:28:00 GMT'))
+
+
+@patch('backup.client.edemocracy.time.monotonic')
+class CircuitBreakerTestCase(unittest.TestCase):
+    def test_opens_on_errors(self, monotonic):
+        monotonic.return_value = 100
+        breaker = CircuitBreaker(window=10, min_requests=4, threshold=0.5,
+                                 cooldown=30)
+
+        # Mostly successful requests keep the breaker closed
+        for status in [200, 200, 200, 502]:
+            breaker.observe('mbox', status)
+        self.assertEqual(0, breaker.wait_time())
+
+        # A spike of errors opens it
+        for status in [502, None, 429]:
+            breaker.observe('mbox', status)
+        self.assertEqual(30, breaker.wait_time())
+
+        # Until the cooldown has passed
+        monotonic.return_value = 130
+        self.assertEqual(0, breaker.wait_time())
+
+    def test_judges_recent_requests(self, monotonic):
+        monotonic.return_value = 100
+        breaker = CircuitBreaker(window=10, min_requests=4, threshold=0.5,
+                                 cooldown=30)
+        for status in [502, 502, 502]:
+            breaker.observe('mbox', status)
+
+        # Errors older than the window are forgotten
+        monotonic.return_value = 120
+        for status in [200, 200, 200, 502]:
+            breaker.observe('mbox', status)
+        self.assertEqual(0, breaker.wait_time())
+
+
+@patch('backup.client.edemocracy.time.monotonic')
+class ConcurrencyLimiterTestCase(unittest.TestCase):
+    def test_slots(self, monotonic):
+        limiter = ConcurrencyLimiter(maximum=100, initial=2)
+
+        # Slots are counted as they are taken and released
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEqual(2, limiter.in_flight)
+        limiter.release(200, 0.1)
+        self.assertEqual(1, limiter.in_flight)
+
+    def test_increases_while_steady(self, monotonic):
+        limiter = ConcurrencyLimiter(maximum=5, initial=2)
+
+        # About a round of successful requests raises the limit by one
+        for i in range(3):
+            limiter.acquire()
+            limiter.release(200, 0.1)
+        self.assertEqual(3, int(limiter.limit))
+
+        # But never past the maximum
+        for i in range(100):
+            limiter.acquire()
+            limiter.release(200, 0.1)
+        self.assertEqual(5, limiter.limit)
+
+    def test_backs_off_on_errors(self, monotonic):
+        monotonic.return_value = 100
+        limiter = ConcurrencyLimiter(minimum=2, maximum=100, initial=40,
+                                     cooldown=1)
+
+        # A burst of errors halves the limit once
+        for status in [502, 429, None]:
+            limiter.acquire()
+            limiter.release(status, 0.1)
+        self.assertEqual(20, limiter.limit)
+
+        # Errors after the cooldown halve it again, down to the minimum
+        for i in range(5):
+            monotonic.return_value += 1
+            limiter.acquire()
+            limiter.release(503, 0.1)
+        self.assertEqual(2, limiter.limit)
+
+    def test_backs_off_on_rising_latency(self, monotonic):
+        monotonic.return_value = 100
+        limiter = ConcurrencyLimiter(maximum=100, initial=40, tolerance=2)
+        for i in range(10):
+            limiter.acquire()
+            limiter.release(200, 0.1)
+        limit = limiter.limit
+
+        # Latency climbing well past its baseline cuts the limit
+        for i in range(20):
+            limiter.acquire()
+            limiter.release(200, 1.0)
+        self.assertLess(limiter.limit, limit / 2 + 1)
+
+    def test_acquire_waits_for_a_slot(self, monotonic):
+        limiter = ConcurrencyLimiter(maximum=100, initial=1)
+        limiter.acquire()
+
+        # Wait for the slot from another thread, until it is released
+        waiter = Thread(target=limiter.acquire)
+        waiter.start()
+        waiter.join(0.05)
+        self.assertTrue(waiter.is_alive())
+        limiter.release(200, 0.1)
+        waiter.join(1)
+
+        # Assert that the waiter woke and took the slot
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(1, limiter.in_flight)
+
+    def test_acquire_async_waits_for_a_slot(self, monotonic):
+        limiter = ConcurrencyLimiter(maximum=100, initial=1)
+        limiter.acquire()
+        loop = asyncio.new_event_loop()
+
+        async def wait_then_release():
+            waiter = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0)
+            self.assertFalse(waiter.done())
+            limiter.release(200, 0.1)
+            await waiter
+
+        # Assert that the waiting coroutine woke and took the slot
+        try:
+            loop.run_until_complete(wait_then_release())
+        finally:
+            loop.close()
+        self.assertEqual(1, limiter.in_flight)
+        self.assertEqual(0, len(limiter.async_waiters))
+
+
+class AsyncEDemocracyClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+        # Set some fixtures
+        self.group_a_members = ['member0', 'member1']
+        self.member_profile = {
+            "id": "member0",
+            "fn": "First Last",
+            "email": [
+                "person@example.com"
+            ]
+        }
+        self.group_a_message0 = """
+        This is a message
+        It Has Lines
+        """
+
+        with open('tests/fixtures/pages/groups.html') as f:
+            self.group_page_html = f.read()
+        with open('tests/fixtures/pages/messages_export.html') as f:
+            self.group_message_export_html = f.read()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_client(self, method, *args):
+        async def call():
+            async with AsyncEDemocracyClient() as client:
+                return await getattr(client, method)(*args)
+        return self.loop.run_until_complete(call())
+
+    def test_init_with_existing_client(self):
+        client = EDemocracyClient()
+        client.session.cookies['__ac'] = 'foo'
+
+        new_client = AsyncEDemocracyClient(client)
+        self.assertEqual({'__ac': 'foo'}, new_client.cookies)
+        self.assertIs(client.rate_limiter, new_client.rate_limiter)
+
+    def test_get_groups(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/groups/',
+                   body=self.group_page_html)
+            expectedGroups = ['another_group', 'city-central', 'city-issues',
+                              'design', 'hub', 'other_secret', 'secret']
+
+            self.assertEqual(self.run_client('get_groups'), expectedGroups)
+
+    def test_get_group_members(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/groups/a_group/'
+                   'members.json',
+                   body=json.dumps(self.group_a_members))
+
+            self.assertEqual(self.run_client('get_group_members', 'a_group'),
+                             self.group_a_members)
+
+    def test_group_members_retrieval_error(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/groups/a_group/'
+                   'members.json',
+                   status=500)
+
+            with self.assertRaises(EDemocracyClientException):
+                self.run_client('get_group_members', 'a_group')
+
+    def test_get_profile_of_member(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/p/member0/profile.json',
+                   body=json.dumps(self.member_profile))
+
+            self.assertEqual(self.run_client('get_profile_of_member',
+                                             'member0'),
+                             self.member_profile)
+
+    def test_get_messages_of_group_and_month(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/groups/a_group/messages/'
+                   'gs-group-messages-export-posts.json?month=201801',
+                   body=json.dumps(['message1', 'message2']))
+
+            self.assertCountEqual(
+                self.run_client('get_messages_of_group_and_month',
+                                'a_group', '201801'),
+                ['message1', 'message2'])
+
+    def test_get_message_of_group(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/groups/a_group/messages/'
+                   'gs-group-messages-export-mbox/message0',
+                   body=self.group_a_message0)
+
+            self.assertEqual(self.run_client('get_message_of_group',
+                                             'a_group', 'message0'),
+                             self.group_a_message0.encode())
+
+    def test_get_message_of_group_metrics(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/groups/a_group/messages/'
+                   'gs-group-messages-export-mbox/message0',
+                   body=self.group_a_message0)
+            metrics = Metrics()
+
+            async def call():
+                async with AsyncEDemocracyClient(metrics=metrics) as client:
+                    return await client.get_message_of_group('a_group',
+                                                             'message0')
+
+            self.loop.run_until_complete(call())
+            mbox = metrics.endpoints['mbox']
+            self.assertEqual(1, mbox.requests)
+            self.assertEqual(len(self.group_a_message0.encode()), mbox.bytes)
+
+    def test_get_message_of_group_retrieval_error(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/groups/a_group/messages/'
+                   'gs-group-messages-export-mbox/message0',
+                   status=404)
+
+            with self.assertRaises(EDemocracyClientException):
+                self.run_client('get_message_of_group', 'a_group',
+                                'message0')
+
+    def test_get_message_months_of_group(self):
+        with aioresponses() as mr:
+            mr.get('http://forums.e-democracy.org/groups/hub/messages/'
+                   'export.html',
+                   body=self.group_message_export_html)
+
+            self.assertEqual(self.run_client('get_message_months_of_group',
+                                             'hub'),
+                             ['201510', '201403'])
+
+    @patch('backup.client.edemocracy.asyncio.sleep', new=returning(None))
+    def test_requests_are_retried(self):
+        with aioresponses() as mr:
+            url = 'http://forums.e-democracy.org/groups/a_group/members.json'
+            mr.get(url, status=502)
+            mr.get(url, status=429, headers={'Retry-After': '1'})
+            mr.get(url, body=json.dumps(self.group_a_members))
+
+            async def call():
+                async with AsyncEDemocracyClient(
+                        retry_policy=RetryPolicy(2)) as client:
+                    return await client.get_group_members('a_group')
+
+            self.assertEqual(self.loop.run_until_complete(call()),
+                             self.group_a_members)
+
+    @patch('backup.client.edemocracy.asyncio.sleep', new=returning(None))
+    def test_requests_retries_exhausted(self):
+        with aioresponses() as mr:
+            url = 'http://forums.e-democracy.org/groups/a_group/members.json'
+            for i in range(3):
+                mr.get(url, status=502)
+            circuit_breaker = Mock()
+            circuit_breaker.wait_time.return_value = 0
+
+            async def call():
+                async with AsyncEDemocracyClient(
+                        retry_policy=RetryPolicy(2),
+                        circuit_breaker=circuit_breaker) as client:
+                    return await client.get_group_members('a_group')
+
+            with self.assertRaises(EDemocracyClientException):
+                self.loop.run_until_complete(call())
+            self.assertEqual(3, circuit_breaker.observe.call_count)
+
+    def test_conditional_requests(self):
+        url = 'http://forums.e-democracy.org/p/member0/profile.json'
+        with aioresponses() as mr, \
+                tempfile.TemporaryDirectory() as directory, \
+                ResponseCache(os.path.join(directory, 'cache.sqlite')) \
+                as cache:
+            mr.get(url, body=json.dumps(self.member_profile),
+                   headers={'ETag': '"v1"'})
+            mr.get(url, status=304)
+
+            async def call():
+                async with AsyncEDemocracyClient(cache=cache) as client:
+                    return [await client.get_profile_of_member('member0'),
+                            await client.get_profile_of_member('member0')]
+
+            self.assertEqual(self.loop.run_until_complete(call()),
+                             [self.member_profile, self.member_profile])
+            requests = [r for rs in mr.requests.values() for r in rs]
+            self.assertEqual({'If-None-Match': '"v1"'},
+                             requests[1].kwargs['headers'])
+
+    def test_cache_used_off_the_event_loop(self):
+        url = 'http://forums.e-democracy.org/p/member0/profile.json'
+        threads = []
+
+        def get(url):
+            threads.append(current_thread())
+            return Mock(body=json.dumps(self.member_profile))
+
+        cache = Mock()
+        cache.get.side_effect = get
+        cache.is_fresh.return_value = True
+
+        async def call():
+            async with AsyncEDemocracyClient(cache=cache) as client:
+                return await client.get_profile_of_member('member0')
+
+        # Assert that the cached response was read in another thread
+        self.assertEqual(self.member_profile,
+                         self.loop.run_until_complete(call()))
+        cache.get.assert_called_once_with(url)
+        self.assertIsNot(current_thread(), threads[0])
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from backup.client.metrics import Metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        for latency in [0.01, 0.02, 0.07, 0.3]:
+            self.metrics.observe('profile', 200, latency, 100)
+        self.metrics.observe('profile', 503, 0.02)
+        self.metrics.observe('mbox', None, 120)
+        self.metrics.add_bytes('mbox', 2048)
+
+    def test_observe(self):
+        profile = self.metrics.endpoints['profile']
+        self.assertEqual(5, profile.requests)
+        self.assertEqual(1, profile.errors)
+        self.assertEqual(400, profile.bytes)
+        self.assertEqual({'200': 4, '503': 1}, profile.statuses)
+
+        mbox = self.metrics.endpoints['mbox']
+        self.assertEqual({'error': 1}, mbox.statuses)
+        self.assertEqual(2048, mbox.bytes)
+
+    def test_quantile(self):
+        profile = self.metrics.endpoints['profile']
+
+        # Three of five latencies are under 50ms, one under 100ms and one
+        # under 500ms
+        self.assertAlmostEqual(0.05 * 2.5 / 3, profile.quantile(0.5))
+        self.assertAlmostEqual(0.25 + 0.25 * 0.75, profile.quantile(0.95))
+
+        # Latencies past the last bound are reported as that bound
+        self.assertEqual(60, self.metrics.endpoints['mbox'].quantile(0.99))
+
+    def test_summary(self):
+        summary = self.metrics.summary()
+
+        # Assert that the slowest endpoint comes first
+        self.assertEqual(2, len(summary))
+        self.assertTrue(summary[0].startswith('mbox '))
+        self.assertIn('5 requests', summary[1])
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.prom')
+            self.metrics.write(path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+
+        self.assertIn('edemocracy_requests_total{endpoint="profile",'
+                      'status="503"} 1', lines)
+        self.assertIn('edemocracy_response_bytes_total{endpoint="mbox"} 2048',
+                      lines)
+        self.assertIn('edemocracy_request_duration_seconds_bucket'
+                      '{endpoint="profile",le="0.05"} 3', lines)
+        self.assertIn('edemocracy_request_duration_seconds_bucket'
+                      '{endpoint="mbox",le="+Inf"} 1', lines)
+        self.assertIn('edemocracy_request_duration_seconds_count'
+                      '{endpoint="profile"} 5', lines)
@@ -0,0 +1,60 @@
+import unittest
+from backup.client.parsers import DEFAULT_FEATURES, ListingParser, \
+    SoupListingParser
+
+
+class SoupListingParserTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Parse with both the default parser and the fallback
+        self.parsers = [SoupListingParser(),
+                        SoupListingParser('html.parser')]
+
+        with open('tests/fixtures/pages/groups.html') as f:
+            self.group_page_html = f.read()
+        with open('tests/fixtures/pages/messages_export.html') as f:
+            self.group_message_export_html = f.read()
+
+    def test_default_features(self):
+        self.assertEqual(DEFAULT_FEATURES, SoupListingParser().features)
+
+    def test_listing_parser_is_abstract(self):
+        class GroupsOnlyParser(ListingParser):
+            def parse_groups(self, html):
+                return []
+
+        self.assertRaises(TypeError, ListingParser)
+        self.assertRaises(TypeError, GroupsOnlyParser)
+
+    def test_parse_groups(self):
+        expected_groups = ['another_group', 'city-central', 'city-issues',
+                           'design', 'hub', 'other_secret', 'secret']
+
+        for parser in self.parsers:
+            self.assertEqual(expected_groups,
+                             parser.parse_groups(self.group_page_html))
+
+    def test_parse_groups_ignores_links_outside_body(self):
+        html = '''
+        <a href="/groups/elsewhere">Elsewhere</a>
+        <div id="bodyblock"><a href="/groups/hub">Hub</a></div>
+        '''
+
+        for parser in self.parsers:
+            self.assertEqual(['hub'], parser.parse_groups(html))
+
+    def test_parse_groups_without_list(self):
+        for parser in self.parsers:
+            with self.assertRaises(ValueError):
+                parser.parse_groups('<html><body>Log in</body></html>')
+
+    def test_parse_message_months(self):
+        for parser in self.parsers:
+            self.assertEqual(['201510', '201403'],
+                             parser.parse_message_months(
+                                 self.group_message_export_html))
+
+    def test_parse_message_months_without_list(self):
+        for parser in self.parsers:
+            with self.assertRaises(ValueError):
+                parser.parse_message_months(self.group_page_html)
@@ -0,0 +1,72 @@
+from mock import patch
+import unittest
+from backup.store.compression import BodyCodec, BodyCodecError, zstandard
+
+BODY = ("From: Sender <sender@domain.com>\nSubject: Re: Meeting\n\n"
+        "Thanks for the note about the meeting.\n").encode('utf-8')
+
+
+def sample_bodies(count):
+    return [("From: Sender <sender%i@domain.com>\nSubject: Re: Meeting %i\n\n"
+             "Thanks for the note about meeting %i.\n-- \n"
+             "You are subscribed to the group\n" % (i, i, i)).encode('utf-8')
+            for i in range(count)]
+
+
+class BodyCodecTestCase(unittest.TestCase):
+
+    def test_compress(self):
+        # Compress a body, given as a string, without a dictionary
+        codec = BodyCodec()
+        data, name = codec.compress(BODY.decode('utf-8'))
+
+        # Assert that it decompresses to its bytes, with zstd if installed
+        self.assertEqual('zlib' if zstandard is None else 'zstd', name)
+        self.assertNotEqual(BODY, data)
+        self.assertEqual(BODY, BodyCodec().decompress(data, name))
+
+    @patch('backup.store.compression.zstandard', None)
+    def test_compress_zlib(self):
+        # Compress a body without zstandard
+        data, name = BodyCodec(1).compress(BODY)
+
+        # Assert that zlib was used, dictionary or not
+        self.assertEqual('zlib', name)
+        self.assertEqual(BODY, BodyCodec().decompress(data, name))
+
+    @unittest.skipUnless(zstandard, 'zstandard is not installed')
+    def test_compress_dictionary(self):
+        # Train a dictionary, and compress a body with it
+        dictionaries = {3: BodyCodec.train_dictionary(sample_bodies(300))}
+        data, name = BodyCodec(3, dictionaries.get).compress(BODY)
+
+        # Assert that the codec names the dictionary, and decompresses with it
+        self.assertEqual('zstd:3', name)
+        self.assertEqual(BODY,
+                         BodyCodec(None, dictionaries.get).decompress(data,
+                                                                      name))
+
+    def test_train_dictionary_too_few_samples(self):
+        self.assertIsNone(BodyCodec.train_dictionary(sample_bodies(5)))
+
+    def test_decompress_uncompressed(self):
+        # Assert that bodies saved without a codec are read as they are
+        codec = BodyCodec()
+        self.assertEqual(BODY, codec.decompress(BODY, None))
+        self.assertEqual('body', codec.decompress('body', None))
+        self.assertIsNone(codec.decompress(None, None))
+
+    def test_decompress_unknown(self):
+        with self.assertRaises(BodyCodecError):
+            BodyCodec().decompress(BODY, 'lzma')
+        with self.assertRaises(BodyCodecError):
+            BodyCodec(None, {}.get).decompress(BODY, 'zstd:1')
+
+    @patch('backup.store.compression.zstandard', None)
+    def test_decompress_without_zstandard(self):
+        with self.assertRaises(BodyCodecError):
+            BodyCodec().decompress(BODY, 'zstd')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 from backup.config import Config, ConfigKey
 import json
+from mock import patch
 import sqlite3
 import unittest
 from backup.store.sqlite import Store
@@ -33,22 +34,35 @@ class SQLiteStoreTestCase(unittest.TestCase):
             'groupB': ['member0', 'member1'],
             'groupC': ['member0']
         }
-        cursor = self.db.cursor()
         for mock_group in mock_group_members:
-            cursor.execute('INSERT into group_members values (?, ?)',
-                           (mock_group,
-                            json.dumps(mock_group_members[mock_group])))
-        self.db.commit()
+            self.insert_mock_group(mock_group, mock_group_members[mock_group])
         return mock_group_members
 
+    def insert_mock_group(self, group_id, members):
+        cursor = self.db.cursor()
+        cursor.execute('INSERT into group_members values (?, ?)',
+                       (group_id, json.dumps(members)))
+        cursor.executemany('''
+            INSERT into group_memberships (group_id, member_id) values (?, ?)
+        ''', [(group_id, member) for member in members])
+        self.db.commit()
+
+    def fetch_saved_memberships(self, group_id):
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT member_id from group_memberships WHERE group_id = ?
+        ''', (group_id,))
+        return [r[0] for r in cursor]
+
     def populate_mock_member_profile(self, id):
         mock_profile = {
             'id': id,
             'attr9': 'value9'
         }
         cursor = self.db.cursor()
-        cursor.execute('INSERT into member_profiles values (?, ?)',
-                       (id, json.dumps(mock_profile)))
+        cursor.execute('''
+            INSERT into member_profiles (id, profile) values (?, ?)
+        ''', (id, json.dumps(mock_profile)))
         self.db.commit()
         return mock_profile
 
@@ -103,14 +117,12 @@ class SQLiteStoreTestCase(unittest.TestCase):
         ''')
         saved_members = json.loads(cursor.fetchone()[0])
         self.assertCountEqual(expected_members, saved_members)
+        self.assertCountEqual(expected_members,
+                              self.fetch_saved_memberships('groupA'))
 
     def test_save_group_members_overwrite(self):
         # Initial state: groupA has members 9, 8, and 0.
-        cursor = self.db.cursor()
-        cursor.execute('INSERT into group_members values (?, ?)',
-                       ('groupA',
-                        json.dumps(['member9', 'member8', 'member0'])))
-        self.db.commit()
+        self.insert_mock_group('groupA', ['member9', 'member8', 'member0'])
 
         # Save members of groupA as members 0 and 1.
         expected_members = ['member0', 'member1']
@@ -118,11 +130,14 @@ class SQLiteStoreTestCase(unittest.TestCase):
             store.save_group_members('groupA', expected_members)
 
         # Assert that groupA's membership is 0 and 1.
+        cursor = self.db.cursor()
         cursor.execute('''
             SELECT member_ids from group_members WHERE group_id = 'groupA'
         ''')
         saved_members = json.loads(cursor.fetchone()[0])
         self.assertCountEqual(expected_members, saved_members)
+        self.assertCountEqual(expected_members,
+                              self.fetch_saved_memberships('groupA'))
 
     def test_fetch_members_of_group(self):
         # Initial State: 3 groups with overlapping membership
@@ -224,16 +239,17 @@ class SQLiteStoreTestCase(unittest.TestCase):
         with self.store as store:
             store.create_group_messages('groupA', expected_message)
 
-        # Assert that groupA has message id 0 with body.
-        cursor = self.db.cursor()
-        cursor.execute('''
-            SELECT id, from_address, body from group_messages
-                WHERE group_id = 'groupA'
-        ''')
-        saved_message = cursor.fetchone()
-        self.assertEqual(expected_message['id'], saved_message[0])
-        self.assertEqual('foo@bar.com', saved_message[1])
-        self.assertEqual(expected_message['body'], saved_message[2])
+            # Assert that groupA has message id 0 with body.
+            cursor = self.db.cursor()
+            cursor.execute('''
+                SELECT id, from_address from group_messages
+                    WHERE group_id = 'groupA'
+            ''')
+            saved_message = cursor.fetchone()
+            self.assertEqual(expected_message['id'], saved_message[0])
+            self.assertEqual('foo@bar.com', saved_message[1])
+            self.assertEqual(expected_message['body'].encode('utf-8'),
+                             store.fetch_group_message_body('message0'))
 
     def test_create_group_messages_multiple_ids(self):
         # Initial state: No message IDs.
@@ -263,7 +279,9 @@ class SQLiteStoreTestCase(unittest.TestCase):
         # Assert that creating messages 0 and 1 leaves message 0 untouched and
         # message 1 is created
         with self.store as store:
-            store.create_group_messages('groupA', ['message0', 'message1'])
+            counts = store.create_group_messages('groupA',
+                                                 ['message0', 'message1'])
+        self.assertEqual((1, 1), counts)
 
         cursor = self.db.cursor()
         cursor.execute('''
@@ -277,6 +295,32 @@ class SQLiteStoreTestCase(unittest.TestCase):
         saved_message = cursor.fetchone()
         self.assertEqual('message1', saved_message[0])
 
+    def test_create_group_messages_mixed(self):
+        # Initial state: Message 0 of Group A exists.
+        self.populate_mock_messages('groupA', 'message0')
+
+        # Create messages with and without bodies, including duplicates
+        with self.store as store:
+            counts = store.create_group_messages('groupA', [
+                'message0',
+                'message1',
+                {'id': 'message2', 'body': "From: Two <two@sender.com>\n\n2"},
+                'message1',
+                {'id': 'message0', 'body': "From: Zero <zero@sender.com>\n\n"}
+            ])
+
+        # Assert that only messages 1 and 2 were inserted
+        self.assertEqual((2, 3), counts)
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT id, from_address from group_messages
+            WHERE group_id = 'groupA'
+        ''')
+        self.assertCountEqual([('message0', None),
+                               ('message1', None),
+                               ('message2', 'two@sender.com')],
+                              cursor.fetchall())
+
     def test_update_message_of_group(self):
         # Initial state: Message 0 of Group A exists.
         self.populate_mock_messages('groupA', 'message0')
@@ -289,17 +333,77 @@ class SQLiteStoreTestCase(unittest.TestCase):
                 'body': mock_body
             })
 
-        # Assert that message 0 of group A was updated.
-        cursor = self.db.cursor()
-        cursor.execute('''
-            SELECT id, group_id, from_address, body from group_messages
-            WHERE id = 'message0'
-        ''')
-        saved_message = cursor.fetchone()
-        self.assertEqual('message0', saved_message[0])
-        self.assertEqual('groupA', saved_message[1])
-        self.assertEqual('sender@domain.com', saved_message[2])
-        self.assertEqual(mock_body, saved_message[3])
+            # Assert that message 0 of group A was updated.
+            cursor = self.db.cursor()
+            cursor.execute('''
+                SELECT id, group_id, from_address from group_messages
+                WHERE id = 'message0'
+            ''')
+            saved_message = cursor.fetchone()
+            self.assertEqual('message0', saved_message[0])
+            self.assertEqual('groupA', saved_message[1])
+            self.assertEqual('sender@domain.com', saved_message[2])
+            self.assertEqual(mock_body.encode('utf-8'),
+                             store.fetch_group_message_body('message0'))
+
+    def test_update_message_of_group_bytes(self):
+        # Initial state: Message 0 of Group A exists.
+        self.populate_mock_messages('groupA', 'message0')
+
+        # Update message 0 of group A with a raw body
+        mock_body = "From: Se\xf1or <sender@domain.com>\n\nMock" \
+            .encode('latin-1')
+        with self.store as store:
+            store.update_group_messages({
+                'id': 'message0',
+                'body': mock_body
+            })
+
+            # Assert that the body is read back as the bytes received
+            cursor = self.db.cursor()
+            cursor.execute('''
+                SELECT from_address, typeof(body) from group_messages
+                WHERE id = 'message0'
+            ''')
+            self.assertEqual(('sender@domain.com', 'blob'), cursor.fetchone())
+            self.assertEqual(mock_body,
+                             store.fetch_group_message_body('message0'))
+
+    def test_fetch_group_message_body_uncompressed(self):
+        # Initial state: Message 0 of Group A has a body saved before bodies
+        # were compressed, and message 1 has none.
+        mock_body = "From: Sender <sender@domain.com>\n\nMock"
+        self.populate_mock_messages('groupA', [
+            {'id': 'message0', 'body': mock_body},
+            'message1'
+        ])
+
+        # Assert that the body is read as it was saved
+        with self.store as store:
+            self.assertEqual(mock_body,
+                             store.fetch_group_message_body('message0'))
+            self.assertIsNone(store.fetch_group_message_body('message1'))
+            self.assertIsNone(store.fetch_group_message_body('message2'))
+
+    def test_fetch_sample_group_message_bodies(self):
+        # Initial state: Messages 0 to 9 of Group A, of which the odd ones
+        # have bodies
+        self.populate_mock_messages('groupA', [
+            {'id': 'message%i' % i,
+             'body': 'From: <s@domain.com>\n\n%i' % i if i % 2 else None}
+            for i in range(10)])
+        bodies = ['From: <s@domain.com>\n\n%i' % i for i in range(1, 10, 2)]
+
+        # Assert that samples are distinct bodies, and that asking for more
+        # than there are fetches every body
+        with self.store as store:
+            sample = store.fetch_sample_group_message_bodies(3)
+            self.assertLessEqual(len(sample), 3)
+            self.assertEqual(len(sample), len(set(sample)))
+            self.assertTrue(set(sample) <= set(bodies))
+            self.assertEqual(bodies,
+                             store.fetch_sample_group_message_bodies(100))
+            self.assertEqual([], store.fetch_sample_group_message_bodies(0))
 
     def test_update_messages_of_group(self):
         # Initial state: Message 0 and 1 of Group A exists.
@@ -319,25 +423,83 @@ class SQLiteStoreTestCase(unittest.TestCase):
         with self.store as store:
             store.update_group_messages(message_updates)
 
-        # Assert that body of message 0 and 1 were updated, and that group was
-        # not.
-        cursor = self.db.cursor()
-        cursor.execute('''
-            SELECT id, group_id, from_address, body from group_messages
-            WHERE id in ('message0', 'message1')
-            ORDER BY id ASC
-        ''')
-        saved_messages = cursor.fetchall()
-        self.assertCountEqual([m['id'] for m in message_updates],
-                              [m[0] for m in saved_messages])
-        for saved_message in saved_messages:
-            self.assertEqual('groupA', saved_message[1])
-        self.assertCountEqual(['sender@zero.com', 'sender@one.com'],
-                              [m[2] for m in saved_messages])
-        self.assertCountEqual([m['body'] for m in message_updates],
-                              [m[3] for m in saved_messages])
+            # Assert that body of message 0 and 1 were updated, and that group
+            # was not.
+            cursor = self.db.cursor()
+            cursor.execute('''
+                SELECT id, group_id, from_address from group_messages
+                WHERE id in ('message0', 'message1')
+                ORDER BY id ASC
+            ''')
+            saved_messages = cursor.fetchall()
+            self.assertCountEqual([m['id'] for m in message_updates],
+                                  [m[0] for m in saved_messages])
+            for saved_message in saved_messages:
+                self.assertEqual('groupA', saved_message[1])
+            self.assertCountEqual(['sender@zero.com', 'sender@one.com'],
+                                  [m[2] for m in saved_messages])
+            self.assertCountEqual(
+                [m['body'].encode('utf-8') for m in message_updates],
+                [store.fetch_group_message_body(m[0])
+                 for m in saved_messages])
+
+    def test_iter_empty_group_messages(self):
+        # Initial state: Message 0, 1 and 3 exist and are empty, message 2
+        # exists and has a from_address and body.
+        self.populate_mock_messages('group_id', [
+            'message0',
+            'message1',
+            {
+                'id': 'message2',
+                'body': "From: Existance <anExistant@sender.com>\n\nSomething!"
+            },
+            'message3'
+        ])
+
+        # Assert that messages 0, 1 and 3 are found, across several pages
+        with self.store as store:
+            self.assertEqual([
+                ('message0', 'group_id'),
+                ('message1', 'group_id'),
+                ('message3', 'group_id')
+            ], list(store.iter_empty_group_messages(page_size=2)))
+
+    def test_iter_empty_group_messages_during_updates(self):
+        # Initial state: Messages 0, 1 and 2 exist and are empty.
+        self.populate_mock_messages('group_id',
+                                    ['message0', 'message1', 'message2'])
+
+        # Fill in message 1 after iteration has started
+        with self.store as store:
+            messages = store.iter_empty_group_messages(page_size=1)
+            self.assertEqual(('message0', 'group_id'), next(messages))
+            store.update_group_messages({
+                'id': 'message1',
+                'body': "From: One <one@sender.com>\n\n1"
+            })
+
+            # Assert that the filled in message is no longer found
+            self.assertEqual([('message2', 'group_id')], list(messages))
+
+    def test_filter_empty_group_messages(self):
+        # Initial state: Message 0 exists and is empty, message 1 exists and
+        # has a from_address and body.
+        self.populate_mock_messages('group_id', [
+            'message0',
+            {
+                'id': 'message1',
+                'body': "From: Existance <anExistant@sender.com>\n\nSomething!"
+            }
+        ])
+
+        # Assert that empty and unknown messages are kept, in order
+        with self.store as store:
+            self.assertEqual(['message2', 'message0'],
+                             store.filter_empty_group_messages(
+                                 ['message2', 'message1', 'message0']))
+            self.assertEqual([], store.filter_empty_group_messages([]))
 
-    def test_fetch_empty_group_messages(self):
+    def test_count_empty_group_messages(self):
         # Initial state: Message 0 and 1 exist and are empty, message 2 exists
         # and has a from_address and body.
         self.populate_mock_messages('group_id', [
@@ -349,17 +511,206 @@ class SQLiteStoreTestCase(unittest.TestCase):
             }
         ])
 
-        # Assert that messages 0 and 1 are found
         with self.store as store:
-            self.assertCountEqual([
-                {
-                    'message_id': 'message0',
-                    'group_id': 'group_id'
-                },
-                {
-                    'message_id': 'message1',
-                    'group_id': 'group_id'
-                }], store.fetch_empty_group_messages())
+            self.assertEqual(2, store.count_empty_group_messages())
+
+    def mock_body(self, message_id, date, in_reply_to=None):
+        headers = [
+            'From: Sender <sender@domain.com>',
+            'Date: %s' % date,
+            'Message-ID: <%s@domain.com>' % message_id,
+            'Subject: =?utf-8?q?Caf=C3=A9?= meeting'
+        ]
+        if in_reply_to is not None:
+            headers.append('In-Reply-To: <%s@domain.com>' % in_reply_to)
+        return ('\n'.join(headers) + '\n\nMock').encode('utf-8')
+
+    def test_update_message_of_group_metadata(self):
+        # Initial state: Message 0 of Group A exists.
+        self.populate_mock_messages('groupA', 'message0')
+
+        # Update message 0 of group A
+        mock_body = self.mock_body('message0',
+                                   'Mon, 01 Jan 2018 00:00:00 -0000',
+                                   'message9')
+        with self.store as store:
+            store.update_group_messages({
+                'id': 'message0',
+                'body': mock_body
+            })
+
+        # Assert that the metadata of the message was derived from its body
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT posted_at, rfc_message_id, subject, in_reply_to, size
+            FROM group_messages
+            WHERE id = 'message0'
+        ''')
+        self.assertEqual((1514764800.0, 'message0@domain.com',
+                          'Caf\xe9 meeting', 'message9@domain.com',
+                          len(mock_body)),
+                         cursor.fetchone())
+
+    def test_save_group_message_metadata(self):
+        # Initial state: Message 0 of Group A has a body, but no metadata.
+        mock_body = self.mock_body('message0',
+                                   'Mon, 01 Jan 2018 00:00:00 -0000')
+        self.populate_mock_messages('groupA', {
+            'id': 'message0',
+            'body': mock_body
+        })
+
+        with self.store as store:
+            store.save_group_message_metadata(
+                [('message0', self.emu.get_message_metadata(mock_body))])
+
+        # Assert that the metadata was saved, and the body left alone
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT from_address, posted_at, rfc_message_id, body
+            FROM group_messages
+            WHERE id = 'message0'
+        ''')
+        self.assertEqual(('sender@domain.com', 1514764800.0,
+                          'message0@domain.com', mock_body),
+                         cursor.fetchone())
+
+    def test_update_message_of_group_with_metadata(self):
+        # Initial state: Message 0 of Group A exists.
+        self.populate_mock_messages('groupA', 'message0')
+
+        # Update message 0 with metadata already derived from its body
+        mock_body = "From: Sender <sender@domain.com>\n\nMock"
+        metadata = self.emu.get_message_metadata(mock_body)
+        metadata['from_address'] = 'given@domain.com'
+        with self.store as store:
+            store.update_group_messages(dict(metadata, id='message0',
+                                             body=mock_body))
+
+        # Assert that the given metadata was saved as is
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT from_address from group_messages WHERE id = 'message0'
+        ''')
+        self.assertEqual(('given@domain.com',), cursor.fetchone())
+
+    def test_fetch_group_messages_between(self):
+        # Initial state: Group A has messages posted in December, January and
+        # February, and group B has one posted in January.
+        with self.store as store:
+            store.create_group_messages('groupA', [
+                {'id': 'message1', 'body': self.mock_body(
+                    'message1', 'Wed, 10 Jan 2018 00:00:00 -0000')},
+                {'id': 'message0', 'body': self.mock_body(
+                    'message0', 'Tue, 02 Jan 2018 00:00:00 -0000')},
+                {'id': 'message2', 'body': self.mock_body(
+                    'message2', 'Thu, 01 Feb 2018 00:00:00 -0000')},
+                {'id': 'message3', 'body': self.mock_body(
+                    'message3', 'Sun, 31 Dec 2017 23:59:59 -0000')}
+            ])
+            store.create_group_messages('groupB', {
+                'id': 'message4', 'body': self.mock_body(
+                    'message4', 'Fri, 05 Jan 2018 00:00:00 -0000')})
+
+            # Assert that only group A's January messages are found, in order
+            self.assertEqual(['message0', 'message1'],
+                             store.fetch_group_messages_between(
+                                 'groupA', 1514764800, 1517443200))
+
+    def test_fetch_replies_to_message(self):
+        # Initial state: Messages 1 and 2 reply to message 0
+        with self.store as store:
+            store.create_group_messages('groupA', [
+                {'id': 'message0', 'body': self.mock_body(
+                    'message0', 'Mon, 01 Jan 2018 00:00:00 -0000')},
+                {'id': 'message2', 'body': self.mock_body(
+                    'message2', 'Wed, 03 Jan 2018 00:00:00 -0000',
+                    'message0')},
+                {'id': 'message1', 'body': self.mock_body(
+                    'message1', 'Tue, 02 Jan 2018 00:00:00 -0000',
+                    'message0')}
+            ])
+
+            self.assertEqual([('message1', 'groupA'), ('message2', 'groupA')],
+                             store.fetch_replies_to_message(
+                                 'message0@domain.com'))
+            self.assertEqual([], store.fetch_replies_to_message(
+                'message1@domain.com'))
+
+    ########################################
+    # Group Message Months
+    ########################################
+
+    def test_save_group_message_month(self):
+        # Initial state: groupA's 201801 was fetched while it was open.
+        with self.store as store:
+            store.save_group_message_month('groupA', '201801', 1000.0, False)
+
+        # Fetch it again, after it closed
+        with self.store as store:
+            store.save_group_message_month('groupA', '201801', 2000.0, True)
+            store.save_group_message_month('groupA', '201712', 2000.0, True)
+
+        # Assert that the latest fetch of each month is recorded
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT group_id, month, fetched_at, closed
+            FROM group_message_months
+        ''')
+        self.assertCountEqual([('groupA', '201801', 2000.0, 1),
+                               ('groupA', '201712', 2000.0, 1)],
+                              cursor.fetchall())
+
+    def test_create_group_messages_of_month(self):
+        # Save the messages of a closed month
+        with self.store as store:
+            self.assertEqual((2, 0), store.create_group_messages_of_month(
+                'groupA', '201712', ['message0', 'message1'], 2000.0, True))
+
+            # Assert that both the messages and the month were saved
+            self.assertEqual({'201712': (2000.0, True)},
+                             store.fetch_group_message_months('groupA'))
+            self.assertEqual(2, store.count_empty_group_messages())
+
+    def test_create_group_messages_of_month_duplicates(self):
+        # Initial state: Message 0 of Group A exists.
+        self.populate_mock_messages('groupA', 'message0')
+
+        # Save the messages of a month, one of which already exists
+        with self.store as store, \
+                self.assertLogs('backup.store.sqlite', 'INFO') as logs:
+            self.assertEqual((1, 1), store.create_group_messages_of_month(
+                'groupA', '201712', ['message0', 'message1'], 2000.0, True))
+
+        # Assert that the duplicate was counted and logged
+        self.assertEqual(['INFO:backup.store.sqlite:Saved 1 new message IDs '
+                          'of groupA in 201712, 1 already saved'],
+                         logs.output)
+
+    def test_create_group_messages_of_month_failed(self):
+        # Save the messages of a month whose record fails to save
+        with self.store as store:
+            with self.assertRaises(TypeError):
+                store.create_group_messages_of_month(
+                    'groupA', '201712', ['message0'], 2000.0, None)
+
+            # Assert that the messages were not saved without the month
+            self.assertEqual({}, store.fetch_group_message_months('groupA'))
+            self.assertEqual(0, store.count_empty_group_messages())
+
+    def test_fetch_group_message_months(self):
+        # Initial state: two months of groupA, and one of groupB, fetched.
+        with self.store as store:
+            store.save_group_message_month('groupA', '201801', 1000.0, False)
+            store.save_group_message_month('groupA', '201712', 2000.0, True)
+            store.save_group_message_month('groupB', '201801', 3000.0, True)
+
+        # Fetch and assert the months of groupA
+        with self.store as store:
+            self.assertEqual({'201801': (1000.0, False),
+                              '201712': (2000.0, True)},
+                             store.fetch_group_message_months('groupA'))
+            self.assertEqual({}, store.fetch_group_message_months('groupC'))
 
     ########################################
     # Member Profiles
@@ -406,6 +757,64 @@ class SQLiteStoreTestCase(unittest.TestCase):
         saved_profile = json.loads(cursor.fetchone()[0])
         self.assertCountEqual(expected_profile, saved_profile)
 
+    @patch('backup.store.sqlite.time.time')
+    def test_save_member_profile_unchanged(self, time):
+        # Initial state: member0's profile was saved at 1000.
+        profile = {'id': 'member0', 'attr1': 'value1'}
+        time.return_value = 1000.0
+        with self.store as store:
+            self.assertTrue(store.save_member_profile(profile))
+
+        # Save the same profile again at 2000, then a changed one at 3000
+        with self.store as store:
+            time.return_value = 2000.0
+            self.assertFalse(store.save_member_profile(dict(profile)))
+            cursor = self.db.cursor()
+            cursor.execute('''
+                SELECT profile, fetched_at from member_profiles
+            ''')
+            self.assertEqual([(json.dumps(profile), 2000.0)],
+                             cursor.fetchall())
+
+            time.return_value = 3000.0
+            self.assertTrue(store.save_member_profile(
+                {'id': 'member0', 'attr1': 'value2'}))
+
+        # Assert that the changed profile was saved
+        with self.store as store:
+            self.assertEqual({'id': 'member0', 'attr1': 'value2'},
+                             store.fetch_profile_of_member('member0'))
+
+    @patch('backup.store.sqlite.time.time')
+    def test_fetch_members_due_for_profile(self, time):
+        # Initial state: member0 and member1 were members of groupA, and had
+        # their profiles fetched at 1000 and 2000. Then member1 joined
+        # groupB, and member2 joined groupA.
+        with self.store as store:
+            time.return_value = 500.0
+            store.save_group_members('groupA', ['member0', 'member1'])
+            time.return_value = 1000.0
+            store.save_member_profile({'id': 'member0'})
+            time.return_value = 2000.0
+            store.save_member_profile({'id': 'member1'})
+            time.return_value = 2500.0
+            store.save_group_members('groupB', ['member1'])
+            store.save_group_members('groupA',
+                                     ['member0', 'member1', 'member2'])
+
+        # Assert that new members, then members that joined a group, then
+        # stale members are due
+        time.return_value = 3000.0
+        with self.store as store:
+            self.assertEqual(['member2', 'member1'],
+                             store.fetch_members_due_for_profile(2500))
+            self.assertEqual(['member2', 'member1', 'member0'],
+                             store.fetch_members_due_for_profile(1000))
+            time.return_value = 2600.0
+            store.save_member_profile({'id': 'member1'})
+            store.save_member_profile({'id': 'member2'})
+            self.assertEqual([], store.fetch_members_due_for_profile(5000))
+
     def test_save_member_profile_no_id(self):
         # Assert that saving a profile without an ID raises
         with self.assertRaises(KeyError):
@@ -430,3 +839,123 @@ class SQLiteStoreTestCase(unittest.TestCase):
         with self.store as store:
             fetched_profile = store.fetch_profile_of_member('member0')
             self.assertIsNone(fetched_profile)
+
+    ########################################
+    # Sync Journal
+    ########################################
+
+    def test_sync_runs(self):
+        # Start two runs of command0, and finish the first
+        with self.store as store:
+            self.assertIsNone(store.fetch_last_sync_run('command0'))
+            run0 = store.create_sync_run('command0')
+            store.finish_sync_run(run0)
+            run1 = store.create_sync_run('command0')
+
+        # Assert that the latest run is the last of the command
+        with self.store as store:
+            self.assertEqual(run1, store.fetch_last_sync_run('command0'))
+            self.assertEqual(run1, store.fetch_last_sync_run(
+                'command0', unfinished=True))
+            self.assertIsNone(store.fetch_last_sync_run('command1'))
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT id, finished_at IS NOT NULL from sync_runs ORDER BY id
+        ''')
+        self.assertEqual([(run0, 1), (run1, 0)], cursor.fetchall())
+
+        # Assert that a finished run is not fetched as unfinished
+        with self.store as store:
+            store.finish_sync_run(run1)
+            self.assertIsNone(store.fetch_last_sync_run(
+                'command0', unfinished=True))
+
+    def test_finish_sync_run_forgets_done_jobs(self):
+        # Initial state: run 1 has a done, b failed and c pending, and run 2
+        # has a done
+        with self.store as store:
+            store.save_sync_jobs(1, 'task', ['a', 'b', 'c'])
+            store.update_sync_job(1, 'task', 'a', 'done')
+            store.update_sync_job(1, 'task', 'b', 'failed', 'Error')
+            store.save_sync_jobs(2, 'task', ['a'])
+            store.update_sync_job(2, 'task', 'a', 'done')
+
+            # Finish run 1
+            store.finish_sync_run(1)
+
+            # Assert that only the done items of run 1 were forgotten
+            self.assertIsNone(store.fetch_sync_job_state(1, 'task', 'a'))
+            self.assertEqual(['b'],
+                             list(store.iter_sync_jobs(1, 'task', 'failed')))
+            self.assertEqual(['c'],
+                             list(store.iter_sync_jobs(1, 'task', 'pending')))
+            self.assertEqual('done', store.fetch_sync_job_state(2, 'task',
+                                                                'a'))
+
+    def test_sync_jobs(self):
+        # Initial state: items a, b and c are pending, then a is done and b
+        # failed.
+        with self.store as store:
+            store.save_sync_jobs(1, 'task', ['a', 'b', 'c'])
+            store.update_sync_job(1, 'task', 'a', 'done')
+            store.update_sync_job(1, 'task', 'b', 'failed', 'Error')
+
+            # Record a and d as pending again
+            store.save_sync_jobs(1, 'task', ['a', 'd'])
+
+            # Assert that recorded items keep their state
+            self.assertEqual('done', store.fetch_sync_job_state(1, 'task',
+                                                                'a'))
+            self.assertIsNone(store.fetch_sync_job_state(2, 'task', 'a'))
+            self.assertEqual(['c', 'd'], list(store.iter_sync_jobs(
+                1, 'task', 'pending', page_size=1)))
+            self.assertEqual(['b'],
+                             list(store.iter_sync_jobs(1, 'task', 'failed')))
+            self.assertEqual([], list(store.iter_sync_jobs(1, 'other',
+                                                           'pending')))
+
+    def test_iter_sync_jobs_through_rowid(self):
+        # Initial state: items a and b are pending, then c is recorded after
+        # the last rowid is taken
+        with self.store as store:
+            self.assertEqual(0, store.fetch_last_sync_job_rowid(1, 'task'))
+            store.save_sync_jobs(1, 'task', ['a', 'b'])
+            last_rowid = store.fetch_last_sync_job_rowid(1, 'task')
+            store.save_sync_jobs(1, 'task', ['c'])
+
+            # Assert that only the items up to the rowid are read
+            self.assertEqual(['a', 'b'], list(store.iter_sync_jobs(
+                1, 'task', 'pending', last_rowid, page_size=1)))
+
+    ########################################
+    # Transactions
+    ########################################
+
+    def test_transaction(self):
+        # Save two profiles in one transaction
+        with self.store as store:
+            with store.transaction():
+                store.save_member_profile({'id': 'member0'})
+                store.save_member_profile({'id': 'member1'})
+
+                # Assert that nothing is visible before the commit
+                cursor = self.db.cursor()
+                cursor.execute('SELECT count(*) from member_profiles')
+                self.assertEqual(0, cursor.fetchone()[0])
+
+        # Assert that both profiles were committed
+        cursor.execute('SELECT count(*) from member_profiles')
+        self.assertEqual(2, cursor.fetchone()[0])
+
+    def test_transaction_rollback(self):
+        # Fail partway through a transaction
+        with self.store as store:
+            with self.assertRaises(KeyError):
+                with store.transaction():
+                    store.save_member_profile({'id': 'member0'})
+                    store.save_member_profile({'attr': 'value'})
+
+        # Assert that nothing was committed
+        cursor = self.db.cursor()
+        cursor.execute('SELECT count(*) from member_profiles')
+        self.assertEqual(0, cursor.fetchone()[0])
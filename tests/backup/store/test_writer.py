@@ -0,0 +1,126 @@
+from backup.config import Config, ConfigKey
+import json
+import sqlite3
+import unittest
+from backup.store.writer import QueuedStore, Writer
+
+
+class WriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = sqlite3.connect(Config.get(ConfigKey.DATABASE_PATH))
+        self.writer = Writer(Config.get(ConfigKey.DATABASE_PATH),
+                             batch_size=2, flush_interval=0.01)
+
+    def tearDown(self):
+        self.clearDatabase()
+        self.db.close()
+
+    def clearDatabase(self):
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT name from sqlite_master where type = 'table'
+        ''')
+        for table in [table[0] for table in cursor
+                      if table[0] != '_yoyo_migration']:
+            cursor.execute('DELETE from %s' % table)
+        self.db.commit()
+
+    def test_submit(self):
+        # Queue writes of three groups' members, more than one batch's worth
+        with self.writer as writer:
+            futures = [writer.submit('save_group_members', group, [group])
+                       for group in ['groupA', 'groupB', 'groupC']]
+
+        # Assert that every write was committed
+        for future in futures:
+            self.assertIsNone(future.result(0))
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT group_id, member_ids from group_members
+        ''')
+        self.assertCountEqual([('groupA', ['groupA']),
+                               ('groupB', ['groupB']),
+                               ('groupC', ['groupC'])],
+                              [(g, json.loads(m)) for g, m in cursor])
+
+    def test_submit_failure(self):
+        # Queue a write that fails alongside one that succeeds, in one batch
+        with self.writer as writer:
+            failure = writer.submit('save_member_profile', {'attr': 'value'})
+            success = writer.submit('save_member_profile', {'id': 'member0'})
+
+        # Assert that only the failing write was lost
+        with self.assertRaises(KeyError):
+            failure.result(0)
+        self.assertTrue(success.result(0))
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT id from member_profiles
+        ''')
+        self.assertEqual([('member0',)], cursor.fetchall())
+
+    def test_queued_store(self):
+        # Write through a QueuedStore
+        with self.writer as writer, \
+                QueuedStore(Config.get(ConfigKey.DATABASE_PATH),
+                            writer) as store:
+            store.create_group_messages('groupA', ['message0'])
+            store.update_group_messages({
+                'id': 'message0',
+                'body': "From: Sender <sender@domain.com>\n\nMock"
+            })
+
+        # Assert that the writes were applied in the order they were made
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT id, group_id, from_address from group_messages
+        ''')
+        self.assertEqual([('message0', 'groupA', 'sender@domain.com')],
+                         cursor.fetchall())
+
+    def test_submit_nested_transaction(self):
+        # Queue a write that opens its own transaction, in a batch with a
+        # write that fails
+        with self.writer as writer:
+            month = writer.submit('create_group_messages_of_month', 'groupA',
+                                  '201712', ['message0'], 2000.0, True)
+            failure = writer.submit('save_member_profile', {})
+
+        # Assert that the write was committed whole, on its own
+        self.assertEqual((1, 0), month.result(0))
+        with self.assertRaises(KeyError):
+            failure.result(0)
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT group_id, month from group_message_months
+        ''')
+        self.assertEqual([('groupA', '201712')], cursor.fetchall())
+
+    def test_parse_processes(self):
+        # Write messages through a writer that parses them in two processes
+        message = {
+            'id': 'message1',
+            'body': b"From: Sender <sender@domain.com>\n"
+                    b"Date: Mon, 01 Jan 2018 00:00:00 -0000\n\nMock"
+        }
+        with Writer(Config.get(ConfigKey.DATABASE_PATH), batch_size=3,
+                    flush_interval=0.01, parse_processes=2) as writer:
+            writer.submit('create_group_messages', 'groupA', 'message0')
+            writer.submit('create_group_messages', 'groupA', message)
+            writer.submit('update_group_messages', {
+                'id': 'message0',
+                'body': b"From: Other <other@domain.com>\n\nMock"
+            })
+
+        # Assert that the metadata was derived, and the caller's message left
+        # alone
+        self.assertNotIn('from_address', message)
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT id, from_address, posted_at from group_messages
+            ORDER BY id
+        ''')
+        self.assertEqual([('message0', 'other@domain.com', None),
+                          ('message1', 'sender@domain.com', 1514764800.0)],
+                         cursor.fetchall())
@@ -8,6 +8,13 @@ from backup.config import Config, ConfigKey
 class ConfigTestCase(unittest.TestCase):
     def setUp(self):
         Config.config = None
+        self.environ = dict(os.environ)
+
+    def tearDown(self):
+        # Don't leak the values set by these tests into later tests
+        os.environ.clear()
+        os.environ.update(self.environ)
+        Config.config = None
 
     @patch('backup.config.Config.load', wraps=Config.load)
     def test_get_calls_load_when_needed(self, load):
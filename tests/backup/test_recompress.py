@@ -0,0 +1,94 @@
+from backup.config import Config, ConfigKey
+import sqlite3
+import unittest
+from backup.recompress import Recompress
+from backup.store.compression import zstandard
+from backup.store.sqlite import Store
+from backup.sync import Journal
+from tests.backup.store.test_compression import sample_bodies
+
+
+class RecompressTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db_path = Config.get(ConfigKey.DATABASE_PATH)
+        self.db = sqlite3.connect(self.db_path)
+        self.bodies = sample_bodies(300)
+        self.db.executemany('''
+            INSERT INTO group_messages (id, group_id, body)
+            VALUES (?, 'groupA', ?)
+        ''', [('message%03i' % i, body) for i, body in enumerate(self.bodies)])
+        self.db.execute('''
+            INSERT INTO group_messages (id, group_id)
+            VALUES ('message300', 'groupA')
+        ''')
+        self.db.commit()
+
+    def tearDown(self):
+        self.clearDatabase()
+        self.db.close()
+
+    def clearDatabase(self):
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT name from sqlite_master where type = 'table'
+        ''')
+        for table in [table[0] for table in cursor
+                      if table[0] != '_yoyo_migration']:
+            cursor.execute('DELETE from %s' % table)
+        self.db.commit()
+
+    def test_recompress(self):
+        # Compress every body, training a dictionary on them first
+        with Store(self.db_path) as store:
+            journal = Journal(store.create_sync_run('compress_messages'))
+            Recompress(self.db_path, journal, processes=1, range_size=100)()
+
+            # Assert that every body was compressed with the dictionary, if
+            # zstandard is installed, and reads back as it was
+            codec = store.get_body_codec().codec
+            self.assertEqual('zlib' if zstandard is None else
+                             'zstd:%i' % store.fetch_last_body_dictionary_id(),
+                             codec)
+            cursor = self.db.cursor()
+            cursor.execute('''
+                SELECT body_codec, count(*), sum(length(body))
+                FROM group_messages
+                GROUP BY body_codec
+                ORDER BY body_codec
+            ''')
+            (_, empty, _), (compressed_codec, compressed, size) = \
+                cursor.fetchall()
+            self.assertEqual((1, codec, 300), (empty, compressed_codec,
+                                               compressed))
+            if zstandard is not None:
+                # Only a dictionary shrinks bodies this short
+                self.assertLess(size,
+                                sum(len(body) for body in self.bodies) / 3)
+            self.assertEqual(self.bodies, [
+                store.fetch_group_message_body('message%03i' % i)
+                for i in range(300)])
+            self.assertIsNone(store.fetch_group_message_body('message300'))
+
+    @unittest.skipUnless(zstandard, 'zstandard is not installed')
+    def test_recompress_resume(self):
+        # Compress every body, then resume the run
+        with Store(self.db_path) as store:
+            run_id = store.create_sync_run('compress_messages')
+            Recompress(self.db_path, Journal(run_id), processes=1,
+                       range_size=100)()
+            store.update_sync_job(run_id, 'recompress', '[100, 200]',
+                                  'pending')
+            Recompress(self.db_path, Journal(run_id, 'resume'), processes=1,
+                       range_size=100)()
+
+            # Assert that resuming did not train another dictionary
+            self.assertEqual(1, len(self.db.execute('''
+                SELECT id FROM body_dictionaries
+            ''').fetchall()))
+            self.assertEqual('done', store.fetch_sync_job_state(
+                run_id, 'recompress', '[100, 200]'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+from backup.config import Config, ConfigKey
+import sqlite3
+import unittest
+from backup.reindex import Reindex
+from backup.store.sqlite import Store
+from backup.sync import Journal
+
+
+class ReindexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db_path = Config.get(ConfigKey.DATABASE_PATH)
+        self.db = sqlite3.connect(self.db_path)
+        self.store = Store(self.db_path)
+        self.store.__enter__()
+        self.db.executemany('''
+            INSERT INTO group_messages (id, group_id, body)
+            VALUES (?, 'groupA', ?)
+        ''', [('message%i' % i,
+               'From: Sender <sender%i@domain.com>\n\nMock' % i)
+              for i in range(1, 6)])
+        self.db.execute('''
+            INSERT INTO group_messages (id, group_id)
+            VALUES ('message6', 'groupA')
+        ''')
+        self.db.commit()
+
+    def tearDown(self):
+        self.store.__exit__(None, None, None)
+        self.clearDatabase()
+        self.db.close()
+
+    def clearDatabase(self):
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT name from sqlite_master where type = 'table'
+        ''')
+        for table in [table[0] for table in cursor
+                      if table[0] != '_yoyo_migration']:
+            cursor.execute('DELETE from %s' % table)
+        self.db.commit()
+
+    def fetch_senders(self):
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT id, from_address, size from group_messages ORDER BY id
+        ''')
+        return [(message_id, sender) for message_id, sender, size in cursor]
+
+    def test_reindex(self):
+        # Reindex every message, two rowids at a time
+        journal = Journal(self.store.create_sync_run('reindex_messages'))
+        Reindex(self.db_path, journal, processes=1, range_size=2)()
+
+        # Assert that the metadata of every message with a body was derived
+        self.assertEqual([('message1', 'sender1@domain.com'),
+                          ('message2', 'sender2@domain.com'),
+                          ('message3', 'sender3@domain.com'),
+                          ('message4', 'sender4@domain.com'),
+                          ('message5', 'sender5@domain.com'),
+                          ('message6', None)],
+                         self.fetch_senders())
+        self.assertEqual(['done'] * 3, [
+            self.store.fetch_sync_job_state(journal.run_id, 'reindex', key)
+            for key in ['[0, 2]', '[2, 4]', '[4, 6]']])
+
+    def test_reindex_missing_only(self):
+        # Give one message metadata already
+        self.db.execute('''
+            UPDATE group_messages SET from_address = 'kept@domain.com',
+                size = 1
+            WHERE id = 'message2'
+        ''')
+        self.db.commit()
+
+        # Reindex the messages missing metadata, then every message
+        journal = Journal(self.store.create_sync_run('reindex_messages'))
+        Reindex(self.db_path, journal, processes=1, range_size=2)()
+        missing = self.fetch_senders()
+        journal = Journal(self.store.create_sync_run('reindex_messages'))
+        Reindex(self.db_path, journal, processes=1, range_size=2,
+                missing_only=False)()
+
+        # Assert that only the second reindex replaced the metadata
+        self.assertEqual(('message2', 'kept@domain.com'), missing[1])
+        self.assertEqual(('message2', 'sender2@domain.com'),
+                         self.fetch_senders()[1])
+
+    def test_reindex_resume(self):
+        # Reindex every message, then forget the metadata, and mark the range
+        # of the third and fourth messages as still pending
+        run_id = self.store.create_sync_run('reindex_messages')
+        Reindex(self.db_path, Journal(run_id), processes=1, range_size=2)()
+        self.db.execute('''
+            UPDATE group_messages SET from_address = NULL, size = NULL
+        ''')
+        self.db.commit()
+        self.store.update_sync_job(run_id, 'reindex', '[2, 4]', 'pending')
+
+        # Resume the run
+        Reindex(self.db_path, Journal(run_id, 'resume'), processes=1,
+                range_size=2)()
+
+        # Assert that only the pending range was reindexed again
+        self.assertEqual([('message1', None),
+                          ('message2', None),
+                          ('message3', 'sender3@domain.com'),
+                          ('message4', 'sender4@domain.com'),
+                          ('message5', None),
+                          ('message6', None)],
+                         self.fetch_senders())
+
+
+if __name__ == '__main__':
+    unittest.main()
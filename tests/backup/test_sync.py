@@ -1,9 +1,114 @@
 from backup.config import Config, ConfigKey
+import asyncio
+import calendar
 from mock import call, patch, Mock, NonCallableMock
+import sqlite3
 import unittest
 
 from backup.client.edemocracy import EDemocracyClient
-from backup.sync import Sync, Threaded
+from backup.store.sqlite import Store
+from backup.sync import AsyncSync, Asynchronous, is_month_closed, Journal, \
+    Pipeline, Sync, Threaded
+
+
+def returning(value):
+    """Creates a coroutine function that returns the provided value."""
+    async def coroutine(*args):
+        return value
+    return coroutine
+
+
+class IsMonthClosedTestCase(unittest.TestCase):
+    def test(self):
+        end_of_january = calendar.timegm((2018, 2, 1, 0, 0, 0))
+        week = 7 * 24 * 60 * 60
+
+        self.assertFalse(is_month_closed('201801', end_of_january - 1))
+        self.assertFalse(is_month_closed('201801', end_of_january + week))
+        self.assertTrue(is_month_closed('201801', end_of_january + 2 * week))
+
+    def test_december(self):
+        end_of_december = calendar.timegm((2018, 1, 1, 0, 0, 0))
+        month = 31 * 24 * 60 * 60
+
+        self.assertFalse(is_month_closed('201712', end_of_december))
+        self.assertTrue(is_month_closed('201712', end_of_december + month))
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(Config.get(ConfigKey.DATABASE_PATH))
+        self.store = Store(Config.get(ConfigKey.DATABASE_PATH))
+
+    def tearDown(self):
+        cursor = self.db.cursor()
+        cursor.execute('DELETE from sync_jobs')
+        cursor.execute('DELETE from sync_runs')
+        self.db.commit()
+        self.db.close()
+
+    def journal_states(self, run_id):
+        cursor = self.db.cursor()
+        cursor.execute('''
+            SELECT item, state, attempts from sync_jobs WHERE run_id = ?
+        ''', (run_id,))
+        return cursor.fetchall()
+
+    def create_stopped_run(self, store):
+        # A run that stopped with item 'a' done, 'b' failed and 'c' pending
+        journal = Journal(store.create_sync_run('command'))
+        items = list(journal.sources('task', ['a', 'b', 'c'], store))
+        journal.done('task', 'a', store)
+        journal.failed('task', 'b', KeyError('b'), store)
+        return journal.run_id, items
+
+    def test_new(self):
+        with self.store as store:
+            run_id, items = self.create_stopped_run(store)
+
+        # Assert that every item was synced, and its progress journaled
+        self.assertEqual(['a', 'b', 'c'], items)
+        self.assertCountEqual([('"a"', 'done', 1),
+                               ('"b"', 'failed', 1),
+                               ('"c"', 'pending', 0)],
+                              self.journal_states(run_id))
+        cursor = self.db.cursor()
+        cursor.execute('SELECT error from sync_jobs WHERE item = \'"b"\'')
+        self.assertEqual([("KeyError: 'b'",)], cursor.fetchall())
+
+    def test_resume(self):
+        with self.store as store:
+            run_id, _ = self.create_stopped_run(store)
+
+            # Assert that only pending and unseen items are resumed
+            journal = Journal(run_id, 'resume')
+            self.assertEqual(['c', 'd'], list(journal.sources(
+                'task', ['a', 'b', 'c', 'd'], store)))
+            self.assertEqual(['c', 'd'],
+                             list(journal.backlog('task', store)))
+
+    def test_retry(self):
+        with self.store as store:
+            run_id, _ = self.create_stopped_run(store)
+
+            # Assert that only failed items are retried
+            journal = Journal(run_id, 'retry')
+            self.assertEqual(['b'], list(journal.sources(
+                'task', ['a', 'b', 'c', 'd'], store)))
+            journal.done('task', 'b', store)
+
+        self.assertIn(('"b"', 'done', 2), self.journal_states(run_id))
+
+    def test_produced(self):
+        with self.store as store:
+            run_id, _ = self.create_stopped_run(store)
+
+            # Assert that only items not already journaled are passed on
+            journal = Journal(run_id, 'resume')
+            self.assertEqual([{'month': '201801'}], journal.produced(
+                'task', ['c', {'month': '201801'}], store))
+            self.assertEqual([{'month': '201801'}],
+                             list(journal.backlog('task', store))[1:])
 
 
 class SyncTestCase(unittest.TestCase):
@@ -55,7 +160,8 @@ class SyncTestCase(unittest.TestCase):
         self.store.save_member_profile \
                   .assert_called_with(self.member_profile)
 
-    def test_message_ids_of_group_and_month(self):
+    @patch('backup.sync.time.time', return_value=1000.0)
+    def test_message_ids_of_group_and_month(self, time):
         self.client.get_messages_of_group_and_month = Mock(
             return_value=list(self.group_messages.keys())
         )
@@ -64,28 +170,114 @@ class SyncTestCase(unittest.TestCase):
             'group': 'someGroup',
             'month': '201801'},
             self.client, self.store)
-        self.store.create_group_messages \
-            .assert_called_with('someGroup', list(self.group_messages.keys()))
+        self.store.create_group_messages_of_month \
+            .assert_called_with('someGroup', '201801',
+                                list(self.group_messages.keys()), 1000.0,
+                                False)
 
     def test_message(self):
         def group_message(_, message):
             return self.group_messages[message]
         self.client.get_message_of_group = Mock(side_effect=group_message)
 
-        Sync.message({
-            'group_id': 'someGroup',
-            'message_id': 'message0'},
-            self.client, self.store)
+        Sync.message(('message0', 'someGroup'), self.client, self.store)
+        self.store.update_group_messages.assert_called_with(
+            {'id': 'message0', 'body': 'Hello'}
+        )
+
+
+class AsyncSyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = NonCallableMock()
+        self.store = NonCallableMock()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_group_members(self):
+        expected_members = ['member0', 'member1']
+        self.client.get_group_members = returning(expected_members)
+
+        self.loop.run_until_complete(
+            AsyncSync.group_members('groupA', self.client, self.store))
+        self.store.save_group_members.assert_called_with('groupA',
+                                                         expected_members)
+
+    def test_member_profiles(self):
+        profile = {'id': 'member0'}
+        self.client.get_profile_of_member = returning(profile)
+
+        self.loop.run_until_complete(
+            AsyncSync.member_profile('member0', self.client, self.store))
+        self.store.save_member_profile.assert_called_with(profile)
+
+    def test_message_ids_of_group_and_month(self):
+        self.client.get_messages_of_group_and_month = returning(
+            ['message0', 'message1'])
+
+        self.loop.run_until_complete(
+            AsyncSync.message_ids_of_group_and_month({
+                'group': 'someGroup',
+                'month': '201801'},
+                self.client, self.store))
+        args = self.store.create_group_messages_of_month.call_args[0]
+        self.assertEqual(('someGroup', '201801', ['message0', 'message1']),
+                         args[:3])
+
+    def test_new_messages_of_group_and_month(self):
+        self.client.get_messages_of_group_and_month = returning(
+            ['message0', 'message1'])
+        self.store.filter_empty_group_messages.return_value = ['message0']
+
+        self.assertEqual([('message0', 'someGroup')],
+                         self.loop.run_until_complete(
+                             AsyncSync.new_messages_of_group_and_month({
+                                 'group': 'someGroup',
+                                 'month': '201801'},
+                                 self.client, self.store)))
+        self.assertEqual(['message0', 'message1'], self.store
+                         .create_group_messages_of_month.call_args[0][2])
+
+    def test_message_months_of_group(self):
+        self.client.get_message_months_of_group = returning(
+            ['201801', '201712'])
+
+        self.assertEqual([{'group': 'someGroup', 'month': '201801'},
+                          {'group': 'someGroup', 'month': '201712'}],
+                         self.loop.run_until_complete(
+                             AsyncSync.message_months_of_group(
+                                 'someGroup', self.client, self.store)))
+
+    def test_open_message_months_of_group(self):
+        self.client.get_message_months_of_group = returning(
+            ['201801', '201712'])
+        self.store.fetch_group_message_months.return_value = {
+            '201712': (1000.0, True)
+        }
+
+        self.assertEqual([{'group': 'someGroup', 'month': '201801'}],
+                         self.loop.run_until_complete(
+                             AsyncSync.open_message_months_of_group(
+                                 'someGroup', self.client, self.store)))
+
+    def test_message(self):
+        self.client.get_message_of_group = returning('Hello')
+
+        self.loop.run_until_complete(
+            AsyncSync.message(('message0', 'someGroup'),
+                              self.client, self.store))
         self.store.update_group_messages.assert_called_with(
             {'id': 'message0', 'body': 'Hello'}
         )
 
 
 class ThreadedTestCase(unittest.TestCase):
-    @patch('time.sleep')  # Skip sleeping
-    @patch('backup.sync.Store')
+    @patch('backup.sync.Writer')
+    @patch('backup.sync.QueuedStore')
     @patch('backup.sync.EDemocracyClient')
-    def test(self, mock_client, mock_store, mock_time):
+    def test(self, mock_client, mock_store, mock_writer):
+        mock_writer.return_value.__enter__.return_value = mock_writer
         mock_store.return_value.__enter__.return_value = mock_store
         func = Mock()
         master_client = Mock()
@@ -96,7 +288,9 @@ class ThreadedTestCase(unittest.TestCase):
         threaded()
 
         # Assert that the provided function was called with a Store
-        # and EDemocracyClient
+        # and EDemocracyClient, and that every Store shares one Writer
+        mock_store.assert_called_with(Config.get(ConfigKey.DATABASE_PATH),
+                                      mock_writer)
         func.assert_has_calls(
             [call(i,
                   mock_client.return_value,
@@ -104,3 +298,247 @@ class ThreadedTestCase(unittest.TestCase):
              for i in range(10)],
             any_order=True
         )
+
+    @patch('backup.sync.Writer')
+    @patch('backup.sync.QueuedStore')
+    @patch('backup.sync.EDemocracyClient')
+    def test_streamed_items(self, mock_client, mock_store, mock_writer):
+        mock_store.return_value.__enter__.return_value = mock_store
+        func = Mock()
+
+        # Stream more items than fit in the work queue
+        threaded = Threaded(func, (i for i in range(10)), Mock(),
+                            Config.get(ConfigKey.DATABASE_PATH),
+                            total=10, max_pending=2)
+        threaded()
+
+        # Assert that every item was synced
+        self.assertEqual(10, threaded.total_count.value)
+        self.assertCountEqual([i for i in range(10)],
+                              [c[0][0] for c in func.call_args_list])
+
+    @patch('backup.sync.Writer')
+    @patch('backup.sync.QueuedStore')
+    @patch('backup.sync.EDemocracyClient')
+    def test_concurrency_limiter(self, mock_client, mock_store, mock_writer):
+        mock_store.return_value.__enter__.return_value = mock_store
+        func = Mock()
+        concurrency_limiter = Mock(maximum=4, limit=2)
+
+        # Assert that there is a worker for every request the limiter could
+        # allow in flight
+        threaded = Threaded(func, [i for i in range(10)], Mock(),
+                            Config.get(ConfigKey.DATABASE_PATH),
+                            concurrency_limiter=concurrency_limiter)
+        self.assertEqual(4, threaded.workers)
+        threaded()
+        self.assertCountEqual([i for i in range(10)],
+                              [c[0][0] for c in func.call_args_list])
+
+
+class AsynchronousTestCase(unittest.TestCase):
+    @patch('backup.sync.Writer')
+    @patch('backup.sync.QueuedStore')
+    @patch('backup.sync.AsyncEDemocracyClient')
+    def test(self, mock_client, mock_store, mock_writer):
+        mock_writer.return_value.__enter__.return_value = mock_writer
+        mock_client.return_value.__aenter__ = returning(mock_client)
+        mock_client.return_value.__aexit__ = returning(None)
+        mock_store.return_value.__enter__.return_value = mock_store
+        calls = []
+
+        async def func(item, client, store):
+            calls.append((item, client, store))
+        master_client = Mock()
+
+        # Create and call the asynchronous function
+        asynchronous = Asynchronous(func, [i for i in range(10)],
+                                    master_client,
+                                    Config.get(ConfigKey.DATABASE_PATH),
+                                    concurrency=3)
+        asynchronous()
+
+        # Assert that the provided function was called with a Store
+        # and AsyncEDemocracyClient sharing the master client's session
+        mock_client.assert_called_once_with(master_client, 3)
+        mock_store.assert_called_once_with(
+            Config.get(ConfigKey.DATABASE_PATH), mock_writer)
+        self.assertCountEqual([(i, mock_client, mock_store)
+                               for i in range(10)], calls)
+
+    @patch('backup.sync.Writer')
+    @patch('backup.sync.QueuedStore')
+    @patch('backup.sync.AsyncEDemocracyClient')
+    def test_streamed_items(self, mock_client, mock_store, mock_writer):
+        mock_client.return_value.__aenter__ = returning(mock_client)
+        mock_client.return_value.__aexit__ = returning(None)
+        items = []
+
+        async def func(item, client, store):
+            items.append(item)
+
+        # Stream more items than fit in the work queue
+        asynchronous = Asynchronous(func, (i for i in range(10)), Mock(),
+                                    Config.get(ConfigKey.DATABASE_PATH),
+                                    concurrency=3, total=10, max_pending=2)
+        asynchronous()
+
+        # Assert that every item was synced
+        self.assertEqual(10, asynchronous.current_count)
+        self.assertCountEqual([i for i in range(10)], items)
+
+    @patch('backup.sync.AsyncEDemocracyClient')
+    def test_journal_failed_write(self, mock_client):
+        mock_client.return_value.__aenter__ = returning(mock_client)
+        mock_client.return_value.__aexit__ = returning(None)
+        db_path = Config.get(ConfigKey.DATABASE_PATH)
+
+        async def func(item, client, store):
+            # Profiles without an ID fail once the writer applies them
+            store.save_member_profile({'id': item} if item % 2 else {})
+
+        with Store(db_path) as store:
+            run_id = store.create_sync_run('command')
+
+        try:
+            Asynchronous(func, [i for i in range(4)], Mock(), db_path,
+                         concurrency=2, journal=Journal(run_id))()
+
+            # Assert that the items whose writes failed were journaled as
+            # failed, though their task returned
+            with Store(db_path) as store:
+                self.assertEqual(['done', 'failed', 'done', 'failed'], [
+                    store.fetch_sync_job_state(run_id, 'func', str(i))
+                    for i in [1, 2, 3, 0]])
+        finally:
+            db = sqlite3.connect(db_path)
+            db.execute('DELETE from sync_jobs')
+            db.execute('DELETE from sync_runs')
+            db.execute('DELETE from member_profiles')
+            db.commit()
+            db.close()
+
+
+class PipelineTestCase(unittest.TestCase):
+    @patch('backup.sync.Writer')
+    @patch('backup.sync.QueuedStore')
+    @patch('backup.sync.AsyncEDemocracyClient')
+    def test(self, mock_client, mock_store, mock_writer):
+        mock_client.return_value.__aenter__ = returning(mock_client)
+        mock_client.return_value.__aexit__ = returning(None)
+        mock_store.return_value.__enter__.return_value = mock_store
+        firsts = []
+        seconds = []
+
+        async def first(item, client, store):
+            firsts.append(item)
+            if item == 3:
+                raise Exception('Failed')
+            return [item * 10, item * 10 + 1]
+
+        async def second(item, client, store):
+            seconds.append((item, client, store))
+
+        # Create and call a two stage pipeline, with a small queue between
+        # the stages
+        pipeline = Pipeline([first, second], [i for i in range(5)],
+                            Mock(), Config.get(ConfigKey.DATABASE_PATH),
+                            concurrency=2, max_pending=1)
+        pipeline()
+
+        # Assert that every item of the first stage was synced, and that
+        # the items each returned were synced by the second stage
+        self.assertCountEqual([i for i in range(5)], firsts)
+        self.assertCountEqual([(i, mock_client, mock_store)
+                               for i in [0, 1, 10, 11, 20, 21, 40, 41]],
+                              seconds)
+        self.assertEqual([5, 8], pipeline.total_counts)
+
+    @patch('backup.sync.AsyncEDemocracyClient')
+    def test_journal(self, mock_client):
+        mock_client.return_value.__aenter__ = returning(mock_client)
+        mock_client.return_value.__aexit__ = returning(None)
+        db_path = Config.get(ConfigKey.DATABASE_PATH)
+        seconds = []
+        failing = {3, 21}
+
+        async def first(item, client, store):
+            if item in failing:
+                raise Exception('Failed')
+            return [item * 10, item * 10 + 1]
+
+        async def second(item, client, store):
+            if item in failing:
+                raise Exception('Failed')
+            seconds.append(item)
+
+        with Store(db_path) as store:
+            run_id = store.create_sync_run('command')
+
+        try:
+            # Run a two stage pipeline in which some items fail
+            Pipeline([first, second], [i for i in range(5)], Mock(), db_path,
+                     concurrency=2, journal=Journal(run_id))()
+            self.assertCountEqual([0, 1, 10, 11, 20, 40, 41], seconds)
+
+            # Retry the failed items, which now succeed
+            failing.clear()
+            del seconds[:]
+            Pipeline([first, second], [i for i in range(5)], Mock(), db_path,
+                     concurrency=2, journal=Journal(run_id, 'retry'))()
+
+            # Assert that only the failed items, and the items returned by
+            # them, were synced again
+            self.assertCountEqual([21, 30, 31], seconds)
+            with Store(db_path) as store:
+                self.assertEqual([], list(store.iter_sync_jobs(
+                    run_id, 'first', 'failed')))
+                self.assertEqual(10, len(list(store.iter_sync_jobs(
+                    run_id, 'second', 'done'))))
+        finally:
+            db = sqlite3.connect(db_path)
+            db.execute('DELETE from sync_jobs')
+            db.execute('DELETE from sync_runs')
+            db.commit()
+            db.close()
+
+    @patch('backup.sync.AsyncEDemocracyClient')
+    def test_resume_backlog(self, mock_client):
+        mock_client.return_value.__aenter__ = returning(mock_client)
+        mock_client.return_value.__aexit__ = returning(None)
+        db_path = Config.get(ConfigKey.DATABASE_PATH)
+        seconds = []
+
+        async def first(item, client, store):
+            return [item * 10, item * 10 + 1]
+
+        async def second(item, client, store):
+            # Keep produced items pending while the backlog is read
+            if item < 1000:
+                await asyncio.sleep(0.5)
+            seconds.append(item)
+
+        # Initial state: a stopped run left items of the second stage
+        # pending
+        with Store(db_path) as store:
+            run_id = store.create_sync_run('command')
+            store.save_sync_jobs(run_id, 'second',
+                                 [str(i) for i in range(1000, 3500)])
+
+        try:
+            # Resume the run, producing more items of the second stage while
+            # the pending ones are still being picked back up
+            Pipeline([first, second], [i for i in range(5)], Mock(), db_path,
+                     concurrency=12, max_pending=1,
+                     journal=Journal(run_id, 'resume'))()
+
+            # Assert that every item was synced exactly once
+            self.assertEqual(sorted(list(range(1000, 3500)) +
+                                    [0, 1, 10, 11, 20, 21, 30, 31, 40, 41]),
+                             sorted(seconds))
+        finally:
+            db = sqlite3.connect(db_path)
+            db.execute('DELETE from sync_jobs')
+            db.execute('DELETE from sync_runs')
+            db.commit()
+            db.close()
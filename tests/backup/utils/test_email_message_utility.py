@@ -1,3 +1,4 @@
+import time
 import unittest
 
 from backup.utils.email_message_utility import EmailMessageUtility
@@ -18,3 +19,168 @@ Here is some body
 
         self.assertEqual(self.utility.get_sender_address(test_message),
                          'real@sender.com')
+
+    def test_get_sender_address_bytes(self):
+        test_message = '''\
+From dont@care.com Fri, 26 Jan 2018 01:23:45 +1100
+Content-Type: text/plain; charset="iso-8859-1";
+From: Se\xf1or Sender <real@sender.com>
+
+Caf\xe9
+'''.encode('latin-1')
+
+        self.assertEqual(self.utility.get_sender_address(test_message),
+                         'real@sender.com')
+
+    def test_get_sender_address_folded(self):
+        test_message = b'''\
+Subject: A subject
+ folded over two lines
+from: "A Sender With A Very Long Name"
+ <real@sender.com>
+
+Here is some body
+'''
+
+        self.assertEqual(self.utility.get_sender_address(test_message),
+                         'real@sender.com')
+
+    def test_get_sender_address_crlf(self):
+        test_message = b'To: list@e-democracy.org\r\n' \
+                       b'From: Real Sender <real@sender.com>\r\n\r\n' \
+                       b'Body\r\n'
+
+        self.assertEqual(self.utility.get_sender_address(test_message),
+                         'real@sender.com')
+
+    def test_get_sender_address_crlf_no_from(self):
+        # A CRLF message with folded headers and a malformed line, but no
+        # From header, used to take seconds to fail to match
+        test_message = b''.join(
+            b'Received: from relay%i\r\n\tby e-democracy.org\r\n' % i
+            for i in range(30)) + b'Not a header\r\n\r\nBody\r\n'
+
+        started = time.perf_counter()
+        self.assertEqual(self.utility.get_sender_address(test_message), '')
+        self.assertEqual(
+            self.utility.get_message_metadata(test_message)['from_address'],
+            '')
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+    def test_get_sender_address_encoded_words(self):
+        test_message = b'''\
+From: =?utf-8?b?UmVuw6ll?= <real@sender.com>
+
+Body
+'''
+        self.assertEqual(self.utility.get_sender_address(test_message),
+                         'real@sender.com')
+
+        test_message = b'''\
+From: =?utf-8?q?Real_Sender_<real@sender.com>?=
+
+Body
+'''
+        self.assertEqual(self.utility.get_sender_address(test_message),
+                         'real@sender.com')
+
+    def test_get_sender_address_first_from_in_headers(self):
+        test_message = b'''\
+From: first@sender.com
+From: second@sender.com
+
+From: body@sender.com
+'''
+        self.assertEqual(self.utility.get_sender_address(test_message),
+                         'first@sender.com')
+
+        test_message = b'''\
+To: list@e-democracy.org
+
+From: body@sender.com
+'''
+        self.assertEqual(self.utility.get_sender_address(test_message), '')
+
+    def test_get_sender_address_malformed(self):
+        # Headers after a line that is not a header are part of the body
+        test_message = b'''\
+Subject: A subject
+Not a header
+From: body@sender.com
+
+Body
+'''
+        self.assertEqual(self.utility.get_sender_address(test_message), '')
+        self.assertEqual(self.utility.get_sender_address(b''), '')
+
+    def test_get_sender_addresses(self):
+        self.assertEqual(
+            self.utility.get_sender_addresses([
+                b'From: one@sender.com\n\nBody\n',
+                'From: two@sender.com\n\nBody\n'
+            ]),
+            ['one@sender.com', 'two@sender.com'])
+
+    def test_get_message_metadata(self):
+        test_message = b'''\
+From dont@care.com Fri, 26 Jan 2018 01:23:45 +1100
+From: The Real Sender <real@sender.com>
+Subject: =?utf-8?q?Caf=C3=A9?= meeting,
+ folded
+Date: Fri, 26 Jan 2018 01:23:45 +1100
+Message-ID: <message1@sender.com>
+In-Reply-To: <message0@sender.com>
+ <other@sender.com>
+
+Here is some body
+'''
+
+        self.assertEqual(self.utility.get_message_metadata(test_message), {
+            'from_address': 'real@sender.com',
+            'posted_at': 1516890225.0,
+            'rfc_message_id': 'message1@sender.com',
+            'subject': 'Caf\xe9 meeting, folded',
+            'in_reply_to': 'message0@sender.com',
+            'size': len(test_message)
+        })
+
+    def test_get_message_metadata_missing_headers(self):
+        test_message = '''\
+From: real@sender.com
+Date: not a date
+Subject: Caf\xe9
+
+Body
+'''
+
+        self.assertEqual(self.utility.get_message_metadata(test_message), {
+            'from_address': 'real@sender.com',
+            'posted_at': None,
+            'rfc_message_id': None,
+            'subject': 'Caf\xe9',
+            'in_reply_to': None,
+            'size': len(test_message.encode('utf-8'))
+        })
+
+    def test_get_message_metadata_malformed(self):
+        # Headers after a line that is not a header are part of the body
+        test_message = b'''\
+Subject: A subject
+Not a header
+From: body@sender.com
+
+Body
+'''
+
+        metadata = self.utility.get_message_metadata(test_message)
+        self.assertEqual('', metadata['from_address'])
+        self.assertEqual('A subject', metadata['subject'])
+
+    def test_get_messages_metadata(self):
+        self.assertEqual(
+            [metadata['from_address'] for metadata in
+             self.utility.get_messages_metadata([
+                 b'From: one@sender.com\n\nBody\n',
+                 'From: two@sender.com\n\nBody\n'
+             ])],
+            ['one@sender.com', 'two@sender.com'])